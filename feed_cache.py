@@ -0,0 +1,150 @@
+"""Columnar on-disk cache of a parsed GTFS feed, memory-mapped by every process.
+
+The frames of one feed (``schedule_planner.prepare_feed`` output plus the
+calendars) are written once to ``<cache_dir>/<stamp>/``: one ``.npy`` file
+per numeric column and, for text columns, the dictionary codes plus the
+sorted unique values. Loading maps the numeric and code arrays read-only with
+``np.load(mmap_mode='r')``, so gunicorn workers share one copy through the
+page cache and a warm load takes milliseconds instead of a CSV parse.
+
+Text columns of the frames named in ``categorical`` stay pandas categoricals
+over the mapped codes (stop_times: a million rows of a few thousand distinct
+values); text columns of the small frames are decoded back to plain strings.
+"""
+import hashlib
+import json
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+
+# Bump when the cached frames change shape, so existing caches are rebuilt
+CACHE_FORMAT = 1
+META_FILE = 'feed.json'
+
+
+def source_stamp(folder):
+    """Stamp of the GTFS text files in ``folder`` (name, size and mtime of each)."""
+    h = hashlib.sha1(f"format{CACHE_FORMAT}".encode())
+    for name in sorted(os.listdir(folder)):
+        if name.endswith('.txt'):
+            st = os.stat(os.path.join(folder, name))
+            h.update(f"{name}:{st.st_size}:{st.st_mtime_ns};".encode())
+    return h.hexdigest()
+
+
+_FEED_VERSIONS = {}
+
+
+def feed_version(folder):
+    """Content hash of the GTFS text files in ``folder``; the same feed downloaded twice hashes equal.
+
+    Memoized on ``source_stamp``, so the files are only read again after they change.
+    """
+    stamp = source_stamp(folder)
+    version = _FEED_VERSIONS.get((folder, stamp))
+    if version is None:
+        h = hashlib.sha1()
+        for name in sorted(os.listdir(folder)):
+            if name.endswith('.txt'):
+                h.update(name.encode() + b'\0')
+                with open(os.path.join(folder, name), 'rb') as f:
+                    for block in iter(lambda: f.read(1 << 20), b''):
+                        h.update(block)
+        version = _FEED_VERSIONS[(folder, stamp)] = h.hexdigest()
+    return version
+
+
+def write_feed(cache_dir, stamp, frames, categorical=()):
+    """Writes ``frames`` (name -> DataFrame) as the cache for ``stamp`` and drops older stamps.
+
+    The files are written to a temporary directory that is renamed into
+    place; if another process got there first its copy is kept.
+    """
+    target = os.path.join(cache_dir, stamp)
+    tmp = f"{target}.{os.getpid()}.tmp"
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+
+    meta = {"stamp": stamp, "format": CACHE_FORMAT, "frames": {}}
+    for name, frame in frames.items():
+        index = frame.index.name
+        if index is not None:
+            frame = frame.reset_index()
+        columns = []
+        for i, col in enumerate(frame.columns):
+            values = frame[col]
+            base = os.path.join(tmp, f"{name}.{i}")
+            if pd.api.types.is_numeric_dtype(values) and not isinstance(values.dtype, pd.CategoricalDtype):
+                np.save(base + '.npy', values.to_numpy())
+                kind = 'num'
+            else:
+                cat = pd.Categorical(values)
+                np.save(base + '.codes.npy', cat.codes)
+                np.save(base + '.values.npy', np.asarray(cat.categories.astype(str), dtype=str))
+                kind = 'cat' if name in categorical else 'str'
+            columns.append({"name": col, "kind": kind, "file": f"{name}.{i}"})
+        meta["frames"][name] = {"columns": columns, "index": index, "rows": len(frame)}
+    with open(os.path.join(tmp, META_FILE), 'w') as f:
+        json.dump(meta, f)
+
+    try:
+        os.rename(tmp, target)
+    except OSError:
+        shutil.rmtree(tmp, ignore_errors=True)
+    for entry in os.listdir(cache_dir):
+        if entry != stamp and not entry.endswith('.tmp'):
+            # Processes that mapped an old feed keep their (unlinked) files
+            shutil.rmtree(os.path.join(cache_dir, entry), ignore_errors=True)
+
+
+def load_feed(cache_dir, stamp):
+    """name -> DataFrame over the mapped cache for ``stamp``; None when missing or unreadable."""
+    path = os.path.join(cache_dir, stamp)
+    try:
+        with open(os.path.join(path, META_FILE)) as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if meta.get("format") != CACHE_FORMAT:
+        return None
+
+    frames = {}
+    try:
+        for name, spec in meta["frames"].items():
+            data = {}
+            for col in spec["columns"]:
+                base = os.path.join(path, col["file"])
+                if col["kind"] == 'num':
+                    data[col["name"]] = np.load(base + '.npy', mmap_mode='r')
+                    continue
+                cat = pd.Categorical.from_codes(np.load(base + '.codes.npy', mmap_mode='r'),
+                                                categories=np.load(base + '.values.npy'))
+                data[col["name"]] = cat if col["kind"] == 'cat' else np.asarray(cat.astype(object))
+            frame = pd.DataFrame(data, columns=[c["name"] for c in spec["columns"]], copy=False)
+            if len(frame) != spec["rows"]:
+                raise ValueError(f"{name}: {len(frame)} rows, expected {spec['rows']}")
+            if spec["index"] is not None:
+                frame = frame.set_index(spec["index"])
+            frames[name] = frame
+    except (OSError, ValueError, KeyError) as e:
+        print(f"⚠️ Ignoring unreadable feed cache {path}: {e}")
+        return None
+    return frames
+
+
+def load_or_build(cache_dir, stamp, builder, categorical=()):
+    """The cached frames for ``stamp``, built with ``builder()`` and written first when missing."""
+    frames = load_feed(cache_dir, stamp)
+    if frames is not None:
+        return frames
+    frames = builder()
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        write_feed(cache_dir, stamp, frames, categorical)
+    except OSError as e:
+        print(f"⚠️ Could not write feed cache {cache_dir}: {e}")
+        return frames
+    print(f"💾 Feed cache written to {os.path.join(cache_dir, stamp)}.")
+    return load_feed(cache_dir, stamp) or frames
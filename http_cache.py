@@ -0,0 +1,107 @@
+"""Conditional requests (ETag / 304) and response compression for the geometry endpoints.
+
+Only views decorated with ``compressed`` (trace, coverage and tile routes) are
+compressed; every other response is left as the view built it.
+"""
+import functools
+import gzip
+import hashlib
+
+from flask import make_response, request
+
+try:
+    import brotli
+except ImportError:  # optional; gzip is always available
+    brotli = None
+
+COMPRESS_MIN_SIZE = 1024
+COMPRESS_MIMETYPES = (
+    'application/json',
+    'application/vnd.treinfo.polyline+json',
+    'application/vnd.treinfo.delta+json',
+    'application/x-protobuf',
+    'application/vnd.mapbox-vector-tile',
+)
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+# Appended to the ETag of a compressed body: every representation gets its own strong tag
+_ENCODING_SUFFIX = {'gzip': '-gz', 'br': '-br'}
+
+
+def make_etag(*parts):
+    """Strong ETag value from the parts that fully determine a response."""
+    h = hashlib.sha1()
+    for part in parts:
+        h.update(repr(part).encode('utf-8'))
+        h.update(b'\x1f')
+    return h.hexdigest()
+
+
+def is_not_modified(etag):
+    """True when the request's If-None-Match already names ``etag`` (in any encoding)."""
+    inm = request.if_none_match
+    if not inm:
+        return False
+    return any(inm.contains(etag + suffix) for suffix in ('',) + tuple(_ENCODING_SUFFIX.values())) or inm.star_tag
+
+
+def conditional(response, etag, cache_control):
+    """Stamps ETag and Cache-Control on ``response`` (a 200 or an empty 304)."""
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = cache_control
+    return response
+
+
+def _choose_encoding():
+    accepted = request.accept_encodings
+    if brotli is not None and accepted['br']:
+        return 'br'
+    if accepted['gzip']:
+        return 'gzip'
+    return None
+
+
+def _not_modified_encoding(response):
+    """A 304 carries the validator and Vary of the representation the client revalidated."""
+    response.vary.add('Accept-Encoding')
+    etag, weak = response.get_etag()
+    encoding = _choose_encoding()
+    if etag and encoding and request.if_none_match.contains(etag + _ENCODING_SUFFIX[encoding]):
+        response.set_etag(etag + _ENCODING_SUFFIX[encoding], weak)
+    return response
+
+
+def compress_response(response):
+    """gzip/brotli large JSON, protobuf and tile bodies; 304s get the matching encoded ETag."""
+    if response.status_code == 304:
+        return _not_modified_encoding(response)
+    if (response.status_code != 200 or response.direct_passthrough or response.is_streamed
+            or 'Content-Encoding' in response.headers
+            or response.mimetype not in COMPRESS_MIMETYPES):
+        return response
+    response.vary.add('Accept-Encoding')
+    data = response.get_data()
+    if len(data) < COMPRESS_MIN_SIZE:
+        return response
+    encoding = _choose_encoding()
+    if encoding is None:
+        return response
+
+    if encoding == 'br':
+        body = brotli.compress(data, quality=BROTLI_QUALITY)
+    else:
+        body = gzip.compress(data, compresslevel=GZIP_LEVEL)
+    response.set_data(body)
+    response.headers['Content-Encoding'] = encoding
+    etag, weak = response.get_etag()
+    if etag:
+        response.set_etag(etag + _ENCODING_SUFFIX[encoding], weak)
+    return response
+
+
+def compressed(view):
+    """Route decorator: runs ``compress_response`` on the view's response."""
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        return compress_response(make_response(view(*args, **kwargs)))
+    return wrapper
@@ -1,23 +1,26 @@
 import os
 import base64
 import threading
+import multiprocessing
 import re
 import time
 import pandas as pd
 import requests
 import zipfile
 import io
+import itertools
+import hashlib
 import locale
 from datetime import datetime, timedelta
 import shutil
 import sqlite3
 from flask import Flask, render_template, render_template_string, request, redirect, url_for, session, jsonify, make_response, send_from_directory
 from flask_sqlalchemy import SQLAlchemy
-from sqlalchemy import or_, and_, event, Engine, UniqueConstraint, text
+from sqlalchemy import or_, and_, event, Engine, UniqueConstraint, text, bindparam
 from sqlalchemy.orm import aliased
+from sqlalchemy.dialects import postgresql, sqlite
 from google.transit import gtfs_realtime_pb2
 import json
-import heapq
 import werkzeug.security
 import math
 import secrets
@@ -25,8 +28,17 @@ import uuid
 import smtplib
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
-
-RAILWAY_GRAPH = {}
+from railway_graph import CompiledGraph, GraphManager, GraphWarmingError, LRUCache, haversine_km, snapshot_or_build, tolerance_for_zoom, \
+    GEOMETRY_TOLERANCES, METERS_PER_PIXEL_Z0
+from trace_geometry import FORMATS, LAYOUTS, encode_trace, merge_trace, negotiate_format
+import vector_tiles
+import http_cache
+import schedule_planner
+import schedule_loader
+import feed_cache
+from stations import StationResolver, station_hierarchy, station_key
+from station_search import StationSearchIndex
+from spatial_index import PointIndex
 
 # ==========================================
 # CONFIGURATIE
@@ -39,6 +51,45 @@ STATIC_URL = "https://sncb-opendata.hafas.de/gtfs/static/d22ad6759ee25bg84ddb6c8
 API_DELAY_SECONDS = 1.5  
 MAX_API_CALLS_PER_RUN = 100 
 
+# Shortest-path algorithm for find_path: 'dijkstra', 'astar', 'bidirectional' or 'ch'
+# ('ch' preprocesses a contraction hierarchy after every graph build)
+ROUTING_MODE = os.environ.get('ROUTING_MODE', 'astar')
+
+# Stop-pair path cache: in-process LRU in front of the shared stop_pair_paths table
+PATH_CACHE_SIZE = int(os.environ.get('PATH_CACHE_SIZE', '20000'))
+PERSIST_PATHS = os.environ.get('PERSIST_PATHS', '1') == '1'
+
+# GTFS stops further than this from every operational point stay unmapped (ensure_infrabel_data)
+AUTO_MAPPING_RADIUS_KM = float(os.environ.get('AUTO_MAPPING_RADIUS_KM', '0.2'))
+
+# Station reference data is held in memory; other processes' edits are picked up after this many seconds
+STATION_RESOLVER_CHECK_SECONDS = float(os.environ.get('STATION_RESOLVER_CHECK_SECONDS', '60'))
+
+# Trace cache, filled on demand and by the pre-warm stage after each schedule sync
+TRACE_CACHE_SIZE = int(os.environ.get('TRACE_CACHE_SIZE', '5000'))
+PREWARM_TRACES = os.environ.get('PREWARM_TRACES', '1') == '1'
+PREWARM_PAUSE = float(os.environ.get('PREWARM_PAUSE', '0.005'))
+
+# Trains per COPY/upsert transaction when a day is written to the database
+SYNC_CHUNK_TRAINS = int(os.environ.get('SYNC_CHUNK_TRAINS', '500'))
+# Processes that plan the days of a window sync in parallel (spawned, mapping the feed cache; 1 = plan in-process)
+SYNC_WORKERS = int(os.environ.get('SYNC_WORKERS', str(min(4, os.cpu_count() or 1))))
+
+# Parsed GTFS feed as memory-mapped columns, shared by every worker (empty = parse the csv files)
+FEED_CACHE_DIR = os.environ.get('FEED_CACHE_DIR', '' if os.environ.get('FLASK_TESTING') else 'feed_cache')
+
+# On-disk vector tile cache, one directory per graph version (empty = no disk cache)
+TILE_CACHE_DIR = os.environ.get('TILE_CACHE_DIR', '' if os.environ.get('FLASK_TESTING') else 'tile_cache')
+
+# Browser/proxy cache lifetime (seconds) of geometry responses; ETags revalidate after that
+TRACE_MAX_AGE = int(os.environ.get('TRACE_MAX_AGE', '300'))
+TILE_MAX_AGE = int(os.environ.get('TILE_MAX_AGE', '3600'))
+
+# Compiled graph snapshot, memory-mapped by every process (empty = always build in-process)
+GRAPH_SNAPSHOT_PATH = os.environ.get(
+    'GRAPH_SNAPSHOT_PATH',
+    '' if os.environ.get('FLASK_TESTING') else os.path.join(DATA_FOLDER, 'railway_graph.snap'))
+
 app = Flask(__name__)
 app.secret_key = os.environ.get('SECRET_KEY', 'trein_secret_key_v10')
 app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get(
@@ -59,6 +110,8 @@ app.config.update(
 db = SQLAlchemy(app)
 
 static_data = {}
+# Feed cache stamp static_data was mapped from (None = parsed from the csv files)
+STATIC_FEED_STAMP = None
 LAST_UPDATE_TIMESTAMP = None 
 
 # Per-train lock for composition fetching to avoid SQL Errors during concurrent requests
@@ -142,6 +195,8 @@ class TrainStop(db.Model):
     arrival_time = db.Column(db.String(20))
     departure_time = db.Column(db.String(20))
     stop_sequence = db.Column(db.Integer, index=True)
+    infrabel_id = db.Column(db.String(50), index=True) # Resolved at sync time (NULL = not mapped)
+    station_id = db.Column(db.String(50), index=True) # Canonical station of a platform-level stop_id
 
     __table_args__ = (
         UniqueConstraint('train_id', 'stop_sequence', name='_train_stop_seq_uc'),
@@ -221,6 +276,7 @@ class SystemStatus(db.Model):
     __tablename__ = 'system_status'
     key = db.Column(db.String(50), primary_key=True)
     updated_at = db.Column(db.DateTime)
+    value = db.Column(db.String(100)) # e.g. feed version, or the schedule version a day was imported with
 
 class StopTranslation(db.Model):
     __tablename__ = 'stop_translations'
@@ -230,193 +286,497 @@ class StopTranslation(db.Model):
     lang = db.Column(db.String(5))
     translation = db.Column(db.String(200))
 
+class StopPairPath(db.Model):
+    __tablename__ = 'stop_pair_paths'
+    from_id = db.Column(db.String(50), primary_key=True)
+    to_id = db.Column(db.String(50), primary_key=True)
+    graph_version = db.Column(db.String(40), primary_key=True)
+    segment_ids = db.Column(db.Text) # JSON list, "null" when unreachable
+
 # ==========================================
 # 3. HELPER: TRACING & MAPPING
 # ==========================================
+# HARDCODED MISSING HUBS (Data cleanup): (name contains, unless name contains, infrabel_id)
+STATION_OVERRIDES = [
+    ('lokeren', None, 'FLK'),
+    ('zwijndrecht', None, 'FZW'),
+    ('bevers', None, 'FBV'), # Beveren
+    ('antwerpen-centraal', None, 'FN'),
+    ('berchem', None, 'FCV'), # Antwerp-Berchem
+    ('sint-niklaas', None, 'FSN'),
+    ('gent-sint-pieters', None, 'FGSP'),
+    ('gent-dampoort', None, 'FGDM'),
+    ('gentbrugge', None, 'FUGE'),
+    # HSL FIX: Map Leuven to FLV (Leuven Vorming/Main HSL Node) instead of FL (Broken)
+    ('leuven', 'heverlee', 'FLV'),
+    # PEPINSTER FIX: Ensure Pepinster maps to FPS, not FPSC (Cite)
+    ('pepinster', 'cit', 'FPS'),
+]
+
+STATION_RESOLVER = None
+STATION_RESOLVER_STAMP = None
+STATION_RESOLVER_CHECKED = 0.0
+STATION_RESOLVER_LOCK = threading.Lock()
+# Resolver version the infrabel_id values stored on train_stops were resolved with (SystemStatus)
+STOP_NODES_STATUS = 'stop_nodes_version'
+STOP_NODES_VERSION = None
+
+def station_data_stamp():
+    """Cheap fingerprint of the station reference tables (aggregates only)."""
+    parts = [
+        db.session.query(db.func.count(StationMapping.sncb_id), db.func.max(StationMapping.sncb_id)).one(),
+        db.session.query(db.func.count(StopTranslation.id), db.func.max(StopTranslation.id)).one(),
+        db.session.query(db.func.count(InfrabelOperationalPoint.id), db.func.max(InfrabelOperationalPoint.id)).one(),
+    ]
+    return ':'.join(f"{count or 0}-{top or ''}" for count, top in parts)
+
+def load_station_resolver(stamp=None):
+    """StationResolver over the current tables; its version is ``stamp`` plus a hash of the rows read.
+
+    The stamp only sees rows added or removed, the hash also covers tables
+    that were rewritten with the same number of rows (delete + insert).
+    """
+    t0 = time.time()
+    mappings = [tuple(r) for r in db.session.query(StationMapping.sncb_id, StationMapping.infrabel_id)
+                .order_by(StationMapping.sncb_id).all()]
+    translations = [tuple(r) for r in db.session.query(
+        StopTranslation.stop_id, StopTranslation.field_value, StopTranslation.translation)
+        .order_by(StopTranslation.id).all()]
+    points = [tuple(r) for r in db.session.query(
+        InfrabelOperationalPoint.id, InfrabelOperationalPoint.ptcar_id,
+        InfrabelOperationalPoint.latitude, InfrabelOperationalPoint.longitude,
+        InfrabelOperationalPoint.name_nl, InfrabelOperationalPoint.name_fr)
+        .order_by(InfrabelOperationalPoint.id).all()]
+    content = hashlib.sha1(repr((mappings, translations, points, STATION_OVERRIDES)).encode()).hexdigest()
+    resolver = StationResolver(mappings, translations, points, overrides=STATION_OVERRIDES,
+                               version=f"{stamp or station_data_stamp()}:{content[:16]}")
+    print(f"🚉 Station resolver loaded ({len(resolver)} mappings, {len(resolver.coords)} points) in {time.time() - t0:.2f}s.")
+    return resolver
+
+def station_resolver():
+    """The StationResolver for the current reference data.
+
+    Reloaded after invalidate_station_resolver() or when another process
+    changed the tables (stamp checked at most every STATION_RESOLVER_CHECK_SECONDS).
+    """
+    global STATION_RESOLVER, STATION_RESOLVER_STAMP, STATION_RESOLVER_CHECKED, STOP_NODES_VERSION
+    resolver = STATION_RESOLVER
+    if resolver is not None and time.time() - STATION_RESOLVER_CHECKED < STATION_RESOLVER_CHECK_SECONDS:
+        return resolver
+    with STATION_RESOLVER_LOCK:
+        stamp = station_data_stamp()
+        if STATION_RESOLVER is None or STATION_RESOLVER_STAMP != stamp:
+            STATION_RESOLVER = load_station_resolver(stamp)
+            STATION_RESOLVER_STAMP = stamp
+        STOP_NODES_VERSION = get_status(STOP_NODES_STATUS)
+        STATION_RESOLVER_CHECKED = time.time()
+        return STATION_RESOLVER
+
+def invalidate_station_resolver():
+    """Call after writing StationMapping / StopTranslation / InfrabelOperationalPoint rows.
+
+    The stored train_stops.infrabel_id values are ignored from then on until
+    restamp_stop_nodes() has re-resolved them with the new mapping.
+    """
+    global STATION_RESOLVER, STATION_SEARCH
+    STATION_RESOLVER = None
+    STATION_SEARCH = None
+    TRACE_CACHE.clear() # traces depend on the stop mapping
+
+STATION_SEARCH = None
+STATION_SEARCH_CHECKED = 0.0
+
+def load_station_search(stamp):
+    t0 = time.time()
+    importance = dict(db.session.query(TrainStop.stop_id, db.func.count(TrainStop.id)).group_by(TrainStop.stop_id).all())
+    index = StationSearchIndex(
+        db.session.query(StopTranslation.stop_id, StopTranslation.field_value, StopTranslation.lang,
+                         StopTranslation.translation).order_by(StopTranslation.id).all(),
+        importance=importance,
+        version=stamp,
+    )
+    print(f"🔎 Station search index loaded ({len(index)} stations) in {time.time() - t0:.2f}s.")
+    return index
+
+def station_search():
+    """The StationSearchIndex for the current translations (same refresh rules as station_resolver)."""
+    global STATION_SEARCH, STATION_SEARCH_CHECKED
+    index = STATION_SEARCH
+    if index is not None and time.time() - STATION_SEARCH_CHECKED < STATION_RESOLVER_CHECK_SECONDS:
+        return index
+    with STATION_RESOLVER_LOCK:
+        stamp = station_data_stamp()
+        if STATION_SEARCH is None or STATION_SEARCH.version != stamp:
+            STATION_SEARCH = load_station_search(stamp)
+        STATION_SEARCH_CHECKED = time.time()
+        return STATION_SEARCH
+
+def matched_station_keys(stations):
+    return sorted({station_key(sid) for st in stations for sid in st.stop_ids})
+
+def station_name_filter(stop, query, stations=None):
+    """SQL filter on a TrainStop (or alias) for the stations whose name contains ``query``.
+
+    Matches the indexed station_id (covers every platform of the station) or
+    the official name; falls back to ILIKE on the stop name when no station matches.
+    """
+    if stations is None:
+        stations = station_search().matching(query)
+    if not stations:
+        return stop.stop_name.ilike(f"%{query}%")
+    return or_(stop.station_id.in_(matched_station_keys(stations)),
+               stop.stop_name.in_([st.name for st in stations]))
+
 def get_infrabel_id(sncb_stop_id, stop_name=None):
     """Maps sncb_id -> infrabel_id more robustly."""
-    if not sncb_stop_id: return None
-    
-    # HARDCODED MISSING HUBS (Data cleanup)
-    if stop_name:
-        lname = stop_name.lower()
-        if 'lokeren' in lname: return 'FLK'
-        if 'zwijndrecht' in lname: return 'FZW'
-        if 'bevers' in lname: return 'FBV' # Beveren
-        if 'antwerpen-centraal' in lname: return 'FN'
-        if 'berchem' in lname: return 'FCV' # Antwerp-Berchem
-        if 'sint-niklaas' in lname: return 'FSN'
-        if 'gent-sint-pieters' in lname: return 'FGSP'
-        if 'gent-dampoort' in lname: return 'FGDM'
-        if 'gentbrugge' in lname: return 'FUGE'
-        if 'gentbrugge' in lname: return 'FUGE'
-        # HSL FIX: Map Leuven to FLV (Leuven Vorming/Main HSL Node) instead of FL (Broken)
-        if 'leuven' in lname and 'heverlee' not in lname: return 'FLV'
-        
-        # PEPINSTER FIX: Ensure Pepinster maps to FPS, not FPSC (Cite)
-        if 'pepinster' in lname and 'cit' not in lname: return 'FPS'
+    return station_resolver().resolve(sncb_stop_id, stop_name)
 
-    # 1. Direct try
-    cand = StationMapping.query.filter_by(sncb_id=sncb_stop_id).first()
-    if cand: 
-        return cand.infrabel_id
-    
-    # 2. Try with/without 'S' prefix
-    alt_id = sncb_stop_id[1:] if sncb_stop_id.startswith('S') else f"S{sncb_stop_id}"
-    cand = StationMapping.query.filter_by(sncb_id=alt_id).first()
-    if cand: return cand.infrabel_id
-    
-    # 3. Try splitting old SNCB:123:0 format
-    clean_numeric = ''.join(filter(str.isdigit, sncb_stop_id))
-    # We expect at least a decent length for an ID
-    if len(clean_numeric) > 4:
-        cand = StationMapping.query.filter(StationMapping.sncb_id.like(f"%{clean_numeric}%")).first()
-        if cand: return cand.infrabel_id
-
-    # 4. Name Fallback (Last Resort)
-    if stop_name:
-        clean_name = stop_name.lower().replace('-', ' ').replace('/', ' ')
-        trans = StopTranslation.query.filter(
-            or_(
-                StopTranslation.translation.ilike(f"%{clean_name}%"),
-                StopTranslation.field_value.ilike(f"%{clean_name}%")
-            )
-        ).first()
-        if trans and trans.stop_id != sncb_stop_id:
-            return get_infrabel_id(trans.stop_id, None) # Recursion without name to avoid infinite loop
-            
-    return None
+def stop_infrabel_ids(stops):
+    """Infrabel ids for TrainStop rows: the id stored at sync, else resolved now.
 
-def build_railway_graph():
-    """Builds an adjacency list from InfrabelStationToStation segments using Haversine weights."""
-    global RAILWAY_GRAPH
-    try:
-        with app.app_context():
-            print("🛠️  Building railway graph...")
+    Stored ids are only used while they were resolved with the current
+    mapping version (see restamp_stop_nodes); otherwise every stop is resolved
+    again, with the same fallback to its station as at sync time.
+    """
+    resolver = station_resolver()
+    if STOP_NODES_VERSION == resolver.version:
+        stored = [getattr(s, 'infrabel_id', None) for s in stops]
+    else:
+        stored = [None] * len(stops)
+    missing = [s for s, node in zip(stops, stored) if not node]
+    resolved = iter(resolver.resolve_many([s.stop_id for s in missing], [s.stop_name for s in missing],
+                                          [getattr(s, 'station_id', None) or station_key(s.stop_id) for s in missing]))
+    return [node or next(resolved) for node in stored]
+
+def stop_node_table(df_stops):
+    """stop_id, stop_name, infrabel_id, station_id frame for a GTFS stops frame (every stop resolved once)."""
+    table = df_stops[['stop_id', 'stop_name']].drop_duplicates('stop_id').copy()
+    table['station_id'] = table['stop_id'].map(stop_hierarchy(df_stops))
+    # A platform that is not mapped itself takes the node of its station
+    table['infrabel_id'] = station_resolver().resolve_many(
+        table['stop_id'].tolist(), table['stop_name'].tolist(), table['station_id'].tolist())
+    return table
+
+def stop_hierarchy(df_stops=None):
+    """stop_id -> canonical station id from stops.txt (parent_station, else the SNCB number)."""
+    if df_stops is None:
+        df_stops = static_data.get('stops')
+    if df_stops is None or 'stop_id' not in df_stops:
+        return {}
+    parents = df_stops['parent_station'] if 'parent_station' in df_stops else [None] * len(df_stops)
+    return station_hierarchy(zip(df_stops['stop_id'], parents))
+
+def backfill_stop_nodes(only_missing=True):
+    """Stores infrabel_id and station_id on existing train_stops rows; returns the number of rows updated.
+
+    ``only_missing`` fills rows without a node or station. Otherwise every
+    row is resolved again (a node that no longer resolves is cleared) and the
+    mapping version is recorded, so request-time code trusts the stored ids again.
+    """
+    global STOP_NODES_VERSION
+    resolver = station_resolver()
+    query = db.session.query(TrainStop.stop_id, TrainStop.stop_name).filter(TrainStop.stop_id.isnot(None)).distinct()
+    if only_missing:
+        query = query.filter(or_(TrainStop.infrabel_id.is_(None), TrainStop.station_id.is_(None)))
+    hierarchy = stop_hierarchy()
+    rows = query.all()
+    stations = [hierarchy.get(stop_id) or station_key(stop_id) for stop_id, _ in rows]
+    nodes = resolver.resolve_many([r[0] for r in rows], [r[1] for r in rows], stations)
+
+    table = TrainStop.__table__
+    node = bindparam('node')
+    update = table.update().where(
+        table.c.stop_id == bindparam('sid'),
+        table.c.stop_name.is_not_distinct_from(bindparam('name')),  # NULL names match too
+    ).values(infrabel_id=db.func.coalesce(node, table.c.infrabel_id) if only_missing else node,
+             station_id=bindparam('station'))
+    updated = 0
+    for (stop_id, stop_name), station, inf_id in zip(rows, stations, nodes):
+        updated += db.session.execute(update, {"node": inf_id, "station": station, "sid": stop_id,
+                                               "name": stop_name}).rowcount
+    db.session.commit()
+    if not only_missing:
+        set_status(STOP_NODES_STATUS, resolver.version)
+        STOP_NODES_VERSION = resolver.version
+    print(f"✅ infrabel_id/station_id ingevuld voor {updated} haltes ({len(rows)} unieke stops).")
+    return updated
+
+def restamp_stop_nodes():
+    """Re-resolves every stored train_stops.infrabel_id when the mapping changed since the last stamp."""
+    resolver = station_resolver()
+    if get_status(STOP_NODES_STATUS) == resolver.version:
+        return False
+    print("🚉 Station mapping changed, re-resolving stored stop nodes...")
+    backfill_stop_nodes(only_missing=False)
+    TRACE_CACHE.clear()
+    return True
+
+# Bump when compile_railway_graph changes what it builds, so existing snapshots are rebuilt.
+GRAPH_RULES_REVISION = 4
+
+def graph_source_stamp():
+    """Cheap fingerprint of everything compile_railway_graph() reads (aggregates, no full scan)."""
+    seg_count, seg_max, seg_len = db.session.query(
+        db.func.count(InfrabelStationToStation.id),
+        db.func.max(InfrabelStationToStation.id),
+        db.func.sum(InfrabelStationToStation.length)).one()
+    op_count, lat_sum, lon_sum = db.session.query(
+        db.func.count(InfrabelOperationalPoint.id),
+        db.func.sum(InfrabelOperationalPoint.latitude),
+        db.func.sum(InfrabelOperationalPoint.longitude)).one()
+    sums = ':'.join(f"{x or 0:.6f}" for x in (seg_len, lat_sum, lon_sum))
+    return f"main:r{GRAPH_RULES_REVISION}:{ROUTING_MODE == 'ch'}:{seg_count}:{seg_max}:{op_count}:{sums}"
+
+def compile_railway_graph():
+    """Compiles InfrabelStationToStation segments into a CompiledGraph using Haversine weights."""
+    with app.app_context():
+        print("🛠️  Building railway graph...")
+        
+        # Load Coordinates
+        all_ops = InfrabelOperationalPoint.query.all()
+        coords = {op.id: (op.latitude, op.longitude) for op in all_ops if op.latitude and op.longitude}
+        
+        segments = InfrabelStationToStation.query.all()
+        edges = []
+        segment_lengths = {}
+        geometries = {}
+        
+        for seg in segments:
+            u, v = seg.stationfrom_id, seg.stationto_id
             
-            # Load Coordinates
-            all_ops = InfrabelOperationalPoint.query.all()
-            coords = {op.id: (op.latitude, op.longitude) for op in all_ops if op.latitude and op.longitude}
+            # Calculate Weight
+            w = seg.length
             
-            segments = InfrabelStationToStation.query.all()
-            new_graph = {}
+            # If length is missing or suspiciously 1.0 (default), try Haversine
+            if w is None:
+                if u in coords and v in coords:
+                    w = haversine_km(coords[u][0], coords[u][1], coords[v][0], coords[v][1])
+                else:
+                    w = 1.0 # Last resort fallback
             
-            def haversine(lat1, lon1, lat2, lon2):
-                R = 6371.0 # Radius of Earth in km
-                dlat = math.radians(lat2 - lat1)
-                dlon = math.radians(lon2 - lon1)
-                a = math.sin(dlat / 2)**2 + math.cos(math.radians(lat1)) * math.cos(math.radians(lat2)) * math.sin(dlon / 2)**2
-                c = 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
-                return R * c
-
-            for seg in segments:
-                u, v = seg.stationfrom_id, seg.stationto_id
-                
-                # Calculate Weight
-                w = seg.length
-                
-                # If length is missing or suspiciously 1.0 (default), try Haversine
-                if w is None:
-                    if u in coords and v in coords:
-                        w = haversine(coords[u][0], coords[u][1], coords[v][0], coords[v][1])
-                    else:
-                        w = 1.0 # Last resort fallback
-                
-                if w is None: w = 1.0 # Double check
-                
-                # --- MANUAL WEIGHT ADJUSTMENT ---
-
-                # BLOCK BAD DATA: Segment 875/1319 claims to be FL->ANS with 5km len. 
-                # Seg 321/1249 claims FL->LGR (Liège) with 5km len.
-                # Seg 1305/1310 claims FL->GVX with 16km (Voroux teleport).
-                # This breaks graph logic. Block it.
-                bad_segs = [321, 1249, 1305, 1310]
-                if seg.id in bad_segs:
-                    continue # Skip adding this edge entirely
-
-                # HSL FIX: Penalize Classic Line Landen-Ans - REMOVED
-                # avoid_nodes = ['FWR', 'FLD', 'FRM'] 
-                # if u in avoid_nodes or v in avoid_nodes:
-                #      w *= 2000.0
-                
-                # FAVOR HSL: ANS <-> FLV (Leuven Vorming/HSL Start)
-                # This segment is ~66km. We slightly favor it to ensure selection over penalized classic.
-                hsl_nodes = ['FLV', 'ANS']
-                if u in hsl_nodes and v in hsl_nodes:
-                    w *= 0.8 # Slight preference
-                
-                # AIRPORT FIX: Force Direct trains via Diabolo (Top) not Classic (Bottom)
-                # The "bottom" route goes via Diegem (FDG) and Zaventem (FZA).
-                # We penalize these edges so DIRECT trains choose the "top" path.
-                # Stopping trains (FN->FDG) will still use them as it's the only way.
-                classic_airport_nodes = ['FDG', 'FZA']
-                if u in classic_airport_nodes or v in classic_airport_nodes:
-                   w *= 5.0
-
-                if (u=='FTNN' and v=='FLD') or (v=='FTNN' and u=='FLD'):
-                    w *= 1000.0
-
-                # SPA BRANCH FIX: Penalize entering the Spa branch unless necessary
-                # This prevents mainline trains (Liege-Verviers) from taking the "dip" via Pepinster-Cite (FPSC).
-                spa_nodes = ['FPSC', 'FSS', 'FSSG', 'FJL', 'FTX', 'FRO']
-                if u in spa_nodes or v in spa_nodes:
-                    w *= 10.0
-
-                if u not in new_graph: new_graph[u] = []
-                if v not in new_graph: new_graph[v] = []
-                new_graph[u].append((v, w, seg.id))
-                new_graph[v].append((u, w, seg.id))
-
-            # --- VIRTUAL EXTREME FIX FOR AIRPORT (FBNL) ---
-            # Ensure connectivity to avoiding reversals
-            virtual_edges = [
-                ('FBNL', 'FM', 0.1, 'V_FBNL_FM'),
-                ('FBNL', 'FN', 0.1, 'V_FBNL_FN'),
-                ('FBNL', 'FLV', 0.1, 'V_FBNL_FLV')
-            ]
-            for u, v, w, vid in virtual_edges:
-                if u not in new_graph: new_graph[u] = []
-                if v not in new_graph: new_graph[v] = []
-                new_graph[u].append((v, w, vid))
-                new_graph[v].append((u, w, vid))
-
-            RAILWAY_GRAPH = new_graph
-            print(f"✅ Graph built with {len(RAILWAY_GRAPH)} nodes.")
+            if w is None: w = 1.0 # Double check
+            
+            # --- MANUAL WEIGHT ADJUSTMENT ---
+
+            # BLOCK BAD DATA: Segment 875/1319 claims to be FL->ANS with 5km len. 
+            # Seg 321/1249 claims FL->LGR (Liège) with 5km len.
+            # Seg 1305/1310 claims FL->GVX with 16km (Voroux teleport).
+            # This breaks graph logic. Block it.
+            bad_segs = [321, 1249, 1305, 1310]
+            if seg.id in bad_segs:
+                continue # Skip adding this edge entirely
+
+            # HSL FIX: Penalize Classic Line Landen-Ans - REMOVED
+            # avoid_nodes = ['FWR', 'FLD', 'FRM'] 
+            # if u in avoid_nodes or v in avoid_nodes:
+            #      w *= 2000.0
+            
+            # FAVOR HSL: ANS <-> FLV (Leuven Vorming/HSL Start)
+            # This segment is ~66km. We slightly favor it to ensure selection over penalized classic.
+            hsl_nodes = ['FLV', 'ANS']
+            if u in hsl_nodes and v in hsl_nodes:
+                w *= 0.8 # Slight preference
+            
+            # AIRPORT FIX: Force Direct trains via Diabolo (Top) not Classic (Bottom)
+            # The "bottom" route goes via Diegem (FDG) and Zaventem (FZA).
+            # We penalize these edges so DIRECT trains choose the "top" path.
+            # Stopping trains (FN->FDG) will still use them as it's the only way.
+            classic_airport_nodes = ['FDG', 'FZA']
+            if u in classic_airport_nodes or v in classic_airport_nodes:
+               w *= 5.0
+
+            if (u=='FTNN' and v=='FLD') or (v=='FTNN' and u=='FLD'):
+                w *= 1000.0
+
+            # SPA BRANCH FIX: Penalize entering the Spa branch unless necessary
+            # This prevents mainline trains (Liege-Verviers) from taking the "dip" via Pepinster-Cite (FPSC).
+            spa_nodes = ['FPSC', 'FSS', 'FSSG', 'FJL', 'FTX', 'FRO']
+            if u in spa_nodes or v in spa_nodes:
+                w *= 10.0
+
+            edges.append((u, v, w, seg.id))
+            segment_lengths[seg.id] = seg.length
+            geometries[seg.id] = seg.geom_wkt
+
+        # --- VIRTUAL EXTREME FIX FOR AIRPORT (FBNL) ---
+        # Ensure connectivity to avoiding reversals
+        virtual_edges = [
+            ('FBNL', 'FM', 0.1, 'V_FBNL_FM'),
+            ('FBNL', 'FN', 0.1, 'V_FBNL_FN'),
+            ('FBNL', 'FLV', 0.1, 'V_FBNL_FLV')
+        ]
+        edges.extend(virtual_edges)
+
+        graph = CompiledGraph.from_edges(edges, segment_lengths, coords, geometries=geometries)
+        if ROUTING_MODE == 'ch':
+            t0 = time.time()
+            ch = graph.build_contraction_hierarchy()
+            print(f"   🔺 Contraction hierarchy: {ch.shortcut_count} shortcuts in {time.time() - t0:.1f}s.")
+
+        print(f"✅ Graph built with {len(graph)} nodes, {graph.edge_count} edges (version {graph.version[:8]}).")
+        return graph
+
+def load_railway_graph():
+    """Maps the shared graph snapshot, building and writing it first if it is missing or stale."""
+    if not GRAPH_SNAPSHOT_PATH:
+        return compile_railway_graph()
+    with app.app_context():
+        stamp = graph_source_stamp()
+    t0 = time.time()
+    graph = snapshot_or_build(GRAPH_SNAPSHOT_PATH, stamp, compile_railway_graph)
+    if graph is not None:
+        print(f"🗺️  Railway graph ready in {time.time() - t0:.2f}s (version {graph.version[:8]}).")
+    return graph
+
+TILE_CACHE = vector_tiles.TileCache(TILE_CACHE_DIR)
+
+def on_graph_swap(graph):
+    with app.app_context():
+        invalidate_path_cache(graph.version)
+    COVERAGE_CACHE.clear()
+    TRACE_CACHE.clear()
+    TILE_CACHE.prune(graph.version)
+
+# Owns the live graph. Requests call GRAPH_MANAGER.require() once and keep that
+# graph; rebuilds run in the background and swap in atomically.
+GRAPH_MANAGER = GraphManager(load_railway_graph, on_swap=on_graph_swap)
+
+def build_railway_graph():
+    """Loads or rebuilds the railway graph in the calling thread (startup, maintenance)."""
+    return GRAPH_MANAGER.rebuild()
+
+PATH_CACHE = LRUCache(PATH_CACHE_SIZE)
+# Segment ids driven per user, keyed by graph version, mapping version and the journeys' node pairs
+COVERAGE_CACHE = LRUCache(256)
+# Assembled traces, keyed by graph version, resolved node sequence and tolerance
+TRACE_CACHE = LRUCache(TRACE_CACHE_SIZE)
+PREWARM_STATUS = {"state": "idle"}
+PREWARM_THREAD = None
+_MISSING = object()
+
+def _insert_ignore(model):
+    """INSERT ... ON CONFLICT DO NOTHING for the active dialect (Postgres, SQLite in tests)."""
+    dialect = postgresql if db.engine.dialect.name == 'postgresql' else sqlite
+    return dialect.insert(model.__table__).on_conflict_do_nothing()
+
+def load_stored_paths(version, pairs):
+    """Reads (from, to) pairs from stop_pair_paths in one query; missing pairs are left out."""
+    if not PERSIST_PATHS or not pairs: return {}
+    sources = {p[0] for p in pairs}
+    targets = {p[1] for p in pairs}
+    try:
+        with db.engine.connect() as conn:
+            rows = conn.execute(
+                db.select(StopPairPath.from_id, StopPairPath.to_id, StopPairPath.segment_ids).where(
+                    StopPairPath.graph_version == version,
+                    StopPairPath.from_id.in_(sources),
+                    StopPairPath.to_id.in_(targets))
+            ).all()
     except Exception as e:
-        print(f"⚠️ Error building graph: {e}")
+        print(f"⚠️ Path table read failed: {e}")
+        return {}
+    found = {}
+    for from_id, to_id, segment_ids in rows:
+        if (from_id, to_id) in pairs:
+            path = json.loads(segment_ids)
+            found[(from_id, to_id)] = tuple(path) if path is not None else None
+    return found
+
+def store_paths(version, paths):
+    """Writes {(from, to): path} in its own transaction so callers' sessions are never committed."""
+    if not PERSIST_PATHS or not paths: return
+    try:
+        with db.engine.begin() as conn:
+            conn.execute(_insert_ignore(StopPairPath), [{
+                "from_id": start_node,
+                "to_id": end_node,
+                "graph_version": version,
+                "segment_ids": json.dumps(list(path) if path is not None else None)
+            } for (start_node, end_node), path in paths.items()])
+    except Exception as e:
+        print(f"⚠️ Path table write failed: {e}")
 
-def find_path(start_node, end_node):
-    """Dijkstra to find the shortest path between two Infrabel IDs."""
-    if not RAILWAY_GRAPH: return None
-    if start_node == end_node: return []
-    if start_node not in RAILWAY_GRAPH or end_node not in RAILWAY_GRAPH: return None
-    
-    # queue: (cost, current_node, [segment_ids])
-    queue = [(0, start_node, [])]
-    visited = {}
-    
-    while queue:
-        (cost, node, path_segments) = heapq.heappop(queue)
-        
-        if node in visited and visited[node] <= cost:
-            continue
-        visited[node] = cost
-        
-        if node == end_node:
-            return path_segments
-            
-        for (neighbor, weight, seg_id) in RAILWAY_GRAPH.get(node, []):
-            if neighbor not in visited or visited[neighbor] > cost + weight:
-                heapq.heappush(queue, (cost + weight, neighbor, path_segments + [seg_id]))
-                
-    return None
+def invalidate_path_cache(version):
+    """Drops cached paths of every graph version other than ``version``."""
+    PATH_CACHE.clear()
+    if not PERSIST_PATHS: return
+    try:
+        with db.engine.begin() as conn:
+            res = conn.execute(db.delete(StopPairPath).where(StopPairPath.graph_version != version))
+        if res.rowcount:
+            print(f"   🧹 Removed {res.rowcount} stale stop-pair paths.")
+    except Exception as e:
+        print(f"⚠️ Path table invalidation failed: {e}")
+
+def find_paths(sources, targets, mode=None, graph=None):
+    """Shortest paths for the pairs zip(sources, targets), as {(from, to): segment ids or None}.
+
+    Pairs are looked up in PATH_CACHE, then in stop_pair_paths with a single
+    query. The misses are grouped by origin. When the routing mode is
+    'dijkstra', an origin with several targets gets one multi-target Dijkstra
+    search that stops once all of them are settled; it breaks ties exactly like
+    the single-pair Dijkstra. Other modes can pick a different path among
+    equal-weight ones, so each pair is then searched on its own with that mode.
+    This way the cached path for a pair never depends on whether it was
+    computed alone or in a batch. Raises GraphWarmingError while the first
+    graph is still being built.
+    """
+    if graph is None: graph = GRAPH_MANAGER.require()
+    mode = mode or ROUTING_MODE
+    version = graph.version
+    found = {}
+    missing = set()
+    for pair in zip(sources, targets):
+        if pair in found or pair in missing: continue
+        start_node, end_node = pair
+        if start_node == end_node:
+            found[pair] = ()
+        elif not graph.connected(start_node, end_node):
+            # Different islands: skip the search so callers fall back to a straight line
+            found[pair] = None
+        else:
+            path = PATH_CACHE.get((version, start_node, end_node), _MISSING)
+            if path is _MISSING:
+                missing.add(pair)
+            else:
+                found[pair] = path
+
+    stored = load_stored_paths(version, missing)
+    computed = {}
+    by_source = {}
+    for pair in missing:
+        if pair in stored:
+            found[pair] = stored[pair]
+        else:
+            by_source.setdefault(pair[0], []).append(pair[1])
+    for start_node, ends in by_source.items():
+        if len(ends) > 1 and mode == 'dijkstra':
+            paths = graph.shortest_paths(start_node, ends)
+        else:
+            paths = {end_node: graph.shortest_path(start_node, end_node, mode) for end_node in ends}
+        for end_node, path in paths.items():
+            computed[(start_node, end_node)] = tuple(path) if path is not None else None
+    store_paths(version, computed)
+    found.update(computed)
+
+    for pair in missing:
+        PATH_CACHE.put((version,) + pair, found[pair])
+    return {pair: list(path) if path is not None else None for pair, path in found.items()}
+
+def find_path(start_node, end_node, mode=None, graph=None):
+    """Shortest path (segment ids) between two Infrabel IDs, using ROUTING_MODE by default.
+
+    Results are memoised per graph version: first in PATH_CACHE, then in the
+    stop_pair_paths table shared by all workers, and computed on a miss.
+    """
+    return find_paths([start_node], [end_node], mode, graph)[(start_node, end_node)]
 
 def get_pt_coords(pt_id):
-    """Fallback to get lat/lon for an operational point."""
-    op = InfrabelOperationalPoint.query.filter_by(id=pt_id).first()
-    if op and op.latitude and op.longitude:
-        return [float(op.longitude), float(op.latitude)]
-    return None
+    """[lon, lat] of an operational point: from the graph's node table, else from the station resolver."""
+    graph = GRAPH_MANAGER.graph
+    if graph is not None and pt_id in graph:
+        return graph.node_coords(pt_id)
+    return station_resolver().op_coords(pt_id)
 
 def haversine_distance(lat1, lon1, lat2, lon2):
     R = 6371000  # Radius in meters
@@ -428,9 +788,7 @@ def haversine_distance(lat1, lon1, lat2, lon2):
 
 def get_journey_distance(train_id, start_stop_id, end_stop_id):
     """Calculates total distance in KM for a journey segment."""
-    global RAILWAY_GRAPH
-    if not RAILWAY_GRAPH:
-        build_railway_graph()
+    graph = GRAPH_MANAGER.require()
     
     print(f"📏 Distance Calc: Train {train_id} | {start_stop_id} to {end_stop_id}")
         
@@ -449,19 +807,17 @@ def get_journey_distance(train_id, start_stop_id, end_stop_id):
     if len(filtered_stops) < 2: return 0.0
 
     total_dist = 0.0
-    resolved_pts = []
-    for s in filtered_stops:
-        inf_id = get_infrabel_id(s.stop_id, s.stop_name)
-        if inf_id and inf_id in RAILWAY_GRAPH:
-            resolved_pts.append(inf_id)
+    resolved_pts = [inf_id for inf_id in stop_infrabel_ids(filtered_stops)
+                    if inf_id and inf_id in graph]
 
+    paths = find_paths(resolved_pts[:-1], resolved_pts[1:], graph=graph)
     for i in range(len(resolved_pts) - 1):
-        path_seg_ids = find_path(resolved_pts[i], resolved_pts[i+1])
+        path_seg_ids = paths[(resolved_pts[i], resolved_pts[i+1])]
         if path_seg_ids:
             for seg_id in path_seg_ids:
-                seg = db.session.get(InfrabelStationToStation, seg_id)
-                if seg and seg.length:
-                    total_dist += float(seg.length)
+                length = graph.segment_length(seg_id)
+                if length:
+                    total_dist += length
                 else:
                     total_dist += 0.1 # nominal 100m fallback
         else:
@@ -476,11 +832,22 @@ def get_journey_distance(train_id, start_stop_id, end_stop_id):
                 
     return round(total_dist, 2)
 
-def get_trace_geometry(train_id, start_stop_id=None, end_stop_id=None):
-    """Fetches Infrabel segments for a train's stops, filling gaps with Dijkstra."""
-    global RAILWAY_GRAPH
-    if not RAILWAY_GRAPH:
-        build_railway_graph()
+def requested_tolerance():
+    """Geometry simplification in metres from ?tolerance= or ?zoom= (0 = full detail)."""
+    tolerance = request.args.get('tolerance', type=float)
+    if tolerance is not None:
+        return max(tolerance, 0.0)
+    zoom = request.args.get('zoom', type=float)
+    if zoom is not None:
+        return tolerance_for_zoom(zoom)
+    return 0.0
+
+def get_trace_geometry(train_id, start_stop_id=None, end_stop_id=None, tolerance=0.0):
+    """Fetches Infrabel segments for a train's stops, filling gaps with Dijkstra.
+
+    ``tolerance`` (metres) selects a precomputed simplified geometry level.
+    """
+    graph = GRAPH_MANAGER.require()
         
     stops = TrainStop.query.filter_by(train_id=train_id).order_by(TrainStop.stop_sequence).all()
     if not stops: return None
@@ -496,23 +863,41 @@ def get_trace_geometry(train_id, start_stop_id=None, end_stop_id=None):
         stops = filtered_stops
 
     if len(stops) < 2: return None
+    return trace_for_stops(graph, stops, tolerance)
+
+def trace_nodes(graph, stops):
+    """The graph nodes a trace over ``stops`` connects: the resolved Infrabel ids that are in the graph."""
+    return tuple(inf_id for inf_id in stop_infrabel_ids(stops) if inf_id and inf_id in graph)
+
+def trace_for_stops(graph, stops, tolerance=0.0, nodes=None):
+    """Trace FeatureCollection for an ordered list of stops (rows with stop_id/stop_name).
+
+    The trace only depends on the graph nodes the stops resolve to, so
+    results are kept in TRACE_CACHE per graph version, node sequence and
+    tolerance and are shared by every train (or pattern) that resolves alike.
+    ``nodes`` skips resolving the stops again when the caller already did.
+    """
+    if nodes is None:
+        nodes = trace_nodes(graph, stops)
+    key = (graph.version, nodes, tolerance)
+    cached = TRACE_CACHE.get(key)
+    if cached is not None:
+        return cached
 
     features = []
     seen_segment_ids = set()
     
-    # Pre-resolve all available Infrabel IDs
-    resolved_stops = []
-    for s in stops:
-        inf_id = get_infrabel_id(s.stop_id, s.stop_name)
-        if inf_id and inf_id in RAILWAY_GRAPH: # ONLY ADD IF IN GRAPH
-            resolved_stops.append({"inf_id": inf_id, "stop": s})
+    # Only stops resolved to a node IN THE GRAPH are connected
+    resolved_stops = [{"inf_id": inf_id} for inf_id in nodes]
 
     # Connect resolved stops sequentially, skipping gaps
+    inf_ids = [r["inf_id"] for r in resolved_stops]
+    paths = find_paths(inf_ids[:-1], inf_ids[1:], graph=graph)
     for i in range(len(resolved_stops) - 1):
         id1 = resolved_stops[i]["inf_id"]
         id2 = resolved_stops[i+1]["inf_id"]
         
-        path_seg_ids = find_path(id1, id2)
+        path_seg_ids = paths[(id1, id2)]
         if path_seg_ids:
             for seg_id in path_seg_ids:
                 # Handle Virtual Edges
@@ -535,16 +920,14 @@ def get_trace_geometry(train_id, start_stop_id=None, end_stop_id=None):
                         continue
                     continue
                 seen_segment_ids.add(seg_id)
-                seg = db.session.get(InfrabelStationToStation, seg_id)
-                if seg:
-                    try:
-                        geom = json.loads(seg.geom_wkt)
-                        features.append({
-                            "type": "Feature",
-                            "geometry": geom,
-                            "properties": { "from_id": seg.stationfrom_id, "to_id": seg.stationto_id }
-                        })
-                    except: continue
+                geom = graph.segment_geometry(seg_id, tolerance)
+                if geom:
+                    u, v = graph.segment_endpoints(seg_id)
+                    features.append({
+                        "type": "Feature",
+                        "geometry": geom,
+                        "properties": { "from_id": u, "to_id": v }
+                    })
         else:
             # STRAIGHT LINE FALLBACK for disconnected components
             p1 = get_pt_coords(id1)
@@ -559,10 +942,85 @@ def get_trace_geometry(train_id, start_stop_id=None, end_stop_id=None):
                     "properties": { "from_id": id1, "to_id": id2, "fallback": True }
                 })
         
-    return {
+    trace = {
         "type": "FeatureCollection",
         "features": features
     }
+    TRACE_CACHE.put(key, trace)
+    return trace
+
+def _stop_patterns(dates):
+    """{stop_id pattern: [stop rows, train count]} over all trains running on ``dates``."""
+    rows = db.session.query(TrainStop.train_id, TrainStop.stop_id, TrainStop.stop_name, TrainStop.infrabel_id)\
+        .join(Train, Train.id == TrainStop.train_id)\
+        .filter(Train.date.in_(dates))\
+        .order_by(TrainStop.train_id, TrainStop.stop_sequence).all()
+    patterns = {}
+    for _, group in itertools.groupby(rows, key=lambda r: r.train_id):
+        stops = list(group)
+        if len(stops) < 2:
+            continue
+        entry = patterns.setdefault(tuple(s.stop_id for s in stops), [stops, 0])
+        entry[1] += 1
+    return patterns
+
+def prewarm_traces(dates, pause=None):
+    """Computes the full trace of every distinct stopping pattern running on ``dates``.
+
+    Stop-pair paths end up in PATH_CACHE and the stop_pair_paths table, the
+    assembled traces in TRACE_CACHE, so the first request for a train (or a
+    part of it) no longer searches the graph. Sleeps ``pause`` seconds between
+    patterns to leave the CPU to request threads, and stops early when the
+    graph is swapped.
+    """
+    pause = PREWARM_PAUSE if pause is None else pause
+    graph = GRAPH_MANAGER.require()
+    PREWARM_STATUS.update(state="running", dates=list(dates), trains=0, patterns=0, done=0,
+                          computed=0, already_cached=0, started_at=datetime.now().isoformat(timespec='seconds'),
+                          finished_at=None, duration_s=None, error=None)
+    t0 = time.time()
+    try:
+        patterns = _stop_patterns(dates)
+        PREWARM_STATUS.update(patterns=len(patterns), trains=sum(n for _, n in patterns.values()))
+        print(f"🔥 [PREWARM] {PREWARM_STATUS['trains']} trains on {', '.join(dates)} -> {len(patterns)} stopping patterns")
+        for pattern, (stops, _) in patterns.items():
+            if GRAPH_MANAGER.graph is not graph:
+                print("   ⚠️ [PREWARM] Graph swapped, stopping.")
+                break
+            nodes = trace_nodes(graph, stops)
+            if (graph.version, nodes, 0.0) in TRACE_CACHE:
+                PREWARM_STATUS['already_cached'] += 1
+            else:
+                trace_for_stops(graph, stops, nodes=nodes)
+                PREWARM_STATUS['computed'] += 1
+            PREWARM_STATUS['done'] += 1
+            if pause:
+                time.sleep(pause)
+        PREWARM_STATUS['state'] = "done"
+    except Exception as e:
+        db.session.rollback()
+        PREWARM_STATUS.update(state="failed", error=str(e))
+        print(f"❌ [PREWARM] Failed: {e}")
+    PREWARM_STATUS.update(finished_at=datetime.now().isoformat(timespec='seconds'),
+                          duration_s=round(time.time() - t0, 1))
+    print(f"✅ [PREWARM] {PREWARM_STATUS['computed']} traces computed, "
+          f"{PREWARM_STATUS['already_cached']} already cached in {PREWARM_STATUS['duration_s']}s.")
+
+def start_trace_prewarm(days=(0, 1)):
+    """Runs prewarm_traces for today (+ tomorrow) in a background thread, once at a time."""
+    global PREWARM_THREAD
+    if PREWARM_THREAD is not None and PREWARM_THREAD.is_alive():
+        return False
+    today = datetime.now()
+    dates = [(today + timedelta(days=d)).strftime("%Y-%m-%d") for d in days]
+
+    def run():
+        with app.app_context():
+            prewarm_traces(dates)
+
+    PREWARM_THREAD = threading.Thread(target=run, name="trace-prewarm", daemon=True)
+    PREWARM_THREAD.start()
+    return True
 
 # ==========================================
 # 3. HELPER: GTFS TIME
@@ -586,6 +1044,7 @@ def gtfs_time_to_dt(time_str, date_str):
 # ==========================================
 def load_static_data():
     """Laadt ruwe GTFS data in geheugen voor snelle verwerking"""
+    global STATIC_FEED_STAMP
     print("📂 Static data inladen (Pandas)...")
     
     # Check of bestand bestaat, anders downloaden
@@ -593,46 +1052,35 @@ def load_static_data():
         download_static_data()
         
     try:
-        dtype_cfg = str
-        # Basis bestanden laden
-        static_data['trips'] = pd.read_csv(os.path.join(DATA_FOLDER, 'trips.txt'), dtype=dtype_cfg)
-        static_data['routes'] = pd.read_csv(os.path.join(DATA_FOLDER, 'routes.txt'), dtype=dtype_cfg)
-        static_data['calendar'] = pd.read_csv(os.path.join(DATA_FOLDER, 'calendar.txt'), dtype=dtype_cfg)
-        static_data['calendar_dates'] = pd.read_csv(os.path.join(DATA_FOLDER, 'calendar_dates.txt'), dtype=dtype_cfg)
-        
-        # Stop Times laden (hier halen we de tijden én de counts vandaan)
-        df_st = pd.read_csv(os.path.join(DATA_FOLDER, 'stop_times.txt'), dtype=dtype_cfg)
-        
-        # Zorg dat stop_sequence een nummer is voor correcte sortering
-        df_st['stop_sequence'] = pd.to_numeric(df_st['stop_sequence'])
-        
-        # Groepeer per rit
-        grouped = df_st.sort_values('stop_sequence').groupby('trip_id')
-        
-        # 1. Eerste halte (Vertrektijd)
-        static_data['trip_starts'] = grouped.first().reset_index()[['trip_id', 'departure_time']]
-        
-        # 2. Laatste halte (Bestemming + Aankomsttijd)
-        last_stops = grouped.last().reset_index()
-        stops = pd.read_csv(os.path.join(DATA_FOLDER, 'stops.txt'), dtype=dtype_cfg)
-        ends = last_stops[['trip_id', 'stop_id', 'arrival_time']]
-        ends = ends.merge(stops[['stop_id', 'stop_name']], on='stop_id', how='left')
-        static_data['trip_ends'] = ends[['trip_id', 'stop_name', 'arrival_time']]
-        
-        # =========================================================
-        # HIER GING HET FOUT: DEZE REGEL ONTBRAK
-        # We tellen hoeveel stops elke rit heeft
-        # =========================================================
-        static_data['trip_counts'] = grouped.size().reset_index(name='stop_count')
-
-        # Voeg dit toe aan load_static_data()
-        static_data['stops'] = pd.read_csv(os.path.join(DATA_FOLDER, 'stops.txt'), dtype=str)
-        static_data['stop_times'] = pd.read_csv(os.path.join(DATA_FOLDER, 'stop_times.txt'), dtype={'stop_sequence': int, 'trip_id': str, 'stop_id': str})
+        if FEED_CACHE_DIR:
+            t0 = time.time()
+            stamp = feed_cache.source_stamp(DATA_FOLDER)
+            static_data.update(feed_cache.load_or_build(FEED_CACHE_DIR, stamp, parse_static_data,
+                                                        categorical=('stop_times',)))
+            STATIC_FEED_STAMP = stamp
+            print(f"   ⚡ Feed cache {stamp[:8]} geladen in {time.time() - t0:.2f}s.")
+        else:
+            static_data.update(parse_static_data())
 
         print("✅ Static data geladen in geheugen!")
     except Exception as e: 
         print(f"❌ Fout static: {e}")
 
+def parse_static_data():
+    """Leest de GTFS csv-bestanden en bereidt de frames voor de dagplanning voor (één keer per feed)."""
+    dtype_cfg = str
+    # Basis bestanden laden
+    trips = pd.read_csv(os.path.join(DATA_FOLDER, 'trips.txt'), dtype=dtype_cfg)
+    routes = pd.read_csv(os.path.join(DATA_FOLDER, 'routes.txt'), dtype=dtype_cfg)
+    stops = pd.read_csv(os.path.join(DATA_FOLDER, 'stops.txt'), dtype=dtype_cfg)
+    stop_times = pd.read_csv(os.path.join(DATA_FOLDER, 'stop_times.txt'), dtype=dtype_cfg)
+
+    # Gesorteerde stop_times + vertrek, bestemming en aantal stops per rit
+    frames = schedule_planner.prepare_feed(trips, routes, stop_times, stops)
+    frames['calendar'] = pd.read_csv(os.path.join(DATA_FOLDER, 'calendar.txt'), dtype=dtype_cfg)
+    frames['calendar_dates'] = pd.read_csv(os.path.join(DATA_FOLDER, 'calendar_dates.txt'), dtype=dtype_cfg)
+    return frames
+
 def download_static_data():
     print("⬇️ Downloaden static data met Backup & Rollback protectie...")
     
@@ -704,27 +1152,7 @@ def download_static_data():
         pass
 
 def get_active_services(target_date):
-    date_str = target_date.strftime("%Y%m%d")
-    # Robust weekday mapping (GTFS requires English column names)
-    days = ['monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday']
-    day_name = days[target_date.weekday()]
-    
-    services = set()
-    cal = static_data.get('calendar')
-    if cal is not None and not cal.empty:
-        # Check if column exists (safeguard)
-        if day_name in cal.columns:
-            mask = (cal['start_date'] <= date_str) & (cal['end_date'] >= date_str) & (cal[day_name] == '1')
-            services.update(cal[mask]['service_id'].tolist())
-            
-    cd = static_data.get('calendar_dates')
-    if cd is not None and not cd.empty:
-        exc = cd[cd['date'] == date_str]
-        to_add = exc[exc['exception_type'] == '1']['service_id'].tolist()
-        to_remove = exc[exc['exception_type'] == '2']['service_id'].tolist()
-        services.update(to_add)
-        services.difference_update(to_remove)
-    return services
+    return schedule_planner.active_services(static_data, target_date)
 
 def sync_day(target_date, time_limit=None):
     """
@@ -736,129 +1164,96 @@ def sync_day(target_date, time_limit=None):
         target_str = target_date.strftime("%Y%m%d")
         print(f"🗓️  Syncing {target_str} (Limit: {time_limit if time_limit else 'None'})...")
 
-        # A. Check welke treinen we al hebben voor deze datum (om dubbels te voorkomen)
-        existing_train_nums = set(
-            t.train_number for t in Train.query.filter_by(date=target_str).all()
-        )
-
-        # B. Data ophalen uit Pandas (MOET VOOR get_active_services)
-        required_keys = ['trips', 'calendar', 'calendar_dates', 'trip_starts']
+        # A. Data ophalen uit Pandas (MOET VOOR get_active_services)
+        required_keys = ['trips', 'calendar', 'calendar_dates', 'trip_starts', 'trip_rows']
         is_missing = any(k not in static_data for k in required_keys)
         
         if is_missing:
             print("   Static data incomplete or not loaded. Loading now...")
             load_static_data()
 
-        # C. Haal actieve services op voor DEZE specifieke dag
+        # B. Haal actieve services op voor DEZE specifieke dag
         active_services = get_active_services(target_date)
         if not active_services:
             print(f"   Geen dienstregeling gevonden voor {target_str}.")
             return
 
-        trips_df = static_data['trips']
-        trips_active = trips_df[trips_df['service_id'].isin(active_services)].copy()
-
-        # D. TIJDFILTER (Specifiek voor de nachtritten van morgen)
-        trips_active = trips_active.merge(static_data['trip_starts'], on='trip_id')
-
-        if time_limit:
-            count_before = len(trips_active)
-            trips_active = trips_active[trips_active['departure_time'] < time_limit]
-            print(f"   🕒 Nachtfilter: {count_before} -> {len(trips_active)} ritten over.")
-        
-        if trips_active.empty:
+        # C. Ritten van de dag: tijdfilter (nachtritten van morgen), ranking en dedup per treinnummer
+        trains, stops = schedule_planner.plan_day(static_data, active_services, target_str, time_limit=time_limit)
+        if trains.empty:
             return
 
         # ---------------------------------------------------------
-        # E. VERBETERDE RANKING LOGICA (Gecorrigeerd)
+        # D. OPSLAAN (bestaande treinen van deze datum blijven ongemoeid)
         # ---------------------------------------------------------
+        stop_nodes = stop_node_table(static_data['stops'])
+        stops = stops.merge(stop_nodes[['stop_id', 'infrabel_id', 'station_id']], on='stop_id', how='left')
+        written = schedule_loader.load_day(db.engine, Train.__table__, TrainStop.__table__, target_str,
+                                           trains, stops, replace=False, chunk_size=SYNC_CHUNK_TRAINS)
+        if written:
+            print(f"   ✅ {len(written)} ritten toegevoegd voor {target_str}.")
 
-        def calculate_rank(row, target_date_str):
-            tid = str(row['trip_id'])
-            date_at_end_match = re.search(r':(\d{8})$', tid)
-            if date_at_end_match:
-                found_date = date_at_end_match.group(1)
-                if found_date == target_date_str:
-                    return 1
-                else:
-                    return 2
-            if re.search(r':\d{8}:', tid):
-                return 3
-            return 4
-
-        trips_active['rank'] = trips_active.apply(calculate_rank, axis=1, args=(target_str,))
-
-        # Nu pas mergen met de rest
-        merged = trips_active \
-            .merge(static_data['routes'], on='route_id') \
-            .merge(static_data['trip_ends'], on='trip_id', suffixes=('_start', '_end')) \
-            .merge(static_data['trip_counts'], on='trip_id')
-
-        merged.sort_values(
-            by=['trip_short_name', 'rank', 'stop_count'], 
-            ascending=[True, True, False], 
-            inplace=True
-        )
-
-        final_df = merged.drop_duplicates(subset=['trip_short_name'], keep='first')
-        
-        # ---------------------------------------------------------
-        # F. OPSLAAN
-        # ---------------------------------------------------------
-        df_st = pd.read_csv(os.path.join(DATA_FOLDER, 'stop_times.txt'), dtype=str)
-        df_stops_static = pd.read_csv(os.path.join(DATA_FOLDER, 'stops.txt'), dtype=str)
-        
-        new_trains_count = 0
-        for _, r in final_df.iterrows():
-            train_num = r.get('trip_short_name', '?')
-            if not train_num or train_num == '?' or train_num in existing_train_nums:
-                continue
-
-            new_train = Train(
-                trip_id=r['trip_id'], 
-                train_number=train_num,
-                route_name=r.get('route_long_name', ''), 
-                destination=r.get('trip_headsign') or r.get('stop_name', ''),
-                date=target_str,
-                departure_time=r['departure_time'],
-                arrival_time=r['arrival_time'] 
-            )
-            db.session.add(new_train)
-            db.session.flush() 
-
-            this_trip_stops = df_st[df_st['trip_id'] == r['trip_id']].copy()
-            this_trip_stops['stop_type'] = this_trip_stops.apply(
-                lambda row: 'STOP' if not (row['pickup_type'] == '1' and row['drop_off_type'] == '1') else 'DOORRIT',
-                axis=1
-            )
-
-            this_trip_stops = this_trip_stops.merge(df_stops_static[['stop_id', 'stop_name']], on='stop_id')
-            this_trip_stops['stop_sequence'] = pd.to_numeric(this_trip_stops['stop_sequence'])
-            this_trip_stops.sort_values('stop_sequence', inplace=True)
-
-            stop_objects = []
-            for _, s_row in this_trip_stops.iterrows():
-                stop_objects.append(TrainStop(
-                    train_id=new_train.id,
-                    stop_id=s_row['stop_id'],
-                    stop_name=s_row['stop_name'],
-                    stop_type=s_row['stop_type'],
-                    arrival_time=s_row['arrival_time'],
-                    departure_time=s_row['departure_time'],
-                    stop_sequence=int(s_row['stop_sequence'])
-                ))
-            
-            db.session.bulk_save_objects(stop_objects)
-            new_trains_count += 1
-        
+
+
+# Bump when import_data / the planner change what is stored for a day, so every day is re-checked
+SCHEDULE_FORMAT = 1
+
+def schedule_version():
+    """Version of a day's import: GTFS content, station reference data and SCHEDULE_FORMAT."""
+    parts = f"{feed_cache.feed_version(DATA_FOLDER)}|{station_resolver().version}|{SCHEDULE_FORMAT}"
+    return hashlib.sha1(parts.encode()).hexdigest()
+
+def get_status(key):
+    entry = db.session.get(SystemStatus, key)
+    return entry.value if entry else None
+
+def set_status(key, value):
+    entry = db.session.get(SystemStatus, key) or SystemStatus(key=key)
+    entry.value = value
+    entry.updated_at = datetime.now()
+    db.session.add(entry)
+    db.session.commit()
+
+def remove_trains(target_date_str, train_numbers):
+    """Deletes trains that left the feed on a future day; returns the number deleted.
+
+    Today and past days are history and are never touched. Future trains
+    that a journey points to or that already have composition rows are kept too.
+    """
+    if not train_numbers or target_date_str <= datetime.now().strftime("%Y-%m-%d"):
+        return 0
+    ids = [i for (i,) in db.session.query(Train.id).filter(
+        Train.date == target_date_str, Train.train_number.in_(train_numbers))]
+    in_use = {i for (i,) in db.session.query(Journey.train_id).filter(Journey.train_id.in_(ids)).distinct()}
+    in_use |= {i for (i,) in db.session.query(TrainUnit.train_id).filter(TrainUnit.train_id.in_(ids)).distinct()}
+    doomed = [i for i in ids if i not in in_use]
+    if doomed:
+        db.session.query(TrainStop).filter(TrainStop.train_id.in_(doomed)).delete(synchronize_session=False)
+        db.session.query(Train).filter(Train.id.in_(doomed)).delete(synchronize_session=False)
         db.session.commit()
-        if new_trains_count > 0:
-            print(f"   ✅ {new_trains_count} ritten toegevoegd voor {target_str}.")
+    return len(doomed)
 
+def import_is_current(target_date_str, skip_if_exists=False, version=None):
+    """True when a day needs no import: it has data and skip_if_exists (boot), or it was imported with ``version``."""
+    # OPTIMIZATION: On boot, if data exists, skip heavy processing
+    if skip_if_exists:
+        count = Train.query.filter_by(date=target_date_str).count()
+        if count > 0:
+            print(f"   ⏩ Skipping {target_date_str} (Data exists: {count} trains).")
+            return True
+    if version and get_status(f"schedule:{target_date_str}") == version:
+        print(f"   ⏩ Skipping {target_date_str} (feed unchanged).")
+        return True
+    return False
 
+def import_data(target_date_str, skip_if_exists=False, version=None):
+    """Imports train data for a specific date (YYYY-MM-DD).
 
-def import_data(target_date_str, skip_if_exists=False):
-    """Imports train data for a specific date (YYYY-MM-DD)."""
+    With a ``version`` (see schedule_version) a day already imported with that
+    version is skipped; otherwise only added / changed trains are written and
+    trains that left the feed removed. Returns the diff report
+    (added, removed, modified, unchanged) or None when nothing was compared.
+    """
     global static_data
     
     # Needs pandas, db, models
@@ -866,13 +1261,9 @@ def import_data(target_date_str, skip_if_exists=False):
     if not static_data:
         download_static_data() # Ensure data is loaded
 
-    # OPTIMIZATION: On boot, if data exists, skip heavy processing
-    if skip_if_exists:
-        count = Train.query.filter_by(date=target_date_str).count()
-        if count > 0:
-            print(f"   ⏩ Skipping {target_date_str} (Data exists: {count} trains).")
-            return
-        
+    if import_is_current(target_date_str, skip_if_exists, version):
+        return None
+
     print(f"   📥 Importing data for {target_date_str}...")
     try:
         target_date = datetime.strptime(target_date_str, "%Y-%m-%d")
@@ -880,121 +1271,48 @@ def import_data(target_date_str, skip_if_exists=False):
         print(f"   ❌ Invalid date format: {target_date_str}")
         return
 
-    # 1. Active Services
-    active_services = get_active_services(target_date)
-    if not active_services:
-        print(f"   ⚠️ No active services found for {target_date_str}.")
-        return
-
-    # 2. Filter Trips
-    trips_df = static_data['trips']
-    if trips_df is None or trips_df.empty:
-        print("   ❌ Trips data empty.")
-        return
-
-    # Filter by service_id
-    trips_active = trips_df[trips_df['service_id'].isin(active_services)].copy()
-    
-    if trips_active.empty:
-        return
-
-    # 3. Add Rank
-    def calculate_rank(row, target_date_s):
-         tid = str(row['trip_id'])
-         # Regex for date in trip_id
-         date_at_end_match = re.search(r':(\d{8})$', tid)
-         target_compact = target_date_s.replace('-', '')
-         if date_at_end_match:
-             if date_at_end_match.group(1) == target_compact: return 1
-             return 2
-         if re.search(r':\d{8}:', tid): return 3
-         return 4
-
-    trips_active['rank'] = trips_active.apply(calculate_rank, axis=1, args=(target_date_str,))
-    
-    # Merge details
-    # We must merge trip_starts to get 'departure_time'
-    if 'trip_starts' in static_data:
-        trips_active = trips_active.merge(static_data['trip_starts'], on='trip_id', suffixes=('', '_start'))
-
-    merged = trips_active \
-        .merge(static_data['routes'], on='route_id') \
-        .merge(static_data['trip_ends'], on='trip_id', suffixes=('_start', '_end')) \
-        .merge(static_data['trip_counts'], on='trip_id')
-
-    # Sort and Dedup
-    merged.sort_values(by=['trip_short_name', 'rank', 'stop_count'], ascending=[True, True, False], inplace=True)
-    final_df = merged.drop_duplicates(subset=['trip_short_name'], keep='first')
-    
-    # 4. Save to DB
-    df_st = pd.read_csv(os.path.join(DATA_FOLDER, 'stop_times.txt'), dtype=str)
-    df_stops_static = pd.read_csv(os.path.join(DATA_FOLDER, 'stops.txt'), dtype=str)
-    
-    count_synced = 0
-    
-    for _, r in final_df.iterrows():
-        train_num = r.get('trip_short_name', '?')
-        if not train_num or train_num == '?': continue
-        
-        # Check existence
-        existing_train = Train.query.filter_by(train_number=train_num, date=target_date_str).first()
-        
-        # Logic: If exists, update. If not, create.
-        if existing_train:
-            # Update
-            existing_train.trip_id = r['trip_id']
-            existing_train.route_name = r.get('route_long_name', '')
-            existing_train.destination = r.get('trip_headsign') or r.get('stop_name', '')
-            # departure_time might be in r as 'departure_time' or 'departure_time_start' depending on merges
-            # trip_starts has 'departure_time'
-            existing_train.departure_time = r.get('departure_time')
-            existing_train.arrival_time = r.get('arrival_time')
-            TrainStop.query.filter_by(train_id=existing_train.id).delete()
-            train_obj = existing_train
-        else:
-            train_obj = Train(
-                trip_id=r['trip_id'],
-                train_number=train_num,
-                route_name=r.get('route_long_name', ''),
-                destination=r.get('trip_headsign') or r.get('stop_name', ''),
-                date=target_date_str,
-                departure_time=r.get('departure_time'),
-                arrival_time=r.get('arrival_time')
-            )
-            db.session.add(train_obj)
-        
-        db.session.flush() # Get ID
-        
-        # Stops
-        this_trip_stops = df_st[df_st['trip_id'] == r['trip_id']].copy()
-        this_trip_stops['stop_type'] = this_trip_stops.apply(
-            lambda row: 'STOP' if not (row['pickup_type'] == '1' and row['drop_off_type'] == '1') else 'DOORRIT', axis=1
-        )
-        this_trip_stops = this_trip_stops.merge(df_stops_static[['stop_id', 'stop_name']], on='stop_id')
-        this_trip_stops['stop_sequence'] = pd.to_numeric(this_trip_stops['stop_sequence'])
-        this_trip_stops.sort_values('stop_sequence', inplace=True)
-        
-        stop_objects = []
-        for _, s_row in this_trip_stops.iterrows():
-             stop_objects.append(TrainStop(
-                 train_id=train_obj.id,
-                 stop_id=s_row['stop_id'],
-                 stop_name=s_row['stop_name'],
-                 stop_type=s_row['stop_type'],
-                 arrival_time=s_row['arrival_time'],
-                 departure_time=s_row['departure_time'],
-                 stop_sequence=int(s_row['stop_sequence'])
-             ))
-        db.session.bulk_save_objects(stop_objects)
-        count_synced += 1
-        
-    db.session.commit()
-    print(f"   ✅ Imported {count_synced} trains for {target_date_str}.")
+    # Active services, rank, merge details, sort and dedup
+    plan = schedule_planner.plan_service_day(static_data, target_date)
+    if plan.error:
+        raise plan.error
+    return write_day(target_date_str, plan.trains, plan.stops, version)
+
+def write_day(target_date_str, trains, stops, version=None, stop_nodes=None):
+    """Writes a planned day (schedule_planner frames); returns the diff report, None when nothing runs."""
+    if trains is None or trains.empty:
+        if trains is None:
+            print(f"   ⚠️ No active services found for {target_date_str}.")
+        if version:
+            set_status(f"schedule:{target_date_str}", version)  # nothing to plan until the feed changes
+        return None
 
-def populate_todays_schedule(fast_boot=False):
+    # 1. Diff against what is stored: only added / changed trains are written
+    if stop_nodes is None:
+        stop_nodes = stop_node_table(static_data['stops'])
+    stops = stops.merge(stop_nodes[['stop_id', 'infrabel_id', 'station_id']], on='stop_id', how='left')
+    db.session.commit()  # no open session transaction next to the bulk load
+    stored_trains, stored_stops = schedule_loader.stored_day(db.engine, Train.__table__, TrainStop.__table__,
+                                                             target_date_str)
+    diff = schedule_loader.diff_day(trains, stops, stored_trains, stored_stops)
+
+    # 2. Save to DB: changed trains are updated in place and their stops replaced
+    changed = trains[trains['train_number'].isin(diff['added'] + diff['modified'])]
+    schedule_loader.load_day(db.engine, Train.__table__, TrainStop.__table__, target_date_str,
+                             changed, stops[stops['trip_id'].isin(changed['trip_id'])],
+                             replace=True, chunk_size=SYNC_CHUNK_TRAINS)
+    deleted = remove_trains(target_date_str, diff['removed'])
+    if version:
+        set_status(f"schedule:{target_date_str}", version)
+    kept = f" ({len(diff['removed']) - deleted} kept as history)" if deleted < len(diff['removed']) else ""
+    print(f"   ✅ {target_date_str}: +{len(diff['added'])} added, ~{len(diff['modified'])} modified, "
+          f"-{len(diff['removed'])} removed{kept}, {diff['unchanged']} unchanged.")
+    return diff
+
+def populate_todays_schedule(fast_boot=False, workers=1):
     """
     Populates schedule for [today-7, today+7] and cleans up old data.
-    Runs at 4 AM daily.
+    Runs at 4 AM daily. ``workers`` > 1 plans the days in spawned processes
+    that map the feed cache.
     """
     with app.app_context():
         today = datetime.now()
@@ -1014,24 +1332,76 @@ def populate_todays_schedule(fast_boot=False):
             
             # Now delete trains
             db.session.query(Train).filter(or_(Train.date < min_date, Train.date > max_date)).delete(synchronize_session=False)
+            db.session.query(SystemStatus).filter(
+                SystemStatus.key.like('schedule:%'),
+                or_(SystemStatus.key < f"schedule:{min_date}", SystemStatus.key > f"schedule:{max_date}")
+            ).delete(synchronize_session=False)
             db.session.commit()
             print("✅ [CLEANUP] Old data removed.")
         except Exception as e:
             db.session.rollback()
             print(f"❌ [CLEANUP] Failed: {e}")
 
-        # 2. Populate/Update window
-        print(f"📅 [SYNC] Updating schedule for range [-7, +7] (FastBoot={fast_boot})...")
+        # 2. Stored stop nodes follow the station mapping (stale ones are ignored until then)
+        try:
+            restamp_stop_nodes()
+        except Exception as e:
+            db.session.rollback()
+            print(f"   ⚠️ Could not re-resolve stored stop nodes: {e}")
+
+        # 3. Feed version: days already imported with this version are skipped
+        version = None
+        try:
+            feed = feed_cache.feed_version(DATA_FOLDER)
+            if get_status('gtfs_feed_version') != feed:
+                print(f"🆕 [SYNC] New GTFS feed version {feed[:12]}.")
+                set_status('gtfs_feed_version', feed)
+            version = schedule_version()
+        except Exception as e:
+            db.session.rollback()
+            print(f"   ⚠️ Feed version unknown, importing every day: {e}")
+
+        # 4. Populate/Update window: days are planned (in worker processes if asked), written here one by one
+        print(f"📅 [SYNC] Updating schedule for range [-7, +7] (FastBoot={fast_boot}, workers={workers})...")
+        t_sync = time.perf_counter()
+        pending = []
         for i in range(-7, 8):
-            target_date = (today + timedelta(days=i)).strftime("%Y-%m-%d")
-            print(f"   🔄 Syncing {target_date}...")
+            target_date = today + timedelta(days=i)
+            if not import_is_current(target_date.strftime("%Y-%m-%d"), skip_if_exists=fast_boot, version=version):
+                pending.append(target_date)
+
+        report = {}
+        if pending:
             try:
-                # Use fast_boot to skip if data exists
-                import_data(target_date, skip_if_exists=fast_boot)
+                stop_nodes = stop_node_table(static_data['stops'])
             except Exception as e:
-                print(f"   ⚠️ Failed to sync {target_date}: {e}")
-        
-        print("✅ [SYNC] Window update completed.")
+                print(f"   ⚠️ Stop nodes unavailable, resolving per day: {e}")
+                stop_nodes = None
+            feed_source = (FEED_CACHE_DIR, STATIC_FEED_STAMP) if FEED_CACHE_DIR and STATIC_FEED_STAMP else None
+            for plan in schedule_planner.plan_days(static_data, pending, workers=workers, feed_source=feed_source):
+                target_date = plan.date.strftime("%Y-%m-%d")
+                print(f"   🔄 Syncing {target_date}...")
+                t_write = time.perf_counter()
+                try:
+                    if plan.error:
+                        raise plan.error
+                    diff = write_day(target_date, plan.trains, plan.stops, version, stop_nodes=stop_nodes)
+                    if diff:
+                        report[target_date] = diff
+                except Exception as e:
+                    db.session.rollback()
+                    print(f"   ⚠️ Failed to sync {target_date}: {e}")
+                print(f"   ⏱️ {target_date}: plan {plan.seconds:.2f}s, write {time.perf_counter() - t_write:.2f}s")
+        
+        changed = {d: r for d, r in sorted(report.items()) if r['added'] or r['modified'] or r['removed']}
+        for d, r in changed.items():
+            print(f"   📊 {d}: +{len(r['added'])} ~{len(r['modified'])} -{len(r['removed'])}"
+                  f" (e.g. {', '.join((r['added'] + r['modified'] + r['removed'])[:5])})")
+        print(f"✅ [SYNC] Window update completed in {time.perf_counter() - t_sync:.1f}s "
+              f"({len(report)} days compared, {len(changed)} changed).")
+
+    if PREWARM_TRACES:
+        start_trace_prewarm()
 
 # ... (rest of main.py until end)
 
@@ -1077,6 +1447,7 @@ def sync_translations_to_db():
         
         db.session.bulk_save_objects(translations_to_add)
         db.session.commit()
+        invalidate_station_resolver()
         print(f"✅ Vertalingen geladen voor {len(translations_to_add)} unieke stationsnamen.")
         
     except Exception as e:
@@ -1109,6 +1480,27 @@ def migrate_db():
                 db.session.execute(text(f"ALTER TABLE journeys ADD COLUMN sub_type_{i} VARCHAR(10)"))
                 db.session.execute(text(f"ALTER TABLE journeys ADD COLUMN orientation_{i} VARCHAR(20)"))
                 db.session.commit()
+
+        # Check TrainStop columns
+        res = db.session.execute(text("SELECT column_name FROM information_schema.columns WHERE table_name='train_stops'"))
+        existing_cols = [r[0] for r in res]
+        if 'infrabel_id' not in existing_cols:
+            print("   ➕ Adding infrabel_id to train_stops (run 'python manage_data.py backfill' to fill it)")
+            db.session.execute(text("ALTER TABLE train_stops ADD COLUMN infrabel_id VARCHAR(50)"))
+            db.session.execute(text("CREATE INDEX IF NOT EXISTS ix_train_stops_infrabel_id ON train_stops (infrabel_id)"))
+            db.session.commit()
+        if 'station_id' not in existing_cols:
+            print("   ➕ Adding station_id to train_stops (run 'python manage_data.py backfill' to fill it)")
+            db.session.execute(text("ALTER TABLE train_stops ADD COLUMN station_id VARCHAR(50)"))
+            db.session.execute(text("CREATE INDEX IF NOT EXISTS ix_train_stops_station_id ON train_stops (station_id)"))
+            db.session.commit()
+
+        # Check SystemStatus columns
+        res = db.session.execute(text("SELECT column_name FROM information_schema.columns WHERE table_name='system_status'"))
+        if 'value' not in [r[0] for r in res]:
+            print("   ➕ Adding value to system_status")
+            db.session.execute(text("ALTER TABLE system_status ADD COLUMN value VARCHAR(100)"))
+            db.session.commit()
                 
         print("✅ Database migrations checked.")
     except Exception as e:
@@ -1191,6 +1583,9 @@ def update_journey():
         db.session.commit()
         return jsonify({"success": True, "message": "Journey updated"}), 200
         
+    except GraphWarmingError:
+        db.session.rollback()
+        raise
     except Exception as e:
         db.session.rollback()
         return jsonify({"success": False, "error": str(e)}), 500
@@ -1209,14 +1604,89 @@ def api_delete_journey(journey_id):
     return jsonify({"success": True})
 
 @app.route('/api/trace/<int:train_id>')
+@http_cache.compressed
 def api_trace(train_id):
+    """Trace geometry as GeoJSON, or polyline / delta / geobuf via ?format= or Accept.
+
+    ?layout=merged stitches the per-segment features into one continuous line.
+    """
+    fmt = negotiate_format(request.args, request.accept_mimetypes)
+    if fmt is None:
+        return jsonify({"error": f"Unknown format, use one of: {', '.join(FORMATS)}"}), 400
+    layout = request.args.get('layout', 'segments')
+    if layout not in LAYOUTS:
+        return jsonify({"error": f"Unknown layout, use one of: {', '.join(LAYOUTS)}"}), 400
     start_stop = request.args.get('start')
     end_stop = request.args.get('end')
-    geom = get_trace_geometry(train_id, start_stop, end_stop)
+    tolerance = requested_tolerance()
+
+    # The trace depends on the graph, the train's stop list and the Infrabel node each stop
+    # resolves to (stored or via the station mapping), so all of them make up the ETag
+    graph = GRAPH_MANAGER.require()
+    stop_rows = db.session.query(TrainStop.stop_sequence, TrainStop.stop_id, TrainStop.stop_name,
+                                 TrainStop.infrabel_id)\
+        .filter(TrainStop.train_id == train_id).order_by(TrainStop.stop_sequence).all()
+    nodes = stop_infrabel_ids(stop_rows)
+    etag = http_cache.make_etag(graph.version, station_resolver().version,
+                                [(r.stop_sequence, r.stop_id, r.stop_name, node) for r, node in zip(stop_rows, nodes)],
+                                start_stop, end_stop, tolerance, layout, fmt)
+    cache_control = f"public, max-age={TRACE_MAX_AGE}"
+    if stop_rows and http_cache.is_not_modified(etag):
+        response = make_response('', 304)
+        response.vary.add('Accept')
+        return http_cache.conditional(response, etag, cache_control)
+
+    geom = get_trace_geometry(train_id, start_stop, end_stop, tolerance)
     if geom:
-        return jsonify(geom)
+        if layout == 'merged':
+            geom = merge_trace(geom)
+        body, mimetype = encode_trace(geom, fmt)
+        response = make_response(body)
+        response.mimetype = mimetype
+        response.vary.add('Accept')
+        return http_cache.conditional(response, etag, cache_control)
     return jsonify({"error": "No trace data"}), 404
 
+@app.errorhandler(GraphWarmingError)
+def graph_warming(e):
+    response = jsonify({"error": "Railway graph is warming up, retry shortly", "warming": True})
+    response.status_code = 503
+    response.headers['Retry-After'] = '5'
+    return response
+
+@app.route('/api/debug/graph')
+def api_graph_status():
+    return jsonify(GRAPH_MANAGER.status())
+
+@app.route('/api/debug/prewarm')
+def api_prewarm_status():
+    lookups = TRACE_CACHE.hits + TRACE_CACHE.misses
+    return jsonify({
+        **PREWARM_STATUS,
+        "trace_cache": {
+            "size": len(TRACE_CACHE),
+            "hits": TRACE_CACHE.hits,
+            "misses": TRACE_CACHE.misses,
+            "hit_rate": round(TRACE_CACHE.hits / lookups, 3) if lookups else None,
+        },
+    })
+
+@app.route('/api/debug/graph_components')
+def api_graph_components():
+    """Lists the connected components (islands) of the railway graph."""
+    graph = GRAPH_MANAGER.require()
+    limit = request.args.get('limit', 20, type=int)
+    components = graph.component_members()
+    return jsonify({
+        "graph_version": graph.version,
+        "node_count": len(graph),
+        "component_count": len(components),
+        "components": [
+            {"size": len(members), "nodes": sorted(members)[:limit]}
+            for members in components
+        ]
+    })
+
 @app.route('/api/composition/<int:train_id>')
 def api_composition(train_id):
     train = db.session.get(Train, train_id)
@@ -1298,6 +1768,8 @@ def api_log_journey():
         db.session.add(journey)
         db.session.commit()
         return jsonify({"success": True})
+    except GraphWarmingError:
+        raise
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -1400,52 +1872,133 @@ def api_my_history():
         
     return jsonify({"journeys": result})
 
+def user_journey_rows(user_id):
+    """The journey columns that determine a user's coverage, in a stable order."""
+    rows = db.session.query(Journey.id, Journey.train_id, Journey.start_stop_id, Journey.end_stop_id)\
+        .filter(Journey.user_id == user_id).order_by(Journey.id).all()
+    return tuple(tuple(r) for r in rows)
+
+def journey_node_pairs(rows):
+    """(from, to) Infrabel node pairs traced for journey rows (see user_journey_rows), in order."""
+    # Journeys without recorded stops use the whole train: first and last stop, one query for all
+    train_ids = {train_id for _, train_id, start_stop_id, end_stop_id in rows
+                 if train_id and not (start_stop_id and end_stop_id)}
+    train_ends = {}
+    if train_ids:
+        stops = TrainStop.query.filter(TrainStop.train_id.in_(train_ids))\
+            .order_by(TrainStop.train_id, TrainStop.stop_sequence).all()
+        for train_id, group in itertools.groupby(stops, key=lambda s: s.train_id):
+            group = list(group)
+            if len(group) >= 2:
+                train_ends[train_id] = tuple(stop_infrabel_ids([group[0], group[-1]]))
+
+    pairs = []
+    for _, train_id, start_stop_id, end_stop_id in rows:
+        if start_stop_id and end_stop_id:
+            pair = (get_infrabel_id(start_stop_id), get_infrabel_id(end_stop_id))
+        elif train_id:
+            pair = train_ends.get(train_id, (None, None))
+        else:
+            continue
+        if pair[0] and pair[1]:
+            pairs.append(pair)
+    return tuple(pairs)
+
+def user_coverage_segments(user_id, graph, pairs=None):
+    """Set of segment ids covered by a user's journeys (memoised per graph, mapping and node pairs)."""
+    if pairs is None:
+        pairs = journey_node_pairs(user_journey_rows(user_id))
+    key = (graph.version, station_resolver().version, pairs)
+    cached = COVERAGE_CACHE.get(key)
+    if cached is not None:
+        return cached
+
+    # One search per distinct origin (usually the user's home station)
+    all_segments = set()
+    for path_seg_ids in find_paths([p[0] for p in pairs], [p[1] for p in pairs], graph=graph).values():
+        if path_seg_ids: all_segments.update(path_seg_ids)
+    all_segments = frozenset(all_segments)
+    COVERAGE_CACHE.put(key, all_segments)
+    return all_segments
+
 @app.route('/api/coverage')
+@http_cache.compressed
 def api_coverage():
     if 'user_id' not in session:
         return jsonify({"error": "Not logged in"}), 401
     
-    journeys = Journey.query.filter_by(user_id=session['user_id']).all()
-    all_segments = set()
-    
-    for j in journeys:
-        # Trace path for each journey if possible
-        if j.start_stop_id and j.end_stop_id:
-            id1 = get_infrabel_id(j.start_stop_id)
-            id2 = get_infrabel_id(j.end_stop_id)
-            if id1 and id2:
-                path_seg_ids = find_path(id1, id2)
-                if path_seg_ids:
-                    all_segments.update(path_seg_ids)
-        elif j.train_id:
-            # Fallback: full train path if no specific stops recorded
-            stops = TrainStop.query.filter_by(train_id=j.train_id).order_by(TrainStop.stop_sequence).all()
-            if len(stops) >= 2:
-                id1 = get_infrabel_id(stops[0].stop_id)
-                id2 = get_infrabel_id(stops[-1].stop_id)
-                if id1 and id2:
-                    path_seg_ids = find_path(id1, id2)
-                    if path_seg_ids: all_segments.update(path_seg_ids)
+    graph = GRAPH_MANAGER.require()
+    tolerance = requested_tolerance()
+    pairs = journey_node_pairs(user_journey_rows(session['user_id']))
+    # Private: only the user's own browser may keep it, and it must revalidate every time
+    etag = http_cache.make_etag('coverage', graph.version, station_resolver().version, session['user_id'],
+                                pairs, tolerance)
+    if http_cache.is_not_modified(etag):
+        return http_cache.conditional(make_response('', 304), etag, 'private, no-cache')
+    all_segments = user_coverage_segments(session['user_id'], graph, pairs)
             
     features = []
     for seg_id in all_segments:
-        seg = db.session.get(InfrabelStationToStation, seg_id)
-        if seg:
-            try:
-                geom = json.loads(seg.geom_wkt)
-                features.append({
-                    "type": "Feature",
-                    "geometry": geom,
-                    "properties": { "from_id": seg.stationfrom_id, "to_id": seg.stationto_id }
-                })
-            except: continue
+        geom = graph.segment_geometry(seg_id, tolerance)
+        if geom:
+            u, v = graph.segment_endpoints(seg_id)
+            features.append({
+                "type": "Feature",
+                "geometry": geom,
+                "properties": { "from_id": u, "to_id": v }
+            })
             
-    return jsonify({
+    response = jsonify({
         "type": "FeatureCollection",
         "features": features
     })
+    return http_cache.conditional(response, etag, 'private, no-cache')
+
+def tile_response(data, etag, cache_control):
+    if data is None:
+        response = make_response('', 304)
+    else:
+        response = make_response(data)
+        response.mimetype = vector_tiles.MIMETYPE
+    return http_cache.conditional(response, etag, cache_control)
+
+@app.route('/tiles/<int:z>/<int:x>/<int:y>.mvt')
+@http_cache.compressed
+def network_tile(z, x, y):
+    """Infrabel network as a vector tile (layer 'network'), cached on disk per graph version."""
+    if not vector_tiles.valid_tile(z, x, y):
+        return jsonify({"error": "Tile out of range"}), 404
+    graph = GRAPH_MANAGER.require()
+    etag = http_cache.make_etag('network', graph.version, z, x, y)
+    cache_control = f"public, max-age={TILE_MAX_AGE}"
+    if http_cache.is_not_modified(etag):
+        return tile_response(None, etag, cache_control)
+    data = TILE_CACHE.get(graph.version, 'network', z, x, y)
+    if data is None:
+        data = vector_tiles.encode_tile({"network": vector_tiles.segment_features(graph, z, x, y)})
+        TILE_CACHE.put(graph.version, 'network', z, x, y, data)
+    return tile_response(data, etag, cache_control)
+
+@app.route('/tiles/coverage/<int:z>/<int:x>/<int:y>.mvt')
+@http_cache.compressed
+def coverage_tile(z, x, y):
+    """Segments driven by the session user as a vector tile (layer 'coverage')."""
+    if 'user_id' not in session:
+        return jsonify({"error": "Not logged in"}), 401
+    if not vector_tiles.valid_tile(z, x, y):
+        return jsonify({"error": "Tile out of range"}), 404
+    graph = GRAPH_MANAGER.require()
+    pairs = journey_node_pairs(user_journey_rows(session['user_id']))
+    etag = http_cache.make_etag('coverage', graph.version, station_resolver().version, session['user_id'],
+                                pairs, z, x, y)
+    if http_cache.is_not_modified(etag):
+        return tile_response(None, etag, 'private, no-cache')
+    segments = user_coverage_segments(session['user_id'], graph, pairs)
+    features = vector_tiles.segment_features(graph, z, x, y, segments) if segments else []
+    return tile_response(vector_tiles.encode_tile({"coverage": features}), etag, 'private, no-cache')
 
 @app.route('/api/monthly_coverage')
+@http_cache.compressed
 def api_monthly_coverage():
     if 'user_id' not in session:
         return jsonify({"error": "Not logged in"}), 401
@@ -1471,8 +2024,9 @@ def api_monthly_coverage():
     ).all()
     
     features = []
+    tolerance = requested_tolerance()
     for j in journeys:
-        trace = get_trace_geometry(j.train_id, j.start_stop_id, j.end_stop_id)
+        trace = get_trace_geometry(j.train_id, j.start_stop_id, j.end_stop_id, tolerance)
         if trace and trace['type'] == 'FeatureCollection':
             features.extend(trace['features'])
             
@@ -1482,6 +2036,7 @@ def api_monthly_coverage():
     })
 
 @app.route('/api/range_coverage')
+@http_cache.compressed
 def api_range_coverage():
     if 'user_id' not in session:
         return jsonify({"error": "Not logged in"}), 401
@@ -1508,8 +2063,9 @@ def api_range_coverage():
     ).all()
     
     features = []
+    tolerance = requested_tolerance()
     for j in journeys:
-        trace = get_trace_geometry(j.train_id, j.start_stop_id, j.end_stop_id)
+        trace = get_trace_geometry(j.train_id, j.start_stop_id, j.end_stop_id, tolerance)
         if trace and trace['type'] == 'FeatureCollection':
             features.extend(trace['features'])
             
@@ -1586,6 +2142,17 @@ def api_wrapped():
     unique_units_set = set()
     total_km = 0.0
 
+    # Resolve all journey endpoints up front: find_paths then runs one search per origin
+    journey_pairs = {}
+    for j in journeys:
+        if j.start_stop_id and j.end_stop_id:
+            id1 = get_infrabel_id(j.start_stop_id)
+            id2 = get_infrabel_id(j.end_stop_id)
+            if id1 and id2:
+                journey_pairs[j.id] = (id1, id2)
+    graph = GRAPH_MANAGER.require()
+    journey_paths = find_paths([p[0] for p in journey_pairs.values()], [p[1] for p in journey_pairs.values()], graph=graph)
+
     for j in journeys:
         total_km += (j.distance_km or 0.0)
         
@@ -1657,16 +2224,15 @@ def api_wrapped():
                 route_stats[r_key] = route_stats.get(r_key, 0) + 1
                 
                 # Segments
-                id1 = get_infrabel_id(j.start_stop_id)
-                id2 = get_infrabel_id(j.end_stop_id)
-                if id1 and id2:
-                    path = find_path(id1, id2)
+                pair = journey_pairs.get(j.id)
+                if pair:
+                    path = journey_paths[pair]
                     if path:
                         for seg_id in path:
-                            seg = db.session.get(InfrabelStationToStation, seg_id)
-                            if seg:
+                            ends = graph.segment_endpoints(seg_id)
+                            if ends and not (isinstance(seg_id, str) and seg_id.startswith('V_')):
                                 # Unified Segment: Sort IDs to ensure A->B == B->A
-                                ids = sorted([seg.stationfrom_id, seg.stationto_id])
+                                ids = sorted(ends)
                                 seg_key = f"{ids[0]} - {ids[1]}"
                                 segment_stats[seg_key] = segment_stats.get(seg_key, 0) + 1
 
@@ -1765,12 +2331,11 @@ def get_translated_stop(stop_name_or_id):
 
 def get_op_name(op_id):
     """Resolves Infrabel ID or PTCAR ID to a name."""
-    op = InfrabelOperationalPoint.query.filter_by(id=op_id).first()
-    if not op:
-        op = InfrabelOperationalPoint.query.filter_by(ptcar_id=op_id).first()
-    if op:
+    names = station_resolver().op_names(op_id)
+    if names:
+        name_nl, name_fr = names
         lang = get_locale()
-        return op.name_nl if lang == 'nl' else (op.name_fr or op.name_nl)
+        return name_nl if lang == 'nl' else (name_fr or name_nl)
     return op_id
 
 # ==========================================
@@ -1788,7 +2353,10 @@ def inject():
     except:
         pass
 
-    return dict(t=t, current_lang=get_locale(), now=datetime.now(), last_update=last_update_time)
+    # Lets the map pick the geometry level of coverage layers (and refetch when zooming in)
+    geometry_levels = {'tolerances': [0.0] + sorted(GEOMETRY_TOLERANCES), 'meters_per_pixel_z0': METERS_PER_PIXEL_Z0}
+    return dict(t=t, current_lang=get_locale(), now=datetime.now(), last_update=last_update_time,
+                geometry_levels=geometry_levels)
 
 @app.template_filter('format_date')
 def format_date(value):
@@ -1899,6 +2467,15 @@ def set_lang():
     if lang in TRANSLATIONS: session['lang'] = lang
     return jsonify({"success": True})
 
+@app.route('/api/station_suggestions')
+def api_station_suggestions():
+    """Station autocomplete: best matches for ?q= (accent / typo tolerant), most used stations first."""
+    q = request.args.get('q', '').strip()
+    limit = min(request.args.get('limit', 10, type=int), 50)
+    if not q: return jsonify([])
+    lang = get_locale()
+    return jsonify([station.as_dict(lang) for station in station_search().search(q, limit)])
+
 @app.route('/api/search_suggestions')
 def search_suggestions():
     q = request.args.get('q', '').strip()
@@ -1995,37 +2572,20 @@ def api_plan_journey():
     hour_param = request.args.get('hour', '')
     
     # 1. Resolve 'from' and 'to' stations
-    def resolve_stations(name):
-        search_query = name.lower()
-        matched = StopTranslation.query.filter(
-            or_(
-                StopTranslation.translation.ilike(f"%{search_query}%"),
-                StopTranslation.field_value.ilike(f"%{search_query}%")
-            )
-        ).all()
-        ids = [m.stop_id for m in matched]
-        names = [m.field_value for m in matched]
-        return ids, names
-
-    from_ids, from_names = resolve_stations(from_name)
-    to_ids, to_names = resolve_stations(to_name)
-    
-    if not from_ids and not from_names: return jsonify([])
-    if not to_ids and not to_names: return jsonify([])
+    from_stations = station_search().matching(from_name)
+    to_stations = station_search().matching(to_name)
+    if not from_stations or not to_stations: return jsonify([])
 
     # 2. Query trains that stop at BOTH (A -> B order)
     t1 = aliased(TrainStop)
     t2 = aliased(TrainStop)
     
-    f_ids = [t1.stop_id.like(f"{sid}%") for sid in from_ids] + [t1.stop_name == name for name in from_names]
-    t_ids = [t2.stop_id.like(f"{sid}%") for sid in to_ids] + [t2.stop_name == name for name in to_names]
-    
     query = db.session.query(Train, t1.stop_id.label('start_id'), t2.stop_id.label('end_id'))\
         .join(t1, Train.id == t1.train_id).join(t2, Train.id == t2.train_id)
     
     query = query.filter(Train.date == target_date)
-    query = query.filter(or_(*f_ids))
-    query = query.filter(or_(*t_ids))
+    query = query.filter(station_name_filter(t1, from_name, from_stations))
+    query = query.filter(station_name_filter(t2, to_name, to_stations))
     query = query.filter(t1.stop_sequence < t2.stop_sequence)
     
     if hour_param:
@@ -2068,25 +2628,8 @@ def api_search_trains():
         if date_param: query = query.filter(Train.date == date_param)
         trains = query.order_by(Train.date.desc()).limit(20).all()
     else:
-        # Station search: join with TrainStop and StopTranslation
-        search_query = q.lower()
-        matched_translations = StopTranslation.query.filter(
-            or_(
-                StopTranslation.translation.ilike(f"%{search_query}%"),
-                StopTranslation.field_value.ilike(f"%{search_query}%")
-            )
-        ).all()
-        
-        target_stop_ids = [m.stop_id for m in matched_translations]
-        station_names = [m.field_value for m in matched_translations]
-        
-        query = Train.query.join(TrainStop)
-        if target_stop_ids:
-            id_filters = [TrainStop.stop_id.like(f"{sid}%") for sid in target_stop_ids]
-            name_filters = [TrainStop.stop_name == name for name in station_names]
-            query = query.filter(or_(*id_filters, *name_filters))
-        else:
-            query = query.filter(TrainStop.stop_name.ilike(f"%{search_query}%"))
+        # Station search: join with TrainStop, stations from the in-memory search index
+        query = Train.query.join(TrainStop).filter(station_name_filter(TrainStop, q))
             
         trains = query.distinct().order_by(Train.date.desc(), Train.departure_time.desc()).limit(20).all()
 
@@ -2113,23 +2656,7 @@ def api_station_board():
     target_date = raw_date if raw_date else datetime.now().strftime("%Y-%m-%d")
     hour_param = request.args.get('hour', '')
     
-    search_query = station_name.lower()
-    matched = StopTranslation.query.filter(
-        or_(
-            StopTranslation.translation.ilike(f"%{search_query}%"),
-            StopTranslation.field_value.ilike(f"%{search_query}%")
-        )
-    ).all()
-    
-    ids = [m.stop_id for m in matched]
-    names = [m.field_value for m in matched]
-    
-    if not ids and not names:
-        query = Train.query.join(TrainStop).filter(TrainStop.stop_name.ilike(f"%{search_query}%"))
-    else:
-        id_filters = [TrainStop.stop_id.like(f"{sid}%") for sid in ids]
-        name_filters = [TrainStop.stop_name == name for name in names]
-        query = Train.query.join(TrainStop).filter(or_(*id_filters, *name_filters))
+    query = Train.query.join(TrainStop).filter(station_name_filter(TrainStop, station_name))
         
     query = query.filter(Train.date == target_date)
     
@@ -2171,7 +2698,7 @@ def search():
     if not q: return redirect(url_for('index'))
     
     query = db.session.query(Train)
-    target_stop_ids = []
+    target_station_ids = []
     station_names_to_match = []
 
     if search_type == 'train_number':
@@ -2187,28 +2714,13 @@ def search():
         query = query.join(TrainUnit).filter(TrainUnit.material_type.ilike(f"{q}%"))
     elif search_type == 'station':
         search_query = q.lower()
-        # 1. Zoek matchende stations in de vertalingstabel
-        matched = db.session.query(StopTranslation).filter(
-            or_(
-                StopTranslation.translation.ilike(f"%{search_query}%"),
-                StopTranslation.field_value.ilike(f"%{search_query}%")
-            )
-        ).all()
-        
-        target_stop_ids = [m.stop_id for m in matched]
-        station_names_to_match = [m.field_value for m in matched]
+        # 1. Zoek matchende stations in de (in-memory) zoekindex
+        matched = station_search().matching(q)
+        target_station_ids = matched_station_keys(matched)
+        station_names_to_match = [st.name for st in matched]
 
         # 2. Query: Zoek ritten die OF het ID OF de naam bevatten (robuuster)
-        if target_stop_ids:
-            # We gebruiken 'like' op het stop_id om platform-extensies te vangen (bv. 8833001%)
-            # OF we zoeken op de officiële namen die we hebben gevonden
-            id_filters = [TrainStop.stop_id.like(f"{sid}%") for sid in target_stop_ids]
-            name_filters = [TrainStop.stop_name == name for name in station_names_to_match]
-            
-            query = query.join(TrainStop).filter(or_(*id_filters, *name_filters))
-        else:
-            # Volledige fallback op de tekstuele stationsnaam
-            query = query.join(TrainStop).filter(TrainStop.stop_name.ilike(f"%{search_query}%"))
+        query = query.join(TrainStop).filter(station_name_filter(TrainStop, q, matched))
         
         # 3. Datum filtering
         if search_date:
@@ -2230,9 +2742,9 @@ def search():
         
         if search_type == 'station':
             # Zoek de halte in deze rit die het beste matcht met wat de gebruiker zocht
-            # We kijken eerst naar ID (prefix match voor platformen) en dan naar naam
+            # We kijken eerst naar het station_id (dekt alle perrons) en dan naar naam
             rel_stop = next((s for s in train.stops if 
-                            any(s.stop_id.startswith(sid) for sid in target_stop_ids) or 
+                            s.station_id in target_station_ids or 
                             s.stop_name in station_names_to_match or 
                             search_query in s.stop_name.lower()), None)
             
@@ -2354,39 +2866,25 @@ def ensure_infrabel_data():
                 df_stops['stop_lat'] = pd.to_numeric(df_stops['stop_lat'])
                 df_stops['stop_lon'] = pd.to_numeric(df_stops['stop_lon'])
                 
-                def haversine(lat1, lon1, lat2, lon2):
-                    if lat1 is None or lon1 is None or lat2 is None or lon2 is None: return 999
-                    R = 6371 
-                    dlat = math.radians(lat2 - lat1)
-                    dlon = math.radians(lon2 - lon1)
-                    a = math.sin(dlat/2)**2 + math.cos(math.radians(lat1)) * math.cos(math.radians(lat2)) * math.sin(dlon/2)**2
-                    c = 2 * math.atan2(math.sqrt(a), math.sqrt(1-a))
-                    return R * c
+                # Closest operational point per stop (threshold: 0.2 km = 200 meter by default)
+                index = PointIndex([op.id for op in all_ops], [op.latitude for op in all_ops],
+                                   [op.longitude for op in all_ops], cell_km=AUTO_MAPPING_RADIUS_KM)
+                matches = index.nearest_many(df_stops['stop_lat'].tolist(), df_stops['stop_lon'].tolist(),
+                                             AUTO_MAPPING_RADIUS_KM)
 
                 mapping_count = 0
-                for _, s in df_stops.iterrows():
-                    slat, slon = s['stop_lat'], s['stop_lon']
-                    if pd.isna(slat): continue
-                    
-                    best_op = None
-                    min_dist = 999
-                    for op in all_ops:
-                        dist = haversine(slat, slon, op.latitude, op.longitude)
-                        if dist < min_dist:
-                            min_dist = dist
-                            best_op = op
-                    
-                    # Threshold: 0.2 km (200 meter)
-                    if best_op and min_dist < 0.2:
+                for stop_id, stop_name, match in zip(df_stops['stop_id'], df_stops['stop_name'], matches):
+                    if match:
                         db.session.add(StationMapping(
-                            sncb_id=s['stop_id'],
-                            infrabel_id=best_op.id, # Symbolic name
-                            name=s['stop_name']
+                            sncb_id=stop_id,
+                            infrabel_id=match[0], # Symbolic name
+                            name=stop_name
                         ))
                         mapping_count += 1
                 db.session.commit()
                 print(f"   ✅ Mapping complete ({mapping_count} stations mapped).")
             
+            invalidate_station_resolver()
             print("🚀 Infrastructure auto-ingestion completed successfully.")
             
             print("🚀 Infrastructure auto-ingestion completed successfully.")
@@ -2419,7 +2917,7 @@ def run_startup_tasks():
                 print(f"🌅 [BACKEND] Running sync for {current_date} (Force: {force_first_run})...")
                 # On startup (Force=True), skip existing days to unblock server quickly.
                 # On daily schedule (Force=False), do full sync.
-                populate_todays_schedule(fast_boot=force_first_run)
+                populate_todays_schedule(fast_boot=force_first_run, workers=SYNC_WORKERS)
                 last_sync_date = current_date
                 force_first_run = False
                 print("✅ [BACKEND] Sync completed.")
@@ -2433,5 +2931,6 @@ if __name__ == '__main__':
     debug_mode = os.environ.get('FLASK_DEBUG', '0') == '1'
     app.run(host='0.0.0.0', port=5000, debug=debug_mode, use_reloader=debug_mode)
 else:
-    if not os.environ.get('FLASK_TESTING'):
+    # Planner worker processes import main too; only the main process runs the startup tasks
+    if not os.environ.get('FLASK_TESTING') and multiprocessing.current_process().name == 'MainProcess':
         threading.Thread(target=run_startup_tasks, daemon=True).start()
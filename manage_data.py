@@ -2,7 +2,9 @@ import os
 import sys
 import pandas as pd
 from datetime import datetime
-from main import app, db, Train, TrainStop, sync_day
+from main import app, db, Train, TrainStop, sync_day, compile_railway_graph, graph_source_stamp, backfill_stop_nodes, GRAPH_SNAPSHOT_PATH, \
+    load_static_data, populate_todays_schedule, SYNC_WORKERS
+from railway_graph import write_snapshot
 
 def delete_day(date_str):
     """Deletes all trains and stops for a specific date (YYYYMMDD)."""
@@ -29,9 +31,41 @@ def load_day(date_str):
     with app.app_context():
         sync_day(dt)
 
+def write_graph_snapshot():
+    """Rebuilds the railway graph and (over)writes the shared snapshot file."""
+    if not GRAPH_SNAPSHOT_PATH:
+        print("❌ GRAPH_SNAPSHOT_PATH is leeg, snapshots staan uit.")
+        return
+    with app.app_context():
+        graph = compile_railway_graph()
+        write_snapshot(graph, GRAPH_SNAPSHOT_PATH, graph_source_stamp())
+    print(f"✅ Graph snapshot geschreven naar {GRAPH_SNAPSHOT_PATH} (versie {graph.version[:8]}).")
+
+def backfill_infrabel_ids(redo_all=False):
+    """Fills train_stops.infrabel_id for existing rows ('all' also re-resolves filled rows)."""
+    with app.app_context():
+        backfill_stop_nodes(only_missing=not redo_all)
+
+def sync_window(workers=SYNC_WORKERS):
+    """Syncs the [-7, +7] window, planning the days in ``workers`` processes (needs FEED_CACHE_DIR)."""
+    load_static_data()
+    populate_todays_schedule(workers=workers)
+
 if __name__ == "__main__":
+    if len(sys.argv) >= 2 and sys.argv[1].lower() == "snapshot":
+        write_graph_snapshot()
+        sys.exit(0)
+
+    if len(sys.argv) >= 2 and sys.argv[1].lower() == "window":
+        sync_window(int(sys.argv[2]) if len(sys.argv) >= 3 else SYNC_WORKERS)
+        sys.exit(0)
+
+    if len(sys.argv) >= 2 and sys.argv[1].lower() == "backfill":
+        backfill_infrabel_ids(redo_all=len(sys.argv) >= 3 and sys.argv[2].lower() == "all")
+        sys.exit(0)
+
     if len(sys.argv) < 3:
-        print("Gebruik: python manage_data.py [load|delete] [YYYYMMDD]")
+        print("Gebruik: python manage_data.py [load|delete] [YYYYMMDD] | snapshot | backfill [all] | window [workers]")
         sys.exit(1)
 
     action = sys.argv[1].lower()
@@ -0,0 +1,1154 @@
+"""Compiled railway graph used for tracing trains over the Infrabel network.
+
+The graph is stored in CSR (compressed sparse row) form: every node id is
+interned to an integer, the outgoing edges of node ``i`` live in the slice
+``offsets[i]:offsets[i + 1]`` of the ``targets`` / ``weights`` /
+``edge_segments`` arrays, and ``edge_segments`` points into the segment table
+(real ``InfrabelStationToStation`` ids or virtual ``V_...`` ids).
+"""
+import heapq
+import json
+import math
+import mmap
+import os
+import struct
+import sys
+import hashlib
+import threading
+import time
+from array import array
+from collections import OrderedDict
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # not on Windows; snapshot builds are then only single-flight per process
+    fcntl = None
+
+INF = float('inf')
+NAN = float('nan')
+
+# Smallest factor any real edge weight gets relative to its track length
+# (the ANS <-> FLV HSL preference). Scales the A* haversine lower bound.
+MIN_EDGE_MULTIPLIER = 0.8
+
+ROUTING_MODES = ('dijkstra', 'astar', 'bidirectional', 'ch')
+
+# Snapshot file layout: magic, little-endian u64 meta length, JSON meta, then
+# every array as a raw native-endian section starting on an 8-byte boundary.
+SNAPSHOT_MAGIC = b'TMGRAPH2'
+SNAPSHOT_ALIGN = 8
+_GRAPH_SECTIONS = ('offsets', 'targets', 'weights', 'edge_segments', 'segment_lengths',
+                   'node_lat', 'node_lon', 'components')
+_GEOMETRY_SECTIONS = ('kinds', 'part_offsets', 'coord_offsets', 'coords', 'bboxes')
+
+# Douglas-Peucker tolerances (metres) precomputed per segment, next to full detail (0)
+GEOMETRY_TOLERANCES = (5.0, 20.0, 80.0, 300.0, 1000.0)
+# Web-mercator metres per pixel at zoom 0, at Belgian latitudes (~50.5 N)
+METERS_PER_PIXEL_Z0 = 156543.03 * math.cos(math.radians(50.5))
+_CH_SECTIONS = ('rank', 'up_offsets', 'up_targets', 'up_weights', 'up_arcs',
+                'arc_u', 'arc_v', 'arc_mid', 'arc_first', 'arc_second', 'arc_edge')
+
+
+EARTH_RADIUS_KM = 6371.0
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    R = EARTH_RADIUS_KM
+    dlat = math.radians(lat2 - lat1)
+    dlon = math.radians(lon2 - lon1)
+    a = math.sin(dlat / 2)**2 + math.cos(math.radians(lat1)) * math.cos(math.radians(lat2)) * math.sin(dlon / 2)**2
+    return 2 * R * math.atan2(math.sqrt(a), math.sqrt(1 - a))
+
+
+def tolerance_for_zoom(zoom):
+    """Simplification tolerance (metres) that stays under half a pixel at a map zoom level."""
+    return METERS_PER_PIXEL_Z0 / (2 ** max(0.0, float(zoom))) / 2
+
+
+class CompiledGraph:
+    """Immutable CSR graph with a segment table and shortest-path queries."""
+
+    def __init__(self, node_ids, offsets, targets, weights, edge_segments,
+                 segment_ids, segment_lengths, segment_ends, node_lat=None, node_lon=None,
+                 min_multiplier=MIN_EDGE_MULTIPLIER, components=None, geometry_levels=None):
+        self.node_ids = node_ids
+        self.node_index = {nid: i for i, nid in enumerate(node_ids)}
+        self.offsets = offsets
+        self.targets = targets
+        self.weights = weights
+        self.edge_segments = edge_segments
+        self.segment_ids = segment_ids
+        self.segment_index = {sid: i for i, sid in enumerate(segment_ids)}
+        self.segment_lengths = segment_lengths
+        self.segment_ends = segment_ends
+        n = len(node_ids)
+        self.node_lat = node_lat if node_lat is not None else array('d', [NAN]) * n
+        self.node_lon = node_lon if node_lon is not None else array('d', [NAN]) * n
+        self.min_multiplier = min_multiplier
+        self.components = components if components is not None else self._label_components()
+        if geometry_levels is None:
+            geometry_levels = [(0.0, SegmentGeometries.from_geojson(len(segment_ids), ()))]
+        # (tolerance, SegmentGeometries) pairs, full detail first, coarser levels after
+        self.geometry_levels = geometry_levels
+        self.geometries = geometry_levels[0][1]
+        self._portal_dist = None
+        self._xyz = None
+        self._version = None
+        self.ch = None
+
+    @classmethod
+    def empty(cls):
+        return cls([], array('i', [0]), array('i'), array('d'), array('i'), [], array('d'), [])
+
+    @classmethod
+    def from_edges(cls, edges, segment_lengths=None, coords=None, min_multiplier=MIN_EDGE_MULTIPLIER,
+                   geometries=None, tolerances=GEOMETRY_TOLERANCES):
+        """Compiles undirected ``(u, v, weight, seg_id)`` edges into CSR arrays.
+
+        Each edge is added in both directions, in input order, so neighbour
+        order matches the old dict-of-lists adjacency. ``segment_lengths``
+        maps seg_id -> raw track length (km) for distance sums, ``coords``
+        maps node id -> (lat, lon) for goal-directed search and
+        ``geometries`` maps seg_id -> GeoJSON (string or dict) for drawing;
+        a simplified copy is kept for each of ``tolerances``.
+        """
+        segment_lengths = segment_lengths or {}
+        node_index = {}
+        node_ids = []
+        segment_index = {}
+        segment_ids = []
+        seg_lengths = array('d')
+        segment_ends = []
+        arcs = []
+
+        def intern(nid):
+            idx = node_index.get(nid)
+            if idx is None:
+                idx = node_index[nid] = len(node_ids)
+                node_ids.append(nid)
+            return idx
+
+        for u, v, w, seg_id in edges:
+            ui, vi = intern(u), intern(v)
+            si = segment_index.get(seg_id)
+            if si is None:
+                si = segment_index[seg_id] = len(segment_ids)
+                segment_ids.append(seg_id)
+                length = segment_lengths.get(seg_id)
+                seg_lengths.append(float(length) if length is not None else float('nan'))
+                segment_ends.append((u, v))
+            arcs.append((ui, vi, float(w), si))
+            arcs.append((vi, ui, float(w), si))
+
+        n = len(node_ids)
+        degree = [0] * (n + 1)
+        for ui, _, _, _ in arcs:
+            degree[ui + 1] += 1
+        for i in range(n):
+            degree[i + 1] += degree[i]
+        offsets = array('i', degree)
+
+        m = len(arcs)
+        targets = array('i', bytes(4 * m))
+        weights = array('d', bytes(8 * m))
+        edge_segments = array('i', bytes(4 * m))
+        cursor = list(degree[:n])
+        for ui, vi, w, si in arcs:
+            pos = cursor[ui]
+            targets[pos] = vi
+            weights[pos] = w
+            edge_segments[pos] = si
+            cursor[ui] = pos + 1
+
+        coords = coords or {}
+        node_lat = array('d', [NAN]) * n
+        node_lon = array('d', [NAN]) * n
+        for i, nid in enumerate(node_ids):
+            c = coords.get(nid)
+            if c and c[0] is not None and c[1] is not None:
+                node_lat[i], node_lon[i] = float(c[0]), float(c[1])
+
+        geometries = geometries or {}
+        store = SegmentGeometries.from_geojson(len(segment_ids), (geometries.get(sid) for sid in segment_ids))
+        levels = [(0.0, store)] + [(float(tol), store.simplified(tol)) for tol in sorted(tolerances)]
+        return cls(node_ids, offsets, targets, weights, edge_segments,
+                   segment_ids, seg_lengths, segment_ends, node_lat, node_lon, min_multiplier,
+                   geometry_levels=levels)
+
+    def __len__(self):
+        return len(self.node_ids)
+
+    def __contains__(self, node_id):
+        return node_id in self.node_index
+
+    @property
+    def edge_count(self):
+        return len(self.targets)
+
+    @property
+    def version(self):
+        """Content hash of nodes, edges and weights; equal graphs share a version across processes."""
+        if self._version is None:
+            h = hashlib.sha1()
+            h.update('\x1f'.join(self.node_ids).encode('utf-8'))
+            h.update('\x1f'.join(str(sid) for sid in self.segment_ids).encode('utf-8'))
+            for arr in (self.offsets, self.targets, self.weights, self.edge_segments):
+                h.update(memoryview(arr).cast('B'))
+            self._version = h.hexdigest()
+        return self._version
+
+    def _label_components(self):
+        """Connected-component id per node (BFS over the CSR arrays)."""
+        n = len(self.node_ids)
+        offsets, targets = self.offsets, self.targets
+        labels = array('i', [-1]) * n
+        label = 0
+        for root in range(n):
+            if labels[root] >= 0:
+                continue
+            labels[root] = label
+            stack = [root]
+            while stack:
+                u = stack.pop()
+                for e in range(offsets[u], offsets[u + 1]):
+                    v = targets[e]
+                    if labels[v] < 0:
+                        labels[v] = label
+                        stack.append(v)
+            label += 1
+        return labels
+
+    def connected(self, node_a, node_b):
+        """O(1) reachability check between two node ids."""
+        a = self.node_index.get(node_a)
+        b = self.node_index.get(node_b)
+        return a is not None and b is not None and self.components[a] == self.components[b]
+
+    def component_members(self):
+        """Lists of node ids per component, largest component first."""
+        groups = {}
+        for i, label in enumerate(self.components):
+            groups.setdefault(label, []).append(self.node_ids[i])
+        return sorted(groups.values(), key=len, reverse=True)
+
+    def segment_length(self, seg_id):
+        """Raw track length in km, or None for virtual/unknown segments."""
+        si = self.segment_index.get(seg_id)
+        if si is None:
+            return None
+        length = self.segment_lengths[si]
+        return None if length != length else length
+
+    def geometry_level(self, tolerance=0.0):
+        """Coarsest precomputed geometry whose tolerance does not exceed ``tolerance`` (metres)."""
+        chosen = self.geometry_levels[0][1]
+        for tol, store in self.geometry_levels:
+            if tol > tolerance:
+                break
+            chosen = store
+        return chosen
+
+    def segment_geometry(self, seg_id, tolerance=0.0):
+        """GeoJSON geometry of a segment, rebuilt from the coordinate arrays (None if unknown)."""
+        si = self.segment_index.get(seg_id)
+        return None if si is None else self.geometry_level(tolerance).geojson(si)
+
+    def segment_endpoints(self, seg_id):
+        """(stationfrom_id, stationto_id) of a segment, or None."""
+        si = self.segment_index.get(seg_id)
+        return None if si is None else self.segment_ends[si]
+
+    def node_coords(self, node_id):
+        """[lon, lat] of a node (GeoJSON order), or None when it has no location."""
+        i = self.node_index.get(node_id)
+        if i is None:
+            return None
+        lat, lon = self.node_lat[i], self.node_lon[i]
+        if lat != lat or lon != lon:
+            return None
+        return [lon, lat]
+
+    def shortest_path(self, start_node, end_node, mode='dijkstra'):
+        """Shortest path between two node ids as a list of segment ids, or None.
+
+        ``mode`` is one of ROUTING_MODES; all modes return a minimum-weight path.
+        'ch' needs build_contraction_hierarchy() first and uses A* until then.
+        """
+        s = self.node_index.get(start_node)
+        t = self.node_index.get(end_node)
+        if s is None or t is None:
+            return None
+        if s == t:
+            return []
+        if self.components[s] != self.components[t]:
+            return None
+        if mode == 'ch':
+            if self.ch is None:
+                return self._astar(s, t)
+            edges = self.ch.query(s, t)
+            if edges is None:
+                return None
+            return [self.segment_ids[self.edge_segments[e]] for e in edges]
+        if mode == 'astar':
+            return self._astar(s, t)
+        if mode == 'bidirectional':
+            return self._bidirectional(s, t)
+        return self._dijkstra(s, t)
+
+    def shortest_paths(self, start_node, end_nodes):
+        """One Dijkstra search from ``start_node`` to several end nodes.
+
+        The search stops as soon as every reachable end node is settled.
+        Returns ``{end_node: segment ids or None}``.
+        """
+        s = self.node_index.get(start_node)
+        result = {}
+        pending = {}
+        for end_node in end_nodes:
+            t = self.node_index.get(end_node)
+            if s is None or t is None or self.components[s] != self.components[t]:
+                result[end_node] = None
+            elif t == s:
+                result[end_node] = []
+            else:
+                pending[t] = end_node
+        if not pending:
+            return result
+
+        offsets, targets, weights = self.offsets, self.targets, self.weights
+        dist = [INF] * len(self.node_ids)
+        pred_edge = [-1] * len(self.node_ids)
+        dist[s] = 0.0
+        queue = [(0.0, s)]
+        while queue:
+            d, u = heapq.heappop(queue)
+            if d > dist[u]:
+                continue
+            end_node = pending.pop(u, None)
+            if end_node is not None:
+                result[end_node] = self._unwind(pred_edge, s, u)
+                if not pending:
+                    break
+            for e in range(offsets[u], offsets[u + 1]):
+                v = targets[e]
+                nd = d + weights[e]
+                if nd < dist[v]:
+                    dist[v] = nd
+                    pred_edge[v] = e
+                    heapq.heappush(queue, (nd, v))
+        for end_node in pending.values():
+            result[end_node] = None
+        return result
+
+    def _dijkstra(self, s, t):
+        offsets, targets, weights = self.offsets, self.targets, self.weights
+        dist = [INF] * len(self.node_ids)
+        pred_edge = [-1] * len(self.node_ids)
+        dist[s] = 0.0
+        queue = [(0.0, s)]
+        while queue:
+            d, u = heapq.heappop(queue)
+            if d > dist[u]:
+                continue
+            if u == t:
+                return self._unwind(pred_edge, s, t)
+            for e in range(offsets[u], offsets[u + 1]):
+                v = targets[e]
+                nd = d + weights[e]
+                if nd < dist[v]:
+                    dist[v] = nd
+                    pred_edge[v] = e
+                    heapq.heappush(queue, (nd, v))
+        return None
+
+    def _unit_vectors(self):
+        """Per-node 3D unit vectors; chord length * R is a cheap lower bound on haversine."""
+        if self._xyz is not None:
+            return self._xyz
+        lat, lon = self.node_lat, self.node_lon
+        n = len(self.node_ids)
+        xs, ys, zs = array('d', [NAN]) * n, array('d', [NAN]) * n, array('d', [NAN]) * n
+        for i in range(n):
+            if lat[i] == lat[i]:
+                phi, lam = math.radians(lat[i]), math.radians(lon[i])
+                xs[i] = math.cos(phi) * math.cos(lam)
+                ys[i] = math.cos(phi) * math.sin(lam)
+                zs[i] = math.sin(phi)
+        self._xyz = (xs, ys, zs)
+        return self._xyz
+
+    def _portal_distances(self):
+        """Per-node chord distance (km) to the nearest "portal" node.
+
+        An edge is cheap when ``weight < min_multiplier * chord(u, v)`` (the
+        0.1 km virtual airport links) or when an endpoint has no coordinates.
+        Portals are the located endpoints of cheap edges; any path that uses
+        a cheap edge costs at least
+        ``min_multiplier * (portal_dist[v] + portal_dist[t])``, which keeps
+        the A* bound admissible and consistent despite those edges.
+        """
+        if self._portal_dist is not None:
+            return self._portal_dist
+        xs, ys, zs = self._unit_vectors()
+        c = self.min_multiplier
+        offsets, targets, weights = self.offsets, self.targets, self.weights
+        n = len(self.node_ids)
+        portals = set()
+        for u in range(n):
+            for e in range(offsets[u], offsets[u + 1]):
+                v = targets[e]
+                u_known, v_known = xs[u] == xs[u], xs[v] == xs[v]
+                if u_known and v_known:
+                    chord = EARTH_RADIUS_KM * math.sqrt((xs[u] - xs[v])**2 + (ys[u] - ys[v])**2 + (zs[u] - zs[v])**2)
+                    if weights[e] < c * chord:
+                        portals.add(u)
+                        portals.add(v)
+                else:
+                    if u_known: portals.add(u)
+                    if v_known: portals.add(v)
+        portal_dist = array('d', [INF]) * n
+        for v in range(n):
+            if xs[v] != xs[v]:
+                continue
+            best = INF
+            for p in portals:
+                d = EARTH_RADIUS_KM * math.sqrt((xs[v] - xs[p])**2 + (ys[v] - ys[p])**2 + (zs[v] - zs[p])**2)
+                if d < best:
+                    best = d
+            portal_dist[v] = best
+        self._portal_dist = portal_dist
+        return portal_dist
+
+    def _astar(self, s, t):
+        xs, ys, zs = self._unit_vectors()
+        if xs[t] != xs[t]:
+            return self._dijkstra(s, t)
+        portal_dist = self._portal_distances()
+        # Shave a hair off the scale so float rounding never overestimates
+        scale = self.min_multiplier * (1 - 1e-9)
+        tx, ty, tz, t_portal = xs[t], ys[t], zs[t], portal_dist[t]
+        coordless_h = scale * t_portal if t_portal < INF else 0.0
+        heuristic = [-1.0] * len(self.node_ids)
+
+        def h(v):
+            val = heuristic[v]
+            if val < 0:
+                x = xs[v]
+                if x != x:
+                    val = coordless_h
+                else:
+                    chord = EARTH_RADIUS_KM * math.sqrt((x - tx)**2 + (ys[v] - ty)**2 + (zs[v] - tz)**2)
+                    val = scale * min(chord, portal_dist[v] + t_portal)
+                heuristic[v] = val
+            return val
+
+        offsets, targets, weights = self.offsets, self.targets, self.weights
+        dist = [INF] * len(self.node_ids)
+        pred_edge = [-1] * len(self.node_ids)
+        dist[s] = 0.0
+        queue = [(h(s), 0.0, s)]
+        while queue:
+            _, d, u = heapq.heappop(queue)
+            if d > dist[u]:
+                continue
+            if u == t:
+                return self._unwind(pred_edge, s, t)
+            for e in range(offsets[u], offsets[u + 1]):
+                v = targets[e]
+                nd = d + weights[e]
+                if nd < dist[v]:
+                    dist[v] = nd
+                    pred_edge[v] = e
+                    heapq.heappush(queue, (nd + h(v), nd, v))
+        return None
+
+    def _bidirectional(self, s, t):
+        """Bidirectional Dijkstra; the graph is symmetric so both sides share the CSR arrays."""
+        offsets, targets, weights = self.offsets, self.targets, self.weights
+        n = len(self.node_ids)
+        dist = ([INF] * n, [INF] * n)
+        pred = ([-1] * n, [-1] * n)
+        queues = ([(0.0, s)], [(0.0, t)])
+        dist[0][s] = 0.0
+        dist[1][t] = 0.0
+        best = INF
+        meet = None # (forward node, edge, backward node)
+        while queues[0] and queues[1]:
+            if queues[0][0][0] + queues[1][0][0] >= best:
+                break
+            side = 0 if queues[0][0][0] <= queues[1][0][0] else 1
+            d, u = heapq.heappop(queues[side])
+            here, there = dist[side], dist[1 - side]
+            if d > here[u]:
+                continue
+            for e in range(offsets[u], offsets[u + 1]):
+                v = targets[e]
+                nd = d + weights[e]
+                if nd < here[v]:
+                    here[v] = nd
+                    pred[side][v] = e
+                    heapq.heappush(queues[side], (nd, v))
+                total = nd + there[v]
+                if total < best:
+                    best = total
+                    meet = (u, e, v) if side == 0 else (v, e, u)
+        if meet is None:
+            return None
+        u, e, v = meet
+        forward = self._unwind(pred[0], s, u)
+        backward = self._unwind(pred[1], t, v)
+        backward.reverse()
+        return forward + [self.segment_ids[self.edge_segments[e]]] + backward
+
+    def build_contraction_hierarchy(self, witness_settle_limit=None):
+        """Preprocesses the graph for 'ch' queries; returns the hierarchy."""
+        kwargs = {} if witness_settle_limit is None else {'witness_settle_limit': witness_settle_limit}
+        self.ch = ContractionHierarchy.build(self, **kwargs)
+        return self.ch
+
+    def edge_source(self, e):
+        """Source node index of CSR edge ``e`` (binary search over offsets)."""
+        lo, hi = 0, len(self.node_ids) - 1
+        offsets = self.offsets
+        while lo < hi:
+            mid = (lo + hi + 1) // 2
+            if offsets[mid] <= e:
+                lo = mid
+            else:
+                hi = mid - 1
+        return lo
+
+    def _unwind(self, pred_edge, s, t):
+        """Rebuilds the segment id list from a predecessor-edge array."""
+        segs = []
+        node = t
+        while node != s:
+            e = pred_edge[node]
+            segs.append(self.segment_ids[self.edge_segments[e]])
+            node = self.edge_source(e)
+        segs.reverse()
+        return segs
+
+
+class SegmentGeometries:
+    """Segment line geometries as flat coordinate arrays.
+
+    Segment ``si`` owns the parts ``part_offsets[si]:part_offsets[si + 1]``,
+    part ``p`` owns the coordinates ``coord_offsets[p]:coord_offsets[p + 1]``
+    and coordinate ``c`` is ``coords[2c], coords[2c + 1]`` (lon, lat).
+    ``kinds`` records the original type: 0 none, 1 LineString,
+    2 MultiLineString. ``bboxes`` holds ``min_lon, min_lat, max_lon, max_lat``
+    of segment ``si`` at ``4si:4si + 4`` (NaN for segments without geometry).
+    """
+
+    NONE, LINESTRING, MULTILINESTRING = 0, 1, 2
+
+    def __init__(self, kinds, part_offsets, coord_offsets, coords, bboxes=None):
+        self.kinds = kinds
+        self.part_offsets = part_offsets
+        self.coord_offsets = coord_offsets
+        self.coords = coords
+        self.bboxes = bboxes if bboxes is not None else self._bounding_boxes()
+
+    def _bounding_boxes(self):
+        bboxes = array('d')
+        coords, coord_offsets, part_offsets = self.coords, self.coord_offsets, self.part_offsets
+        for si in range(len(self.kinds)):
+            a = coord_offsets[part_offsets[si]]
+            b = coord_offsets[part_offsets[si + 1]]
+            if a == b:
+                bboxes.extend((NAN, NAN, NAN, NAN))
+                continue
+            lons = coords[2 * a:2 * b:2]
+            lats = coords[2 * a + 1:2 * b:2]
+            bboxes.extend((min(lons), min(lats), max(lons), max(lats)))
+        return bboxes
+
+    @classmethod
+    def from_geojson(cls, count, geometries):
+        """Parses ``count`` GeoJSON values (strings, dicts or None) in segment order."""
+        kinds = array('b')
+        part_offsets = array('i', [0])
+        coord_offsets = array('i', [0])
+        coords = array('d')
+        for geometry in geometries:
+            kind, parts = _line_parts(geometry)
+            kinds.append(kind)
+            for part in parts:
+                for lon, lat in part:
+                    coords.append(lon)
+                    coords.append(lat)
+                coord_offsets.append(len(coords) // 2)
+            part_offsets.append(len(coord_offsets) - 1)
+        while len(kinds) < count:
+            kinds.append(cls.NONE)
+            part_offsets.append(len(coord_offsets) - 1)
+        return cls(kinds, part_offsets, coord_offsets, coords)
+
+    def simplified(self, tolerance):
+        """Copy with every part reduced by Douglas-Peucker at ``tolerance`` metres."""
+        part_offsets = array('i', self.part_offsets)
+        coord_offsets = array('i', [0])
+        coords = array('d')
+        src_offsets, src = self.coord_offsets, self.coords
+        for p in range(len(src_offsets) - 1):
+            a, b = src_offsets[p], src_offsets[p + 1]
+            for c in _douglas_peucker(src, a, b, tolerance):
+                coords.append(src[2 * c])
+                coords.append(src[2 * c + 1])
+            coord_offsets.append(len(coords) // 2)
+        return SegmentGeometries(array('b', self.kinds), part_offsets, coord_offsets, coords)
+
+    def parts(self, si):
+        """Coordinate lists ``[[lon, lat], ...]`` per part of segment ``si``."""
+        out = []
+        coord_offsets, coords = self.coord_offsets, self.coords
+        for p in range(self.part_offsets[si], self.part_offsets[si + 1]):
+            flat = coords[2 * coord_offsets[p]:2 * coord_offsets[p + 1]].tolist()
+            out.append([flat[i:i + 2] for i in range(0, len(flat), 2)])
+        return out
+
+    def geojson(self, si):
+        kind = self.kinds[si]
+        if kind == self.LINESTRING:
+            return {"type": "LineString", "coordinates": self.parts(si)[0]}
+        if kind == self.MULTILINESTRING:
+            return {"type": "MultiLineString", "coordinates": self.parts(si)}
+        return None
+
+
+def _douglas_peucker(coords, a, b, tolerance):
+    """Indices of the coordinates in ``a:b`` kept by Douglas-Peucker (endpoints always kept).
+
+    Distances use a local equirectangular projection in metres, which is
+    accurate enough at the scale of a single Infrabel segment.
+    """
+    if b - a <= 2:
+        return range(a, b)
+    ky = 110540.0
+    kx = 111320.0 * math.cos(math.radians(coords[2 * a + 1]))
+    xs = [coords[2 * c] * kx for c in range(a, b)]
+    ys = [coords[2 * c + 1] * ky for c in range(a, b)]
+    keep = [False] * (b - a)
+    keep[0] = keep[-1] = True
+    stack = [(0, b - a - 1)]
+    tol2 = tolerance * tolerance
+    while stack:
+        i, j = stack.pop()
+        x1, y1, x2, y2 = xs[i], ys[i], xs[j], ys[j]
+        dx, dy = x2 - x1, y2 - y1
+        seg2 = dx * dx + dy * dy
+        worst, worst_d2 = -1, tol2
+        for k in range(i + 1, j):
+            px, py = xs[k] - x1, ys[k] - y1
+            if seg2 == 0.0:
+                d2 = px * px + py * py
+            else:
+                t = (px * dx + py * dy) / seg2
+                t = 0.0 if t < 0.0 else 1.0 if t > 1.0 else t
+                ex, ey = px - t * dx, py - t * dy
+                d2 = ex * ex + ey * ey
+            if d2 > worst_d2:
+                worst, worst_d2 = k, d2
+        if worst >= 0:
+            keep[worst] = True
+            stack.append((i, worst))
+            stack.append((worst, j))
+    return [a + k for k, kept in enumerate(keep) if kept]
+
+
+def _line_parts(geometry):
+    """(kind, parts) for a LineString/MultiLineString GeoJSON value; anything else is NONE."""
+    if isinstance(geometry, str):
+        try:
+            geometry = json.loads(geometry)
+        except ValueError:
+            return SegmentGeometries.NONE, []
+    if not isinstance(geometry, dict):
+        return SegmentGeometries.NONE, []
+    try:
+        if geometry.get("type") == "LineString":
+            parts = [geometry["coordinates"]]
+            kind = SegmentGeometries.LINESTRING
+        elif geometry.get("type") == "MultiLineString":
+            parts = geometry["coordinates"]
+            kind = SegmentGeometries.MULTILINESTRING
+        else:
+            return SegmentGeometries.NONE, []
+        return kind, [[(float(pt[0]), float(pt[1])) for pt in part] for part in parts]
+    except (KeyError, TypeError, ValueError, IndexError):
+        return SegmentGeometries.NONE, []
+
+
+class GraphWarmingError(Exception):
+    """Raised while no graph has been built yet; the build runs in the background."""
+
+
+class GraphManager:
+    """Owns the live graph: background single-flight builds and atomic swaps.
+
+    ``builder`` returns a CompiledGraph (or None on failure). Requests read
+    ``manager.graph`` once and keep using that object, so a rebuild never
+    blocks them and a swap is a single reference assignment. ``on_swap`` is
+    called with every newly installed graph.
+    """
+
+    def __init__(self, builder, on_swap=None):
+        self._builder = builder
+        self._on_swap = on_swap
+        self._lock = threading.Lock()
+        self._build_lock = threading.Lock()
+        self._thread = None
+        self.graph = None
+        self.generation = 0
+        self.built_at = None
+        self.last_error = None
+
+    @property
+    def building(self):
+        thread = self._thread
+        return self._build_lock.locked() or (thread is not None and thread.is_alive())
+
+    def require(self):
+        """Returns the current graph, or starts a build and raises GraphWarmingError."""
+        graph = self.graph
+        if graph is None:
+            self.refresh()
+            raise GraphWarmingError("Railway graph is warming up")
+        return graph
+
+    def refresh(self):
+        """Starts a background rebuild unless one is already running."""
+        with self._lock:
+            if not self.building:
+                self._thread = threading.Thread(target=self.rebuild, name="graph-build", daemon=True)
+                self._thread.start()
+            return self._thread
+
+    def rebuild(self):
+        """Builds in the calling thread; concurrent callers wait for the running build."""
+        with self._build_lock:
+            self._run()
+        return self.graph
+
+    def install(self, graph):
+        """Swaps ``graph`` in as the live graph."""
+        self.graph = graph
+        self.generation += 1
+        self.built_at = time.time()
+        if self._on_swap:
+            self._on_swap(graph)
+
+    def _run(self):
+        try:
+            graph = self._builder()
+            if graph is not None:
+                self.install(graph)
+                self.last_error = None
+        except Exception as e:
+            self.last_error = str(e)
+            print(f"⚠️ Error building graph: {e}")
+
+    def status(self):
+        graph = self.graph
+        return {
+            "ready": graph is not None,
+            "building": self.building,
+            "generation": self.generation,
+            "graph_version": graph.version if graph is not None else None,
+            "built_at": self.built_at,
+            "node_count": len(graph) if graph is not None else 0,
+            "last_error": self.last_error,
+        }
+
+
+class LRUCache:
+    """Thread-safe bounded mapping that evicts the least recently used key."""
+
+    def __init__(self, maxsize=10000):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._data
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value = self._data[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+class ContractionHierarchy:
+    """Contraction hierarchy over a CompiledGraph.
+
+    Every node gets a rank; contracting a node adds shortcut arcs between its
+    remaining neighbours unless a witness path is at least as short. Arcs are
+    undirected: an original arc refers to the cheapest CSR edge between its
+    endpoints (``arc_edge``), a shortcut refers to the two arcs it replaces
+    (``arc_first`` joins ``arc_u`` to ``arc_mid``, ``arc_second`` joins
+    ``arc_mid`` to ``arc_v``). Queries run a bidirectional Dijkstra over the
+    upward arcs only and unpack the shortcuts back into CSR edges, so the
+    penalised weights and virtual edges of the base graph carry over as is.
+    """
+
+    def __init__(self, rank, up_offsets, up_targets, up_weights, up_arcs,
+                 arc_u, arc_v, arc_mid, arc_first, arc_second, arc_edge):
+        self.rank = rank
+        self.up_offsets = up_offsets
+        self.up_targets = up_targets
+        self.up_weights = up_weights
+        self.up_arcs = up_arcs
+        self.arc_u = arc_u
+        self.arc_v = arc_v
+        self.arc_mid = arc_mid
+        self.arc_first = arc_first
+        self.arc_second = arc_second
+        self.arc_edge = arc_edge
+
+    @property
+    def shortcut_count(self):
+        return sum(1 for m in self.arc_mid if m >= 0)
+
+    @classmethod
+    def build(cls, graph, witness_settle_limit=500):
+        n = len(graph.node_ids)
+        offsets, targets, weights = graph.offsets, graph.targets, graph.weights
+        arc_u, arc_v, arc_w = array('i'), array('i'), array('d')
+        arc_mid, arc_first, arc_second, arc_edge = array('i'), array('i'), array('i'), array('i')
+        # adj[u][v] -> id of the cheapest arc between u and v
+        adj = [dict() for _ in range(n)]
+
+        def add_arc(u, v, w, mid=-1, first=-1, second=-1, edge=-1):
+            a = len(arc_u)
+            arc_u.append(u)
+            arc_v.append(v)
+            arc_w.append(w)
+            arc_mid.append(mid)
+            arc_first.append(first)
+            arc_second.append(second)
+            arc_edge.append(edge)
+            adj[u][v] = a
+            adj[v][u] = a
+            return a
+
+        for u in range(n):
+            for e in range(offsets[u], offsets[u + 1]):
+                v = targets[e]
+                if v == u:
+                    continue
+                a = adj[u].get(v)
+                if a is None or weights[e] < arc_w[a]:
+                    add_arc(u, v, weights[e], edge=e)
+
+        contracted = [False] * n
+        deleted_neighbours = [0] * n
+
+        def witness_distances(source, skip, limit):
+            """Distances from ``source`` over uncontracted nodes, avoiding ``skip``."""
+            dist = {source: 0.0}
+            queue = [(0.0, source)]
+            settled = 0
+            while queue and settled < witness_settle_limit:
+                d, u = heapq.heappop(queue)
+                if d > dist[u]:
+                    continue
+                if d > limit:
+                    break
+                settled += 1
+                for v, a in adj[u].items():
+                    if v == skip or contracted[v]:
+                        continue
+                    nd = d + arc_w[a]
+                    if nd < dist.get(v, INF):
+                        dist[v] = nd
+                        heapq.heappush(queue, (nd, v))
+            return dist
+
+        def needed_shortcuts(v):
+            neighbours = [(u, arc_w[a], a) for u, a in adj[v].items() if not contracted[u]]
+            shortcuts = []
+            for i, (u, wu, au) in enumerate(neighbours[:-1]):
+                rest = neighbours[i + 1:]
+                limit = wu + max(wx for _, wx, _ in rest)
+                dist = witness_distances(u, v, limit)
+                for x, wx, ax in rest:
+                    via = wu + wx
+                    if dist.get(x, INF) > via:
+                        shortcuts.append((u, x, via, au, ax))
+            return neighbours, shortcuts
+
+        def priority(v):
+            neighbours, shortcuts = needed_shortcuts(v)
+            return len(shortcuts) - len(neighbours) + deleted_neighbours[v]
+
+        queue = [(priority(v), v) for v in range(n)]
+        heapq.heapify(queue)
+        rank = array('i', [0]) * n
+        order = 0
+        while queue:
+            _, v = heapq.heappop(queue)
+            if contracted[v]:
+                continue
+            # Lazy update: re-evaluate and requeue if no longer the cheapest
+            p = priority(v)
+            if queue and p > queue[0][0]:
+                heapq.heappush(queue, (p, v))
+                continue
+            neighbours, shortcuts = needed_shortcuts(v)
+            for u, x, via, au, ax in shortcuts:
+                existing = adj[u].get(x)
+                if existing is not None and arc_w[existing] <= via:
+                    continue
+                # Orient the children so that arc_first touches u and arc_second touches x
+                add_arc(u, x, via, mid=v, first=au, second=ax)
+            contracted[v] = True
+            rank[v] = order
+            order += 1
+            for u, _, _ in neighbours:
+                deleted_neighbours[u] += 1
+
+        # Upward CSR: every arc is stored at its lower-ranked endpoint
+        up = [[] for _ in range(n)]
+        for a in range(len(arc_u)):
+            u, v = arc_u[a], arc_v[a]
+            if adj[u].get(v) != a:
+                continue # superseded by a cheaper arc
+            lo, hi = (u, v) if rank[u] < rank[v] else (v, u)
+            up[lo].append((hi, arc_w[a], a))
+        up_offsets = array('i', [0])
+        up_targets, up_weights, up_arcs = array('i'), array('d'), array('i')
+        for u in range(n):
+            for hi, w, a in up[u]:
+                up_targets.append(hi)
+                up_weights.append(w)
+                up_arcs.append(a)
+            up_offsets.append(len(up_targets))
+
+        return cls(rank, up_offsets, up_targets, up_weights, up_arcs,
+                   arc_u, arc_v, arc_mid, arc_first, arc_second, arc_edge)
+
+    def query(self, s, t):
+        """Node indices in, list of CSR edge indices out (None if unreachable)."""
+        if s == t:
+            return []
+        up_offsets, up_targets, up_weights, up_arcs = self.up_offsets, self.up_targets, self.up_weights, self.up_arcs
+        dist = ({s: 0.0}, {t: 0.0})
+        pred = ({}, {})
+        queues = ([(0.0, s)], [(0.0, t)])
+        best = INF
+        meet = -1
+        side = 0
+        while queues[0] or queues[1]:
+            if not queues[side]:
+                side = 1 - side
+            d, u = heapq.heappop(queues[side])
+            here = dist[side]
+            if d > here[u]:
+                pass
+            elif d >= best:
+                queues[side].clear() # nothing left on this side can improve the meeting point
+            else:
+                other = dist[1 - side].get(u)
+                if other is not None and d + other < best:
+                    best = d + other
+                    meet = u
+                for i in range(up_offsets[u], up_offsets[u + 1]):
+                    v = up_targets[i]
+                    nd = d + up_weights[i]
+                    if nd < here.get(v, INF):
+                        here[v] = nd
+                        pred[side][v] = up_arcs[i]
+                        heapq.heappush(queues[side], (nd, v))
+            side = 1 - side
+        if meet < 0:
+            return None
+
+        forward = []
+        node = meet
+        while node != s:
+            a = pred[0][node]
+            prev = self.arc_u[a] if self.arc_v[a] == node else self.arc_v[a]
+            forward.append((a, prev))
+            node = prev
+        edges = []
+        for a, start in reversed(forward):
+            self._unpack(a, start, edges)
+        node = meet
+        while node != t:
+            a = pred[1][node]
+            self._unpack(a, node, edges)
+            node = self.arc_u[a] if self.arc_v[a] == node else self.arc_v[a]
+        return edges
+
+    def _unpack(self, arc, start, out):
+        """Appends the CSR edges of ``arc`` walked from node ``start``."""
+        arc_u, arc_mid, arc_first, arc_second, arc_edge = self.arc_u, self.arc_mid, self.arc_first, self.arc_second, self.arc_edge
+        stack = [(arc, start)]
+        while stack:
+            a, node = stack.pop()
+            mid = arc_mid[a]
+            if mid < 0:
+                out.append(arc_edge[a])
+            elif node == arc_u[a]:
+                stack.append((arc_second[a], mid))
+                stack.append((arc_first[a], node))
+            else:
+                stack.append((arc_first[a], mid))
+                stack.append((arc_second[a], node))
+
+
+# ==========================================
+# SNAPSHOTS
+# ==========================================
+def _pad(n):
+    return -n % SNAPSHOT_ALIGN
+
+
+def write_snapshot(graph, path, stamp):
+    """Writes ``graph`` (and its contraction hierarchy, if built) to ``path``.
+
+    The file is written next to the target and renamed into place, so readers
+    that already mapped the previous snapshot keep a consistent view.
+    """
+    sections = [(name, getattr(graph, name)) for name in _GRAPH_SECTIONS]
+    for level, (_, store) in enumerate(graph.geometry_levels):
+        sections += [(f'geom{level}_' + name, getattr(store, name)) for name in _GEOMETRY_SECTIONS]
+    if graph.ch is not None:
+        sections += [('ch_' + name, getattr(graph.ch, name)) for name in _CH_SECTIONS]
+
+    layout = []
+    pos = 0
+    for name, arr in sections:
+        view = memoryview(arr)
+        layout.append({"name": name, "format": view.format, "offset": pos, "count": len(view)})
+        pos += view.nbytes + _pad(view.nbytes)
+    meta = json.dumps({
+        "stamp": stamp,
+        "version": graph.version,
+        "byteorder": sys.byteorder,
+        "node_ids": graph.node_ids,
+        "segment_ids": graph.segment_ids,
+        "segment_ends": graph.segment_ends,
+        "min_multiplier": graph.min_multiplier,
+        "geometry_tolerances": [tol for tol, _ in graph.geometry_levels],
+        "sections": layout,
+    }).encode('utf-8')
+
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, 'wb') as f:
+        f.write(SNAPSHOT_MAGIC + struct.pack('<Q', len(meta)) + meta)
+        f.write(b'\0' * _pad(len(SNAPSHOT_MAGIC) + 8 + len(meta)))
+        for _, arr in sections:
+            view = memoryview(arr).cast('B')
+            f.write(view)
+            f.write(b'\0' * _pad(len(view)))
+    os.replace(tmp, path)
+
+
+def load_snapshot(path, stamp=None):
+    """Maps a snapshot read-only; returns None when missing, stale or unreadable.
+
+    The graph arrays are typed memoryviews over the shared mapping, so every
+    process that loads the same file shares one copy in the page cache.
+    """
+    try:
+        with open(path, 'rb') as f:
+            buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError):
+        return None
+    try:
+        view = memoryview(buf)
+        head = len(SNAPSHOT_MAGIC) + 8
+        if bytes(view[:len(SNAPSHOT_MAGIC)]) != SNAPSHOT_MAGIC:
+            raise ValueError("bad magic")
+        (meta_len,) = struct.unpack('<Q', view[len(SNAPSHOT_MAGIC):head])
+        meta = json.loads(bytes(view[head:head + meta_len]))
+        if meta["byteorder"] != sys.byteorder:
+            raise ValueError("byte order mismatch")
+        if stamp is not None and meta["stamp"] != stamp:
+            return None
+
+        base = head + meta_len + _pad(head + meta_len)
+        arrays = {}
+        for sec in meta["sections"]:
+            size = struct.calcsize(sec["format"])
+            start = base + sec["offset"]
+            arrays[sec["name"]] = view[start:start + sec["count"] * size].cast(sec["format"])
+    except (ValueError, KeyError, TypeError, struct.error) as e:
+        print(f"⚠️ Ignoring unreadable graph snapshot {path}: {e}")
+        return None
+
+    graph = CompiledGraph(
+        meta["node_ids"], arrays["offsets"], arrays["targets"], arrays["weights"],
+        arrays["edge_segments"], meta["segment_ids"], arrays["segment_lengths"],
+        [tuple(ends) for ends in meta["segment_ends"]], arrays["node_lat"], arrays["node_lon"],
+        meta["min_multiplier"], arrays["components"],
+        [(tol, SegmentGeometries(*(arrays[f'geom{level}_' + name] for name in _GEOMETRY_SECTIONS)))
+         for level, tol in enumerate(meta["geometry_tolerances"])])
+    graph._version = meta["version"]
+    if "ch_rank" in arrays:
+        graph.ch = ContractionHierarchy(*(arrays['ch_' + name] for name in _CH_SECTIONS))
+    return graph
+
+
+@contextmanager
+def _file_lock(path):
+    if fcntl is None:
+        yield
+        return
+    with open(path, 'a') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def snapshot_or_build(path, stamp, builder):
+    """Loads the snapshot at ``path`` if its stamp matches, else builds and writes it.
+
+    An exclusive lock file next to the snapshot makes the build single-flight
+    across processes: the other workers wait and then map the fresh file.
+    """
+    graph = load_snapshot(path, stamp)
+    if graph is not None:
+        return graph
+    with _file_lock(path + '.lock'):
+        graph = load_snapshot(path, stamp)
+        if graph is not None:
+            return graph
+        graph = builder()
+        if graph is None:
+            return None
+        try:
+            write_snapshot(graph, path, stamp)
+        except OSError as e:
+            print(f"⚠️ Could not write graph snapshot {path}: {e}")
+            return graph
+    print(f"💾 Graph snapshot written to {path}.")
+    return load_snapshot(path, stamp) or graph
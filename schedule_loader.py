@@ -0,0 +1,224 @@
+"""Bulk writer for a planned day of trains and train_stops.
+
+On Postgres every chunk of trains is streamed with ``COPY`` into two
+temporary staging tables and moved into ``trains`` / ``train_stops`` with one
+statement: ``INSERT ... ON CONFLICT (train_number, date)`` returning the train
+ids, chained to ``INSERT ... ON CONFLICT (train_id, stop_sequence)`` for the
+stops. Other databases (SQLite in tests) get the same upserts as executemany
+statements. Each chunk is its own transaction, so memory and lock time stay
+bounded however large the day is.
+
+``diff_day`` compares a planned day with what is stored, so a resync only
+rewrites the trains whose trip, times or stop pattern changed.
+"""
+import io
+
+import pandas as pd
+from sqlalchemy import select, text
+from sqlalchemy.dialects import sqlite
+
+from schedule_planner import stops_by_trip
+
+TRAIN_FIELDS = ['train_number', 'trip_id', 'route_name', 'destination', 'departure_time', 'arrival_time']
+STOP_FIELDS = ['stop_id', 'stop_name', 'stop_type', 'arrival_time', 'departure_time', 'stop_sequence',
+               'infrabel_id', 'station_id']
+CHUNK_TRAINS = 500
+
+
+def _column_defaults(table):
+    """Scalar Python-side column defaults (status, delay, ...), which INSERT ... SELECT would skip."""
+    return {c.name: c.default.arg for c in table.columns
+            if c.default is not None and c.default.is_scalar and c.name not in TRAIN_FIELDS}
+
+
+def load_day(engine, trains_table, stops_table, date, trains, stops, replace=True, chunk_size=None):
+    """Writes ``schedule_planner.plan_day`` frames for ``date``; returns {train_number: train id} written.
+
+    ``replace`` updates trains that already exist for the date and replaces
+    their stops; without it existing trains are left untouched.
+    """
+    stop_columns = [c for c in STOP_FIELDS if c in stops.columns and c in stops_table.c]
+    trip_stops = stops_by_trip(stops[['trip_id'] + stop_columns])
+    write_chunk = _copy_chunk if engine.dialect.name == 'postgresql' else _upsert_chunk
+    chunk_size = chunk_size or CHUNK_TRAINS
+
+    written = {}
+    records = trains.astype(object).where(trains.notna(), None).to_dict('records')
+    for start in range(0, len(records), chunk_size):
+        chunk = records[start:start + chunk_size]
+        train_rows = [{f: r[f] for f in TRAIN_FIELDS} for r in chunk]
+        stop_rows = [dict(s, train_number=r['train_number']) for r in chunk for s in trip_stops.get(r['trip_id'], [])]
+        with engine.begin() as conn:
+            written.update(write_chunk(conn, trains_table, stops_table, date, train_rows, stop_rows,
+                                       stop_columns, replace))
+    return written
+
+
+def stored_day(engine, trains_table, stops_table, date):
+    """(trains, stops) frames of what is stored for ``date``; stops carry train_number instead of trip_id."""
+    t, s = trains_table.c, stops_table.c
+    with engine.connect() as conn:
+        trains = pd.DataFrame(
+            conn.execute(select(t.id, *(t[f] for f in TRAIN_FIELDS)).where(t.date == date)).all(),
+            columns=['id'] + TRAIN_FIELDS)
+        stop_columns = [f for f in STOP_FIELDS if f in s]
+        stops = pd.DataFrame(
+            conn.execute(select(t.train_number, *(s[f] for f in stop_columns))
+                         .join_from(stops_table, trains_table, s.train_id == t.id)
+                         .where(t.date == date)).all(),
+            columns=['train_number'] + stop_columns)
+    return trains, stops
+
+
+def _joined(frame, columns):
+    """One string per row of ``columns``, with missing values as ''."""
+    values = frame[columns].astype(object).where(frame[columns].notna(), '').astype(str)
+    joined = values[columns[0]]
+    for col in columns[1:]:
+        joined = joined + '\x1f' + values[col]
+    return joined
+
+
+def train_fingerprints(trains, stops):
+    """train_number -> string of the train's fields and its whole stop pattern.
+
+    ``stops`` is keyed by a train_number column, or by trip_id (planner output).
+    """
+    if trains.empty:
+        return {}
+    if 'train_number' not in stops:
+        stops = stops.assign(train_number=stops['trip_id'].map(trains.set_index('trip_id')['train_number']))
+    stop_columns = [f for f in STOP_FIELDS if f in stops]
+    stops = stops.sort_values(['train_number', 'stop_sequence'])
+    patterns = _joined(stops, stop_columns).groupby(stops['train_number'].to_numpy(), sort=False).agg('\x1e'.join)
+    heads = pd.Series(_joined(trains, TRAIN_FIELDS).to_numpy(), index=trains['train_number'].to_numpy())
+    return (heads + '\x1d' + patterns.reindex(heads.index).fillna('')).to_dict()
+
+
+def diff_day(planned_trains, planned_stops, stored_trains, stored_stops):
+    """Train numbers added, removed and modified between what is stored and the plan for a day."""
+    new = train_fingerprints(planned_trains, planned_stops)
+    old = train_fingerprints(stored_trains, stored_stops)
+    return {
+        'added': sorted(new.keys() - old.keys()),
+        'removed': sorted(old.keys() - new.keys()),
+        'modified': sorted(n for n in new.keys() & old.keys() if new[n] != old[n]),
+        'unchanged': sum(1 for n in new.keys() & old.keys() if new[n] == old[n]),
+    }
+
+
+# ------------------------------------------------------------------
+# Postgres: COPY into staging, then one upsert statement
+# ------------------------------------------------------------------
+def _copy_value(value):
+    if value is None:
+        return r'\N'
+    return str(value).replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
+
+
+def _copy_rows(cursor, table, columns, rows):
+    buf = io.StringIO()
+    for row in rows:
+        buf.write('\t'.join(_copy_value(row[c]) for c in columns))
+        buf.write('\n')
+    buf.seek(0)
+    cursor.copy_expert(f"COPY {table} ({', '.join(columns)}) FROM STDIN", buf)
+
+
+def _copy_chunk(conn, trains_table, stops_table, date, train_rows, stop_rows, stop_columns, replace):
+    trains, stops = trains_table.name, stops_table.name
+    staged_stop_columns = ['train_number'] + stop_columns
+    # Column types come from the real tables; rows vanish at commit
+    conn.execute(text(
+        f"CREATE TEMP TABLE IF NOT EXISTS stage_trains ON COMMIT DELETE ROWS AS "
+        f"SELECT {', '.join(TRAIN_FIELDS)} FROM {trains} WITH NO DATA"))
+    conn.execute(text(
+        f"CREATE TEMP TABLE IF NOT EXISTS stage_stops ON COMMIT DELETE ROWS AS "
+        f"SELECT t.train_number, {', '.join('s.' + c for c in stop_columns)} "
+        f"FROM {stops} s, {trains} t WITH NO DATA"))
+
+    cursor = conn.connection.cursor()
+    try:
+        _copy_rows(cursor, 'stage_trains', TRAIN_FIELDS, train_rows)
+        _copy_rows(cursor, 'stage_stops', staged_stop_columns, stop_rows)
+    finally:
+        cursor.close()
+
+    defaults = _column_defaults(trains_table)
+    params = {'date': date, **{f"default_{name}": value for name, value in defaults.items()}}
+    insert_columns = ['date'] + TRAIN_FIELDS + list(defaults)
+    select_values = [':date'] + TRAIN_FIELDS + [f":default_{name}" for name in defaults]
+    if replace:
+        on_train_conflict = "DO UPDATE SET " + ', '.join(f"{c} = EXCLUDED.{c}" for c in TRAIN_FIELDS[1:])
+    else:
+        on_train_conflict = "DO NOTHING"
+    stop_updates = ', '.join(f"{c} = EXCLUDED.{c}" for c in stop_columns if c != 'stop_sequence')
+
+    rows = conn.execute(text(
+        f"WITH upserted AS ("
+        f"  INSERT INTO {trains} ({', '.join(insert_columns)})"
+        f"  SELECT {', '.join(select_values)} FROM stage_trains"
+        f"  ON CONFLICT (train_number, date) {on_train_conflict}"
+        f"  RETURNING id, train_number"
+        f"), stop_rows AS ("
+        f"  INSERT INTO {stops} (train_id, {', '.join(stop_columns)})"
+        f"  SELECT u.id, {', '.join('s.' + c for c in stop_columns)}"
+        f"  FROM stage_stops s JOIN upserted u ON u.train_number = s.train_number"
+        f"  ON CONFLICT (train_id, stop_sequence) DO UPDATE SET {stop_updates}"
+        f") SELECT train_number, id FROM upserted"), params).all()
+
+    if replace:
+        # Stops of the old stopping pattern that the new one does not have
+        conn.execute(text(
+            f"DELETE FROM {stops} ts USING {trains} t, stage_trains st "
+            f"WHERE ts.train_id = t.id AND t.date = :date AND t.train_number = st.train_number "
+            f"AND NOT EXISTS (SELECT 1 FROM stage_stops ss "
+            f"WHERE ss.train_number = st.train_number AND ss.stop_sequence = ts.stop_sequence)"),
+            {'date': date})
+    return dict(rows)
+
+
+# ------------------------------------------------------------------
+# Fallback (SQLite): executemany upserts
+# ------------------------------------------------------------------
+def _upsert_chunk(conn, trains_table, stops_table, date, train_rows, stop_rows, stop_columns, replace):
+    numbers = [r['train_number'] for r in train_rows]
+
+    def train_ids():
+        return dict(conn.execute(
+            select(trains_table.c.train_number, trains_table.c.id)
+            .where(trains_table.c.date == date, trains_table.c.train_number.in_(numbers))).all())
+
+    existing = set() if replace else set(train_ids())
+    defaults = _column_defaults(trains_table)
+    insert = sqlite.insert(trains_table)
+    if replace:
+        insert = insert.on_conflict_do_update(
+            index_elements=['train_number', 'date'],
+            set_={c: insert.excluded[c] for c in TRAIN_FIELDS[1:]})
+    else:
+        insert = insert.on_conflict_do_nothing(index_elements=['train_number', 'date'])
+    if train_rows:
+        conn.execute(insert, [dict(defaults, date=date, **r) for r in train_rows])
+    written = {n: i for n, i in train_ids().items() if n not in existing}
+    if not written:
+        return written
+
+    rows = [dict({c: s[c] for c in stop_columns}, train_id=written[s['train_number']])
+            for s in stop_rows if s['train_number'] in written]
+    insert = sqlite.insert(stops_table)
+    insert = insert.on_conflict_do_update(
+        index_elements=['train_id', 'stop_sequence'],
+        set_={c: insert.excluded[c] for c in stop_columns if c != 'stop_sequence'})
+    if rows:
+        conn.execute(insert, rows)
+
+    if replace:
+        keep = {(r['train_id'], r['stop_sequence']) for r in rows}
+        current = conn.execute(
+            select(stops_table.c.id, stops_table.c.train_id, stops_table.c.stop_sequence)
+            .where(stops_table.c.train_id.in_(list(written.values())))).all()
+        stale = [sid for sid, tid, seq in current if (tid, seq) not in keep]
+        if stale:
+            conn.execute(stops_table.delete().where(stops_table.c.id.in_(stale)))
+    return written
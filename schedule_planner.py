@@ -0,0 +1,241 @@
+"""Vectorized planning of the trains and stops of one service day.
+
+``plan_day`` turns the static GTFS frames into the rows that ``sync_day``,
+``import_data`` and ``ingest_gtfs_today`` store: one trip per train number
+(the trip whose id ends in the target date wins, then the longest trip) and
+all stops of those trips with their stop type. Everything runs on whole
+columns. ``prepare_feed`` sorts stop_times once per feed and keeps a
+trip_id -> row range index, so a day's stops are a single ``take`` instead of
+a full stop_times scan per train.
+
+``plan_days`` plans several days at once, fanned out over spawned worker
+processes that map the feed from ``feed_cache``; the caller writes the results.
+"""
+import multiprocessing
+import time
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+import pandas as pd
+
+import feed_cache
+
+TRAIN_COLUMNS = ['trip_id', 'train_number', 'route_name', 'destination', 'departure_time', 'arrival_time']
+STOP_COLUMNS = ['trip_id', 'stop_id', 'stop_name', 'stop_type', 'arrival_time', 'departure_time', 'stop_sequence']
+
+
+def prepare_stop_times(stop_times):
+    """stop_times sorted by trip / sequence, with a numeric stop_sequence and pickup / drop-off types."""
+    st = stop_times.copy()
+    st['stop_sequence'] = pd.to_numeric(st['stop_sequence'])
+    for col in ('pickup_type', 'drop_off_type'):
+        if col in st:
+            st[col] = pd.to_numeric(st[col], errors='coerce').fillna(0).astype(np.int8)
+        else:
+            st[col] = np.int8(0)
+    st.sort_values(['trip_id', 'stop_sequence'], inplace=True, kind='stable')
+    st.reset_index(drop=True, inplace=True)
+    return st
+
+
+def trip_row_index(stop_times):
+    """trip_id -> (start, count) of its rows in a prepared stop_times frame."""
+    trip_ids = stop_times['trip_id'].to_numpy()
+    if not len(trip_ids):
+        return pd.DataFrame({'start': [], 'count': []}, dtype=np.int64)
+    first = np.flatnonzero(np.r_[True, trip_ids[1:] != trip_ids[:-1]])
+    counts = np.diff(np.append(first, len(trip_ids)))
+    return pd.DataFrame({'start': first, 'count': counts}, index=pd.Index(trip_ids[first], name='trip_id'))
+
+
+def prepare_feed(trips, routes, stop_times, stops):
+    """The frames ``plan_day`` needs, derived once per GTFS feed.
+
+    trip_starts: trip_id, departure_time of the first stop
+    trip_ends:   trip_id, stop_name, arrival_time of the last stop
+    trip_counts: trip_id, stop_count
+    """
+    st = prepare_stop_times(stop_times)
+    index = trip_row_index(st)
+    starts = index['start'].to_numpy()
+    lasts = starts + index['count'].to_numpy() - 1
+
+    ends = st[['trip_id', 'stop_id', 'arrival_time']].iloc[lasts]
+    ends = ends.merge(stops[['stop_id', 'stop_name']].drop_duplicates('stop_id'), on='stop_id', how='left')
+    return {
+        'trips': trips,
+        'routes': routes,
+        'stops': stops,
+        'stop_times': st,
+        'trip_rows': index,
+        'trip_starts': st[['trip_id', 'departure_time']].iloc[starts].reset_index(drop=True),
+        'trip_ends': ends[['trip_id', 'stop_name', 'arrival_time']],
+        'trip_counts': pd.DataFrame({'trip_id': index.index, 'stop_count': index['count'].to_numpy()}),
+    }
+
+
+def active_services(feed, target_date):
+    """service_ids running on ``target_date`` per calendar.txt and the calendar_dates exceptions."""
+    date_str = target_date.strftime("%Y%m%d")
+    # Robust weekday mapping (GTFS requires English column names)
+    days = ['monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday']
+    day_name = days[target_date.weekday()]
+
+    services = set()
+    cal = feed.get('calendar')
+    if cal is not None and not cal.empty and day_name in cal.columns:
+        mask = (cal['start_date'] <= date_str) & (cal['end_date'] >= date_str) & (cal[day_name] == '1')
+        services.update(cal[mask]['service_id'].tolist())
+
+    cd = feed.get('calendar_dates')
+    if cd is not None and not cd.empty:
+        exc = cd[cd['date'] == date_str]
+        services.update(exc[exc['exception_type'] == '1']['service_id'].tolist())
+        services.difference_update(exc[exc['exception_type'] == '2']['service_id'].tolist())
+    return services
+
+
+def trip_rank(trip_ids, target_compact):
+    """1: id ends in the target date (YYYYMMDD), 2: ends in another date, 3: has a date inside, 4: no date."""
+    ids = trip_ids.astype(str)
+    end_date = ids.str.extract(r':(\d{8})$', expand=False)
+    rank = np.select([end_date == target_compact, end_date.notna(), ids.str.contains(r':\d{8}:')],
+                     [1, 2, 3], 4)
+    return pd.Series(rank.astype(np.int8), index=trip_ids.index)
+
+
+def classify_stops(pickup_type, drop_off_type, detailed=False):
+    """STOP / DOORRIT per stop; ``detailed`` also marks VERTREK (no drop-off) and AANKOMST (no pickup)."""
+    pickup = np.asarray(pickup_type)
+    drop_off = np.asarray(drop_off_type)
+    passing = (pickup == 1) & (drop_off == 1)
+    if not detailed:
+        return np.where(passing, 'DOORRIT', 'STOP')
+    return np.select([passing, (drop_off == 1) & (pickup == 0), (drop_off == 0) & (pickup == 1)],
+                     ['DOORRIT', 'VERTREK', 'AANKOMST'], 'STOP')
+
+
+def _rows(index, trip_ids):
+    """Row positions of ``trip_ids`` in the prepared stop_times, trip after trip."""
+    sel = index.loc[trip_ids]
+    starts = sel['start'].to_numpy(np.int64)
+    counts = sel['count'].to_numpy(np.int64)
+    offsets = np.repeat(starts - np.cumsum(counts) + counts, counts)
+    return offsets + np.arange(counts.sum(), dtype=np.int64)
+
+
+def plan_day(feed, active_services, target_compact, time_limit=None, detailed_types=False):
+    """(trains, stops) frames for the active services of one day.
+
+    ``feed`` is a ``prepare_feed`` dict; ``target_compact`` is the day as
+    YYYYMMDD and ``time_limit`` (HH:MM:SS) drops trips departing at or after
+    it. ``trains`` has TRAIN_COLUMNS, ordered by train number; ``stops`` has
+    STOP_COLUMNS in the same trip order, by stop_sequence within a trip.
+    """
+    trips = feed['trips']
+    trips = trips[trips['service_id'].isin(active_services)]
+    trips = trips.merge(feed['trip_starts'], on='trip_id')
+    if time_limit:
+        trips = trips[trips['departure_time'] < time_limit]
+    if trips.empty:
+        return pd.DataFrame(columns=TRAIN_COLUMNS), pd.DataFrame(columns=STOP_COLUMNS)
+
+    trips = trips.assign(rank=trip_rank(trips['trip_id'], target_compact))
+    merged = trips \
+        .merge(feed['routes'], on='route_id') \
+        .merge(feed['trip_ends'], on='trip_id', suffixes=('_start', '_end')) \
+        .merge(feed['trip_counts'], on='trip_id')
+    numbers = merged['trip_short_name']
+    merged = merged[numbers.notna() & ~numbers.isin(['', '?'])]
+    merged = merged.sort_values(['trip_short_name', 'rank', 'stop_count'], ascending=[True, True, False],
+                                kind='stable')
+    final = merged.drop_duplicates(subset=['trip_short_name'], keep='first')
+
+    headsign = final['trip_headsign'] if 'trip_headsign' in final else pd.Series(None, index=final.index, dtype=object)
+    route_name = final['route_long_name'].fillna('') if 'route_long_name' in final else ''
+    trains = pd.DataFrame({
+        'trip_id': final['trip_id'],
+        'train_number': final['trip_short_name'],
+        'route_name': route_name,
+        'destination': headsign.where(headsign.notna() & (headsign != ''), final['stop_name']),
+        'departure_time': final['departure_time'],
+        'arrival_time': final['arrival_time'],
+    }, columns=TRAIN_COLUMNS).reset_index(drop=True)
+
+    index = feed.get('trip_rows')
+    if index is None:
+        index = trip_row_index(feed['stop_times'])
+    day = feed['stop_times'].take(_rows(index, trains['trip_id']))
+    stops = pd.DataFrame({
+        'trip_id': day['trip_id'].to_numpy(),
+        'stop_id': day['stop_id'].to_numpy(),
+        'stop_type': classify_stops(day['pickup_type'], day['drop_off_type'], detailed_types),
+        'arrival_time': day['arrival_time'].to_numpy(),
+        'departure_time': day['departure_time'].to_numpy(),
+        'stop_sequence': day['stop_sequence'].to_numpy(),
+    })
+    names = feed['stops'].drop_duplicates('stop_id').set_index('stop_id')['stop_name']
+    stops['stop_name'] = stops['stop_id'].map(names)
+    # Like the old inner join: stops missing from stops.txt are left out
+    known = stops['stop_id'].isin(names.index)
+    return trains, stops.loc[known, STOP_COLUMNS].reset_index(drop=True)
+
+
+def stops_by_trip(stops):
+    """trip_id -> list of stop row dicts (without trip_id, NaN as None), in stop order."""
+    columns = [c for c in stops.columns if c != 'trip_id']
+    values = stops[columns].astype(object).where(stops[columns].notna(), None)
+    records = values.to_dict('records')
+    return {trip_id: [records[i] for i in rows]
+            for trip_id, rows in stops.groupby('trip_id', sort=False).indices.items()}
+
+
+# Result of planning one day: trains / stops are None when no service runs
+DayPlan = namedtuple('DayPlan', 'date trains stops seconds error')
+
+
+def plan_service_day(feed, target_date):
+    """``plan_day`` for the services running on ``target_date`` (a date / datetime) -> DayPlan."""
+    t0 = time.perf_counter()
+    try:
+        services = active_services(feed, target_date)
+        trains, stops = plan_day(feed, services, target_date.strftime("%Y%m%d")) if services else (None, None)
+        return DayPlan(target_date, trains, stops, time.perf_counter() - t0, None)
+    except Exception as e:
+        return DayPlan(target_date, None, None, time.perf_counter() - t0, e)
+
+
+_WORKER_FEED = None
+
+
+def _init_worker(cache_dir, stamp):
+    global _WORKER_FEED
+    _WORKER_FEED = feed_cache.load_feed(cache_dir, stamp)
+
+
+def _plan_in_worker(target_date):
+    if _WORKER_FEED is None:
+        return DayPlan(target_date, None, None, 0.0, RuntimeError("feed cache unreadable in worker"))
+    return plan_service_day(_WORKER_FEED, target_date)
+
+
+def plan_days(feed, dates, workers=1, feed_source=None):
+    """Yields a DayPlan per date, in completion order.
+
+    With ``workers`` > 1 and ``feed_source`` = (cache_dir, stamp) of ``feed``
+    in the feed cache, the days are planned in spawned processes that map the
+    cached feed themselves. Workers are never forked: forking a process that
+    runs threads can deadlock on locks held at fork time. Without a cache or
+    with one worker the days are planned in this process.
+    """
+    dates = list(dates)
+    if workers <= 1 or len(dates) <= 1 or feed_source is None or feed_cache.load_feed(*feed_source) is None:
+        for target_date in dates:
+            yield plan_service_day(feed, target_date)
+        return
+    with ProcessPoolExecutor(max_workers=min(workers, len(dates)), mp_context=multiprocessing.get_context('spawn'),
+                             initializer=_init_worker, initargs=feed_source) as pool:
+        futures = [pool.submit(_plan_in_worker, target_date) for target_date in dates]
+        for future in as_completed(futures):
+            yield future.result()
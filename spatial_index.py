@@ -0,0 +1,108 @@
+"""Grid index over (lat, lon) points for nearest-neighbour station matching.
+
+Points are bucketed in cells of about ``cell_km`` on a side. A query only
+looks at the cells that can hold a point within the radius, and distances
+to those candidates are computed with one vectorized NumPy haversine.
+``nearest_many`` groups the queries per cell, so matching every GTFS stop
+against every operational point costs one small distance matrix per cell
+instead of stops x points Python calls.
+"""
+import math
+from collections import defaultdict
+
+import numpy as np
+
+EARTH_RADIUS_KM = 6371.0
+KM_PER_DEG_LAT = 111.32
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    """Element-wise / broadcast haversine in km on arrays of degrees."""
+    lat1, lon1, lat2, lon2 = (np.radians(a) for a in (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+class PointIndex:
+    """Static grid index; ``ids[i]`` belongs to ``(lats[i], lons[i])``.
+
+    Points without coordinates (None / NaN) are left out.
+    """
+
+    def __init__(self, ids, lats, lons, cell_km=1.0):
+        lats = np.asarray([np.nan if v is None else v for v in lats], dtype=np.float64)
+        lons = np.asarray([np.nan if v is None else v for v in lons], dtype=np.float64)
+        keep = ~(np.isnan(lats) | np.isnan(lons))
+        ids = list(ids)
+        self.ids = [ids[i] for i in np.flatnonzero(keep)]
+        self.lats = lats[keep]
+        self.lons = lons[keep]
+
+        self.cell_km = cell_km
+        self.dlat = cell_km / KM_PER_DEG_LAT
+        # Cells must be at least cell_km wide at the point furthest from the equator
+        max_lat = float(np.max(np.abs(self.lats))) if len(self.lats) else 0.0
+        self.dlon = cell_km / (KM_PER_DEG_LAT * max(math.cos(math.radians(min(max_lat, 89.0))), 1e-6))
+
+        self.cells = defaultdict(list)
+        for i, key in enumerate(zip(*self._cell(self.lats, self.lons))):
+            self.cells[key].append(i)
+        self.cells = {key: np.asarray(members, dtype=np.intp) for key, members in self.cells.items()}
+
+    def __len__(self):
+        return len(self.ids)
+
+    def _cell(self, lats, lons):
+        return (np.floor(np.asarray(lats) / self.dlat).astype(np.int64).tolist(),
+                np.floor(np.asarray(lons) / self.dlon).astype(np.int64).tolist())
+
+    def _candidates(self, cell, radius_km):
+        reach = max(1, math.ceil(radius_km / self.cell_km))
+        ci, cj = cell
+        found = [self.cells[(i, j)]
+                 for i in range(ci - reach, ci + reach + 1)
+                 for j in range(cj - reach, cj + reach + 1)
+                 if (i, j) in self.cells]
+        return np.concatenate(found) if found else np.empty(0, dtype=np.intp)
+
+    def k_nearest(self, lat, lon, radius_km, k=5):
+        """Up to ``k`` (id, km) pairs strictly within ``radius_km``, nearest first."""
+        cell = tuple(c[0] for c in self._cell([lat], [lon]))
+        cand = self._candidates(cell, radius_km)
+        if not len(cand):
+            return []
+        dist = haversine_km(lat, lon, self.lats[cand], self.lons[cand])
+        inside = np.flatnonzero(dist < radius_km)
+        order = inside[np.argsort(dist[inside], kind='stable')][:k]
+        return [(self.ids[cand[o]], float(dist[o])) for o in order]
+
+    def nearest(self, lat, lon, radius_km):
+        """(id, km) of the nearest point strictly within ``radius_km``, or None."""
+        found = self.k_nearest(lat, lon, radius_km, k=1)
+        return found[0] if found else None
+
+    def nearest_many(self, lats, lons, radius_km):
+        """``nearest`` for many query points at once; None for missing coordinates."""
+        lats = np.asarray([np.nan if v is None else v for v in lats], dtype=np.float64)
+        lons = np.asarray([np.nan if v is None else v for v in lons], dtype=np.float64)
+        result = [None] * len(lats)
+        valid = np.flatnonzero(~(np.isnan(lats) | np.isnan(lons)))
+        if not len(valid) or not len(self.ids):
+            return result
+
+        groups = defaultdict(list)
+        for q, key in zip(valid.tolist(), zip(*self._cell(lats[valid], lons[valid]))):
+            groups[key].append(q)
+        for cell, queries in groups.items():
+            cand = self._candidates(cell, radius_km)
+            if not len(cand):
+                continue
+            queries = np.asarray(queries, dtype=np.intp)
+            dist = haversine_km(lats[queries][:, None], lons[queries][:, None],
+                                self.lats[cand][None, :], self.lons[cand][None, :])
+            best = np.argmin(dist, axis=1)
+            best_dist = dist[np.arange(len(queries)), best]
+            for q, b, d in zip(queries.tolist(), best.tolist(), best_dist.tolist()):
+                if d < radius_km:
+                    result[q] = (self.ids[cand[b]], d)
+        return result
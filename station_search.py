@@ -0,0 +1,171 @@
+"""In-memory station name search (autocomplete) over the GTFS translations.
+
+Every station (an official ``field_value`` name with its stop ids and its
+translated names) is indexed under the normalized form of each of its names:
+lower case, accents stripped, hyphens / slashes / apostrophes as spaces. A
+trigram index finds the names that contain the query, a word-prefix index
+covers one and two letter queries, and a trigram similarity pass catches
+typos. Results are ranked by match quality first, then by how many train
+stops the station has. ``matching`` (the search filter) keeps substring
+semantics for every query length: one and two letter queries have no
+trigram to narrow on, so they check every name.
+"""
+import heapq
+import unicodedata
+from collections import defaultdict
+
+# Match quality, best first
+EXACT, PREFIX, WORD_PREFIX, SUBSTRING, FUZZY = range(5)
+FUZZY_MIN_SIMILARITY = 0.35
+_SEPARATORS = str.maketrans({'-': ' ', '/': ' ', "'": ' ', '’': ' ', '.': ' ', '(': ' ', ')': ' ', ',': ' '})
+
+
+def normalize(text):
+    """'Liège-Guillemins' -> 'liege guillemins'."""
+    text = unicodedata.normalize('NFKD', text or '')
+    text = ''.join(c for c in text if not unicodedata.combining(c))
+    return ' '.join(text.lower().translate(_SEPARATORS).split())
+
+
+def trigrams(text):
+    padded = f"  {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class Station:
+    __slots__ = ('name', 'stop_ids', 'labels', 'keys', 'importance')
+
+    def __init__(self, name):
+        self.name = name          # official GTFS name (TrainStop.stop_name)
+        self.stop_ids = []
+        self.labels = {}          # lang -> translated name
+        self.keys = set()         # normalized searchable names
+        self.importance = 0
+
+    def label(self, lang=None):
+        return self.labels.get(lang) or self.name
+
+    def as_dict(self, lang=None):
+        return {"name": self.name, "label": self.label(lang), "stop_ids": self.stop_ids}
+
+
+class StationSearchIndex:
+    """Built from ``(stop_id, field_value, lang, translation)`` rows.
+
+    ``importance`` maps stop_id -> weight (e.g. number of train stops) and
+    breaks ties between stations that match equally well.
+    """
+
+    def __init__(self, translations, importance=None, version=None):
+        self.version = version
+        by_name = {}
+        for stop_id, field_value, lang, translation in translations:
+            if not field_value:
+                continue
+            station = by_name.get(field_value)
+            if station is None:
+                station = by_name[field_value] = Station(field_value)
+                station.keys.add(normalize(field_value))
+            if stop_id and stop_id not in station.stop_ids:
+                station.stop_ids.append(stop_id)
+            if translation:
+                station.keys.add(normalize(translation))
+                if lang:
+                    station.labels.setdefault(lang, translation)
+        self.stations = list(by_name.values())
+        importance = importance or {}
+        for station in self.stations:
+            station.keys.discard('')
+            station.importance = sum(importance.get(sid, 0) for sid in station.stop_ids)
+
+        # (station index, key) postings
+        self._keys = [(si, key) for si, station in enumerate(self.stations) for key in station.keys]
+        self._by_trigram = defaultdict(set)
+        self._by_prefix = defaultdict(set)
+        for ki, (_, key) in enumerate(self._keys):
+            for tri in trigrams(key):
+                self._by_trigram[tri].add(ki)
+            for word in key.split():
+                for n in (1, 2):
+                    if len(word) >= n:
+                        self._by_prefix[word[:n]].add(ki)
+        self._key_trigrams = [trigrams(key) for _, key in self._keys]
+
+    def __len__(self):
+        return len(self.stations)
+
+    @staticmethod
+    def _quality(q, key):
+        if key == q:
+            return EXACT
+        if key.startswith(q):
+            return PREFIX
+        if f" {q}" in f" {key}":
+            return WORD_PREFIX
+        if q in key:
+            return SUBSTRING
+        return None
+
+    def _candidates(self, q, substrings=False):
+        if len(q) < 3:
+            if substrings:
+                # No trigram to narrow on: check every name (a few thousand, all in memory)
+                return range(len(self._keys))
+            words = q.split()
+            return set(self._by_prefix.get(words[0][:2], ())) if words else set()
+        # Keys containing q contain all of its inner trigrams (no padding)
+        inner = [q[i:i + 3] for i in range(len(q) - 2)]
+        postings = sorted((self._by_trigram.get(tri, set()) for tri in inner), key=len)
+        if not postings or not postings[0]:
+            return set()
+        found = set(postings[0])
+        for p in postings[1:]:
+            found &= p
+            if not found:
+                break
+        return found
+
+    def _rank(self, q, fuzzy, limit, substrings=False):
+        best = {}
+        for ki in self._candidates(q, substrings):
+            si, key = self._keys[ki]
+            quality = self._quality(q, key)
+            if quality is not None and quality < best.get(si, (FUZZY + 1,))[0]:
+                best[si] = (quality, 0.0)
+
+        # Typo matches rank last, so they are only needed when the real matches run short
+        if fuzzy and len(q) >= 3 and (limit is None or len(best) < limit):
+            q_tri = trigrams(q)
+            shared = defaultdict(int)
+            for tri in q_tri:
+                for ki in self._by_trigram.get(tri, ()):
+                    shared[ki] += 1
+            for ki, n in shared.items():
+                si = self._keys[ki][0]
+                if si in best and best[si][0] < FUZZY:
+                    continue
+                similarity = n / (len(q_tri) + len(self._key_trigrams[ki]) - n)
+                if similarity >= FUZZY_MIN_SIMILARITY and -similarity < best.get(si, (FUZZY, 0.0))[1]:
+                    best[si] = (FUZZY, -similarity)
+        return best
+
+    def search(self, query, limit=10, fuzzy=True, substrings=False):
+        """Best matching stations for an autocomplete query.
+
+        Short queries only match word prefixes unless ``substrings`` is set.
+        """
+        q = normalize(query)
+        if not q:
+            return []
+        best = self._rank(q, fuzzy, limit, substrings)
+
+        def order(si):
+            return best[si][0], best[si][1], -self.stations[si].importance, self.stations[si].name
+
+        if limit is None:
+            return [self.stations[si] for si in sorted(best, key=order)]
+        return [self.stations[si] for si in heapq.nsmallest(limit, best, key=order)]
+
+    def matching(self, query):
+        """Every station with a name containing ``query`` (accent / case / hyphen insensitive)."""
+        return self.search(query, limit=None, fuzzy=False, substrings=True)
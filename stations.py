@@ -0,0 +1,190 @@
+"""In-memory reference data for station mapping and Infrabel operational points.
+
+``StationResolver`` is built once from the StationMapping, StopTranslation and
+InfrabelOperationalPoint rows and answers SNCB stop -> Infrabel id, OP
+coordinates and OP names from dicts, without touching the database. It keeps
+the lookup order and matching rules of the old query-based ``get_infrabel_id``:
+
+1. hardcoded name overrides (data cleanup for hubs with a bad mapping)
+2. exact ``sncb_id``
+3. the id with / without the ``S`` prefix
+4. the numeric part of the id (old ``SNCB:123:0`` style ids)
+5. the stop name via the translations, then steps 2-4 for that stop id. The
+   name is lower-cased with '-' and '/' turned into spaces and must occur in
+   the translation or the official name of a row (case-insensitive, like
+   ``ILIKE '%name%'``). The stored names are compared as they are, and the
+   first such row in id order wins.
+
+``station_key`` / ``station_hierarchy`` map platform-level stop ids to the id
+of their station, so station queries can match one indexed key.
+"""
+import re
+from bisect import bisect_right
+
+_SNCB_NUMERIC = re.compile(r'^S?(\d{7})(?:\D|$)')
+
+
+def station_key(stop_id, parent_station=None):
+    """Canonical station id for a stop: the parent station if known, else the SNCB number.
+
+    '8892007', 'S8892007' and platform ids like '8892007_3' all give '8892007';
+    ids without a 7-digit SNCB number are their own station.
+    """
+    if parent_station:
+        return station_key(parent_station)
+    if not stop_id:
+        return None
+    match = _SNCB_NUMERIC.match(stop_id)
+    return match.group(1) if match else stop_id
+
+
+def station_hierarchy(stops):
+    """stop_id -> station key for ``(stop_id, parent_station)`` rows (stops.txt)."""
+    return {stop_id: station_key(stop_id, parent if isinstance(parent, str) else None)
+            for stop_id, parent in stops if stop_id}
+
+
+def clean_name(name):
+    """The search form of a stop name: lower case, '-' and '/' as spaces."""
+    return name.lower().replace('-', ' ').replace('/', ' ')
+
+
+def numeric_id(stop_id):
+    return ''.join(filter(str.isdigit, stop_id))
+
+
+class StationResolver:
+    """Dict-backed resolver for one version of the station reference data.
+
+    ``overrides`` is a list of ``(name substring, excluded substring or None,
+    infrabel_id)`` checked in order against the lower-cased stop name.
+    """
+
+    def __init__(self, mappings, translations, operational_points, overrides=(), version=None):
+        self.version = version
+        self.overrides = list(overrides)
+
+        # sncb_id -> infrabel_id; the first row wins, like query.first()
+        self.by_id = {}
+        for sncb_id, infrabel_id in mappings:
+            if sncb_id and infrabel_id:
+                self.by_id.setdefault(sncb_id, infrabel_id)
+        self.by_numeric = {}
+        for sncb_id, infrabel_id in self.by_id.items():
+            digits = numeric_id(sncb_id)
+            if len(digits) > 4:
+                self.by_numeric.setdefault(digits, infrabel_id)
+
+        # Lower-cased translated and official names of every row, in row order, joined
+        # into one string so a substring search is a single str.find; a match can never
+        # span rows because clean names have no NUL. name_starts[i] is where row i begins.
+        parts = []
+        self.name_starts = []
+        self.name_stop_ids = []
+        pos = 0
+        for stop_id, field_value, translation in translations:
+            text = f"{(translation or '').lower()}\0{(field_value or '').lower()}\0"
+            parts.append(text)
+            self.name_starts.append(pos)
+            self.name_stop_ids.append(stop_id)
+            pos += len(text)
+        self.names_blob = ''.join(parts)
+
+        # id / ptcar_id -> (lon, lat) and (name_nl, name_fr)
+        self.coords = {}
+        self.names = {}
+        self.ptcar_ids = {}
+        for op_id, ptcar_id, lat, lon, name_nl, name_fr in operational_points:
+            if lat and lon:
+                self.coords[op_id] = [float(lon), float(lat)]
+            self.names[op_id] = (name_nl, name_fr)
+            if ptcar_id:
+                self.ptcar_ids.setdefault(str(ptcar_id), op_id)
+
+        self._resolved = {}
+
+    def __len__(self):
+        return len(self.by_id)
+
+    def _by_stop_id(self, stop_id):
+        infrabel_id = self.by_id.get(stop_id)
+        if infrabel_id:
+            return infrabel_id
+        alt_id = stop_id[1:] if stop_id.startswith('S') else f"S{stop_id}"
+        infrabel_id = self.by_id.get(alt_id)
+        if infrabel_id:
+            return infrabel_id
+        digits = numeric_id(stop_id)
+        if len(digits) > 4:
+            infrabel_id = self.by_numeric.get(digits)
+            if infrabel_id:
+                return infrabel_id
+            # LIKE '%digits%': the digits inside a longer mapped id
+            for key, infrabel_id in self.by_numeric.items():
+                if digits in key:
+                    return infrabel_id
+        return None
+
+    def _by_name(self, stop_id, stop_name):
+        # First row whose translation or official name ILIKE '%name%'
+        pos = self.names_blob.find(clean_name(stop_name))
+        if pos < 0:
+            return None
+        match = self.name_stop_ids[bisect_right(self.name_starts, pos) - 1]
+        if match and match != stop_id:
+            return self._by_stop_id(match)
+        return None
+
+    def resolve(self, stop_id, stop_name=None):
+        """Infrabel id for an SNCB stop id (and optional name), or None."""
+        if not stop_id:
+            return None
+        key = (stop_id, stop_name)
+        try:
+            return self._resolved[key]
+        except KeyError:
+            pass
+
+        result = None
+        if stop_name:
+            lname = stop_name.lower()
+            for needle, exclude, infrabel_id in self.overrides:
+                if needle in lname and not (exclude and exclude in lname):
+                    result = infrabel_id
+                    break
+        if result is None:
+            result = self._by_stop_id(stop_id)
+        if result is None and stop_name:
+            result = self._by_name(stop_id, stop_name)
+        self._resolved[key] = result
+        return result
+
+    def resolve_many(self, stop_ids, stop_names=None, station_ids=None):
+        """Infrabel ids for parallel lists of stop ids and names (None / NaN: no name), in order.
+
+        With ``station_ids``, a stop that is not mapped itself takes the node
+        of its station (platform ids next to a mapped station id).
+        """
+        if stop_names is None:
+            stop_names = [None] * len(stop_ids)
+        nodes = []
+        for i, (stop_id, name) in enumerate(zip(stop_ids, stop_names)):
+            name = name if isinstance(name, str) else None
+            node = self.resolve(stop_id, name)
+            if node is None and station_ids is not None and station_ids[i] not in (None, stop_id):
+                node = self.resolve(station_ids[i], name)
+            nodes.append(node)
+        return nodes
+
+    def op_coords(self, op_id):
+        """[lon, lat] of an operational point, or None."""
+        return self.coords.get(op_id)
+
+    def op_names(self, op_id):
+        """(name_nl, name_fr) of an operational point by id or PTCAR id, or None."""
+        names = self.names.get(op_id)
+        if names is None and op_id is not None:
+            alias = self.ptcar_ids.get(str(op_id))
+            if alias is not None:
+                names = self.names.get(alias)
+        return names
@@ -0,0 +1,65 @@
+import os
+import tempfile
+import unittest
+import numpy as np
+import pandas as pd
+import feed_cache
+from schedule_planner import plan_day, prepare_feed
+from test_schedule_planner import DAY, gtfs_frames
+
+
+class FeedCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.dir = self.tmp.name
+        self.built = 0
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def build(self):
+        self.built += 1
+        return prepare_feed(*gtfs_frames())
+
+    def test_round_trip_is_mapped_and_plans_the_same_day(self):
+        fresh = self.build()
+        cached = feed_cache.load_or_build(self.dir, 'v1', self.build, categorical=('stop_times',))
+        again = feed_cache.load_or_build(self.dir, 'v1', self.build, categorical=('stop_times',))
+        self.assertEqual(self.built, 2)  # the second load came from disk
+
+        st = again['stop_times']
+        self.assertIsInstance(st['trip_id'].dtype, pd.CategoricalDtype)
+        self.assertIsInstance(np.asarray(st['stop_sequence']).base, np.memmap)
+        self.assertEqual(again['trips']['trip_headsign'].fillna('-').tolist(),
+                         fresh['trips']['trip_headsign'].fillna('-').tolist())
+        self.assertEqual(again['trip_rows'].index.tolist(), fresh['trip_rows'].index.tolist())
+
+        for feed in (cached, again):
+            trains, stops = plan_day(feed, {'WD'}, DAY)
+            expected_trains, expected_stops = plan_day(fresh, {'WD'}, DAY)
+            pd.testing.assert_frame_equal(trains, expected_trains)
+            pd.testing.assert_frame_equal(stops, expected_stops, check_dtype=False)
+
+    def test_new_stamp_replaces_old_cache(self):
+        feed_cache.load_or_build(self.dir, 'v1', self.build)
+        feed_cache.load_or_build(self.dir, 'v2', self.build)
+        self.assertEqual(os.listdir(self.dir), ['v2'])
+        self.assertIsNone(feed_cache.load_feed(self.dir, 'v1'))
+
+    def test_unreadable_cache_is_rebuilt(self):
+        feed_cache.load_or_build(self.dir, 'v1', self.build)
+        os.remove(os.path.join(self.dir, 'v1', 'stops.0.codes.npy'))
+        self.assertIsNone(feed_cache.load_feed(self.dir, 'v1'))
+
+    def test_source_stamp_follows_the_files(self):
+        with open(os.path.join(self.dir, 'trips.txt'), 'w') as f:
+            f.write('trip_id\n1\n')
+        stamp = feed_cache.source_stamp(self.dir)
+        self.assertEqual(stamp, feed_cache.source_stamp(self.dir))
+        with open(os.path.join(self.dir, 'trips.txt'), 'a') as f:
+            f.write('2\n')
+        self.assertNotEqual(stamp, feed_cache.source_stamp(self.dir))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,327 @@
+import os
+import json
+import unittest
+import heapq
+import random
+import tempfile
+import threading
+from railway_graph import (CompiledGraph, GraphManager, GraphWarmingError, LRUCache, haversine_km,
+                           load_snapshot, snapshot_or_build, tolerance_for_zoom, write_snapshot)
+
+
+def reference_path_cost(edges, start, end):
+    """Plain dict-of-lists Dijkstra, as find_path used to do it."""
+    graph = {}
+    for u, v, w, _ in edges:
+        graph.setdefault(u, []).append((v, w))
+        graph.setdefault(v, []).append((u, w))
+    queue = [(0, start)]
+    visited = {}
+    while queue:
+        cost, node = heapq.heappop(queue)
+        if node in visited:
+            continue
+        visited[node] = cost
+        if node == end:
+            return cost
+        for neighbor, weight in graph.get(node, []):
+            if neighbor not in visited:
+                heapq.heappush(queue, (cost + weight, neighbor))
+    return None
+
+
+def random_edges(seed, nodes=60, extra=90):
+    rnd = random.Random(seed)
+    names = [f"N{i}" for i in range(nodes)]
+    edges = []
+    for i in range(1, nodes):
+        edges.append((names[i], names[rnd.randrange(i)], rnd.uniform(0.5, 20.0), len(edges) + 1))
+    for _ in range(extra):
+        u, v = rnd.sample(names, 2)
+        edges.append((u, v, rnd.uniform(0.5, 20.0), len(edges) + 1))
+    return edges
+
+
+def geographic_edges(seed, nodes=80, extra=120):
+    """Edges weighted >= 0.8 x haversine, plus virtual shortcuts and unlocated nodes."""
+    rnd = random.Random(seed)
+    names = [f"P{i}" for i in range(nodes)]
+    coords = {n: (rnd.uniform(49.5, 51.5), rnd.uniform(2.5, 6.4)) for n in names}
+    for n in rnd.sample(names, 4):
+        del coords[n]
+
+    def weight(u, v):
+        if u in coords and v in coords:
+            return haversine_km(*coords[u], *coords[v]) * rnd.choice([0.8, 1.0, 1.3, 5.0])
+        return rnd.uniform(0.5, 5.0)
+
+    edges = []
+    for i in range(1, nodes):
+        u, v = names[i], names[rnd.randrange(i)]
+        edges.append((u, v, weight(u, v), len(edges) + 1))
+    for _ in range(extra):
+        u, v = rnd.sample(names, 2)
+        edges.append((u, v, weight(u, v), len(edges) + 1))
+    for u, v in [rnd.sample(names, 2) for _ in range(3)]:
+        edges.append((u, v, 0.1, f"V_{u}_{v}"))
+    return edges, coords
+
+
+class CompiledGraphTestCase(unittest.TestCase):
+    def setUp(self):
+        self.edges = [
+            ('FGSP', 'FGDM', 4.0, 1),
+            ('FGDM', 'FLK', 18.0, 2),
+            ('FGSP', 'FLK', 30.0, 3),
+            ('FLK', 'FSN', 12.0, 4),
+            ('FBNL', 'FN', 0.1, 'V_FBNL_FN'),
+            ('FX', 'FY', 1.0, 5),
+        ]
+        self.graph = CompiledGraph.from_edges(self.edges, {1: 4.2, 2: 18.5, 3: None})
+
+    def path_cost(self, segs):
+        weights = {seg_id: w for _, _, w, seg_id in self.edges}
+        return sum(weights[s] for s in segs)
+
+    def test_csr_layout(self):
+        self.assertEqual(len(self.graph), 8)
+        self.assertEqual(self.graph.edge_count, 2 * len(self.edges))
+        self.assertIn('FGSP', self.graph)
+        self.assertNotIn('FZZ', self.graph)
+        self.assertFalse(CompiledGraph.empty())
+
+    def test_shortest_path_returns_segment_ids(self):
+        self.assertEqual(self.graph.shortest_path('FGSP', 'FSN'), [1, 2, 4])
+        self.assertEqual(self.graph.shortest_path('FSN', 'FGSP'), [4, 2, 1])
+        self.assertEqual(self.graph.shortest_path('FN', 'FBNL'), ['V_FBNL_FN'])
+        self.assertEqual(self.graph.shortest_path('FGSP', 'FGSP'), [])
+        self.assertIsNone(self.graph.shortest_path('FGSP', 'FX'))
+        self.assertIsNone(self.graph.shortest_path('FGSP', 'UNKNOWN'))
+
+    def test_component_labelling(self):
+        self.assertTrue(self.graph.connected('FGSP', 'FSN'))
+        self.assertFalse(self.graph.connected('FGSP', 'FX'))
+        self.assertFalse(self.graph.connected('FGSP', 'UNKNOWN'))
+        sizes = [len(c) for c in self.graph.component_members()]
+        self.assertEqual(sizes, [4, 2, 2])
+
+    def test_segment_lengths(self):
+        self.assertEqual(self.graph.segment_length(1), 4.2)
+        self.assertIsNone(self.graph.segment_length(3))
+        self.assertIsNone(self.graph.segment_length('V_FBNL_FN'))
+
+    def test_matches_reference_dijkstra(self):
+        for seed in range(5):
+            edges = random_edges(seed)
+            graph = CompiledGraph.from_edges(edges)
+            weights = {seg_id: w for _, _, w, seg_id in edges}
+            rnd = random.Random(seed)
+            for _ in range(30):
+                a, b = rnd.sample(graph.node_ids, 2)
+                segs = graph.shortest_path(a, b)
+                self.assertAlmostEqual(sum(weights[s] for s in segs), reference_path_cost(edges, a, b))
+
+    def test_shortest_paths_from_one_origin(self):
+        for seed in range(3):
+            edges = random_edges(seed)
+            graph = CompiledGraph.from_edges(edges)
+            weights = {seg_id: w for _, _, w, seg_id in edges}
+            rnd = random.Random(seed)
+            source = rnd.choice(graph.node_ids)
+            ends = rnd.sample(graph.node_ids, 10) + [source, 'NOPE']
+            paths = graph.shortest_paths(source, ends)
+            self.assertEqual(set(paths), set(ends))
+            self.assertEqual(paths[source], [])
+            self.assertIsNone(paths['NOPE'])
+            for end in ends[:10]:
+                if end != source:
+                    self.assertAlmostEqual(sum(weights[s] for s in paths[end]), reference_path_cost(edges, source, end))
+        self.assertEqual(self.graph.shortest_paths('FGSP', ['FSN', 'FX']), {'FSN': [1, 2, 4], 'FX': None})
+
+    def test_routing_modes_agree(self):
+        for seed in range(5):
+            edges, coords = geographic_edges(seed)
+            graph = CompiledGraph.from_edges(edges, coords=coords)
+            weights = {seg_id: w for _, _, w, seg_id in edges}
+            rnd = random.Random(seed)
+            for _ in range(40):
+                a, b = rnd.sample(graph.node_ids, 2)
+                expected = sum(weights[s] for s in graph.shortest_path(a, b))
+                for mode in ('astar', 'bidirectional'):
+                    segs = graph.shortest_path(a, b, mode)
+                    self.assertAlmostEqual(sum(weights[s] for s in segs), expected, msg=f"{mode} {a}->{b}")
+
+    def test_contraction_hierarchy_matches_dijkstra(self):
+        for seed in range(5):
+            edges, coords = geographic_edges(seed)
+            graph = CompiledGraph.from_edges(edges, coords=coords)
+            graph.build_contraction_hierarchy()
+            weights = {seg_id: w for _, _, w, seg_id in edges}
+            ends = {seg_id: {u, v} for u, v, _, seg_id in edges}
+            rnd = random.Random(seed)
+            for _ in range(40):
+                a, b = rnd.sample(graph.node_ids, 2)
+                expected = sum(weights[s] for s in graph.shortest_path(a, b))
+                segs = graph.shortest_path(a, b, 'ch')
+                self.assertAlmostEqual(sum(weights[s] for s in segs), expected)
+                # Unpacked shortcuts must form a connected walk from a to b
+                node = a
+                for seg_id in segs:
+                    self.assertIn(node, ends[seg_id])
+                    node = (ends[seg_id] - {node} or {node}).pop()
+                self.assertEqual(node, b)
+
+    def test_modes_handle_trivial_and_disconnected_pairs(self):
+        self.graph.build_contraction_hierarchy()
+        for mode in ('astar', 'bidirectional', 'ch'):
+            self.assertEqual(self.graph.shortest_path('FGSP', 'FGSP', mode), [])
+            self.assertIsNone(self.graph.shortest_path('FGSP', 'FX', mode))
+            self.assertEqual(self.graph.shortest_path('FGSP', 'FSN', mode), [1, 2, 4])
+
+    def test_segment_geometries(self):
+        line = {"type": "LineString", "coordinates": [[3.7, 51.0, 12.0], [3.74, 51.05]]}
+        multi = {"type": "MultiLineString", "coordinates": [[[3.7, 51.0], [3.8, 51.1]], [[3.8, 51.1], [3.9, 51.2]]]}
+        graph = CompiledGraph.from_edges(self.edges, coords={'FGSP': (51.0, 3.7)},
+                                         geometries={1: json.dumps(line), 2: multi, 3: 'not json'})
+        self.assertEqual(graph.segment_geometry(1), {"type": "LineString", "coordinates": [[3.7, 51.0], [3.74, 51.05]]})
+        self.assertEqual(graph.segment_geometry(2), multi)
+        self.assertIsNone(graph.segment_geometry(3))
+        self.assertIsNone(graph.segment_geometry('V_FBNL_FN'))
+        self.assertEqual(graph.segment_endpoints(2), ('FGDM', 'FLK'))
+        self.assertEqual(graph.node_coords('FGSP'), [3.7, 51.0])
+        self.assertIsNone(graph.node_coords('FLK'))
+        boxes = graph.geometries.bboxes
+        self.assertEqual(list(boxes[4:8]), [3.7, 51.0, 3.9, 51.2])
+        self.assertTrue(all(b != b for b in boxes[8:12]))  # no geometry: NaN box
+
+    def test_simplified_geometry_levels(self):
+        # A gentle zig-zag: +-11 m of lateral wobble around a ~2.2 km straight line
+        wobble = [[4.0 + i * 0.001, 50.0 + (0.0001 if i % 2 else 0.0)] for i in range(31)]
+        line = {"type": "LineString", "coordinates": wobble}
+        multi = {"type": "MultiLineString", "coordinates": [wobble, [[4.1, 50.1], [4.2, 50.2]]]}
+        graph = CompiledGraph.from_edges(self.edges, geometries={1: line, 2: multi}, tolerances=(5.0, 20.0))
+        self.assertEqual(graph.segment_geometry(1), line)
+        self.assertEqual(graph.segment_geometry(1, 4.9), line)
+        self.assertEqual(graph.segment_geometry(1, 5.0), line)
+        coarse = graph.segment_geometry(1, 50.0)
+        self.assertEqual(coarse["coordinates"], [wobble[0], wobble[-1]])
+        coarse_multi = graph.segment_geometry(2, 20.0)
+        self.assertEqual(coarse_multi["type"], "MultiLineString")
+        self.assertEqual(coarse_multi["coordinates"], [[wobble[0], wobble[-1]], [[4.1, 50.1], [4.2, 50.2]]])
+        self.assertGreater(tolerance_for_zoom(6), tolerance_for_zoom(14))
+        self.assertLess(tolerance_for_zoom(18), 1.0)
+
+    def test_version_is_content_hash(self):
+        same = CompiledGraph.from_edges(self.edges)
+        self.assertEqual(same.version, self.graph.version)
+        changed = CompiledGraph.from_edges(self.edges[:-1])
+        self.assertNotEqual(changed.version, self.graph.version)
+
+
+class LRUCacheTestCase(unittest.TestCase):
+    def test_evicts_least_recently_used(self):
+        cache = LRUCache(maxsize=2)
+        cache.put('a', 1)
+        cache.put('b', 2)
+        self.assertEqual(cache.get('a'), 1)
+        cache.put('c', 3)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('a'), 1)
+        self.assertEqual(cache.get('c'), 3)
+        self.assertEqual((cache.hits, cache.misses), (3, 1))
+
+
+class SnapshotTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, 'graph.snap')
+        edges, coords = geographic_edges(11)
+        shape = {"type": "LineString", "coordinates": [[4.0, 50.0], [4.1, 50.2]]}
+        self.graph = CompiledGraph.from_edges(edges, {1: 3.5, 2: None}, coords, geometries={1: shape})
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_round_trip_maps_arrays(self):
+        self.graph.build_contraction_hierarchy()
+        write_snapshot(self.graph, self.path, 'stamp-1')
+        loaded = load_snapshot(self.path, 'stamp-1')
+        self.assertIsInstance(loaded.targets, memoryview)
+        self.assertEqual(loaded.node_ids, self.graph.node_ids)
+        self.assertEqual(loaded.segment_ids, self.graph.segment_ids)
+        self.assertEqual(loaded.segment_ends, self.graph.segment_ends)
+        self.assertEqual(list(loaded.components), list(self.graph.components))
+        self.assertEqual(loaded.segment_length(1), 3.5)
+        self.assertIsNone(loaded.segment_length(2))
+        self.assertEqual(loaded.segment_geometry(1), self.graph.segment_geometry(1))
+        self.assertEqual(loaded.segment_geometry(1, 300.0), self.graph.segment_geometry(1, 300.0))
+        self.assertEqual([t for t, _ in loaded.geometry_levels], [t for t, _ in self.graph.geometry_levels])
+        self.assertIsInstance(loaded.geometries.bboxes, memoryview)
+        self.assertEqual(list(loaded.geometries.bboxes[:4]), [4.0, 50.0, 4.1, 50.2])
+        self.assertIsNone(loaded.segment_geometry(2))
+        loaded._version = None
+        self.assertEqual(loaded.version, self.graph.version)
+
+        rnd = random.Random(3)
+        for _ in range(30):
+            a, b = rnd.sample(self.graph.node_ids, 2)
+            expected = self.graph.shortest_path(a, b)
+            for mode in ('dijkstra', 'astar', 'bidirectional', 'ch'):
+                self.assertEqual(loaded.shortest_path(a, b, mode), expected, (a, b, mode))
+
+    def test_stale_or_corrupt_snapshot_is_ignored(self):
+        self.assertIsNone(load_snapshot(self.path))
+        write_snapshot(self.graph, self.path, 'stamp-1')
+        self.assertIsNone(load_snapshot(self.path, 'stamp-2'))
+        with open(self.path, 'r+b') as f:
+            f.write(b'garbage!')
+        self.assertIsNone(load_snapshot(self.path, 'stamp-1'))
+
+    def test_snapshot_or_build_builds_once_per_stamp(self):
+        calls = []
+
+        def builder():
+            calls.append(1)
+            return self.graph
+
+        first = snapshot_or_build(self.path, 'stamp-1', builder)
+        second = snapshot_or_build(self.path, 'stamp-1', builder)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(second.version, first.version)
+        snapshot_or_build(self.path, 'stamp-2', builder)
+        self.assertEqual(len(calls), 2)
+
+
+class GraphManagerTestCase(unittest.TestCase):
+    def test_warms_in_background_and_swaps(self):
+        release = threading.Event()
+        calls = []
+        swapped = []
+
+        def builder():
+            calls.append(1)
+            release.wait(5)
+            return CompiledGraph.from_edges([('A', 'B', 1.0, 1)])
+
+        manager = GraphManager(builder, on_swap=swapped.append)
+        with self.assertRaises(GraphWarmingError):
+            manager.require()
+        with self.assertRaises(GraphWarmingError):
+            manager.require()
+        self.assertTrue(manager.building)
+        release.set()
+        manager._thread.join(5)
+        self.assertEqual(len(calls), 1)
+        graph = manager.require()
+        self.assertEqual(swapped, [graph])
+        self.assertEqual(manager.status()["generation"], 1)
+
+        old = graph
+        new = manager.rebuild()
+        self.assertIsNot(new, old)
+        self.assertEqual(new.version, old.version)
+        self.assertEqual(manager.generation, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,118 @@
+import os
+os.environ.setdefault('FLASK_TESTING', '1')
+os.environ.setdefault('DATABASE_URL', 'sqlite:///:memory:')
+
+import unittest
+from unittest import mock
+import pandas as pd
+import main
+import schedule_loader
+from schedule_planner import TRAIN_COLUMNS
+from main import app, db, Train, TrainStop
+
+DATE = '2026-10-17'
+
+
+def day(patterns):
+    """plan_day-like frames; ``patterns`` maps train number -> stop ids."""
+    trains = pd.DataFrame([(f"T{n}", n, 'Route', f"Dest {n}", '10:00:00', '11:00:00') for n in patterns],
+                          columns=TRAIN_COLUMNS)
+    stops = pd.DataFrame([(f"T{n}", stop_id, f"Stop {stop_id}", 'STOP', '10:00:00', '10:01:00', seq, None, stop_id)
+                          for n, stop_ids in patterns.items() for seq, stop_id in enumerate(stop_ids, start=1)],
+                         columns=['trip_id'] + schedule_loader.STOP_FIELDS)
+    return trains, stops
+
+
+class ScheduleLoaderTestCase(unittest.TestCase):
+    def setUp(self):
+        self.ctx = app.app_context()
+        self.ctx.push()
+        db.create_all()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.ctx.pop()
+
+    def load(self, patterns, replace=True, chunk_size=2):
+        trains, stops = day(patterns)
+        return schedule_loader.load_day(db.engine, Train.__table__, TrainStop.__table__, DATE, trains, stops,
+                                        replace=replace, chunk_size=chunk_size)
+
+    def stops_of(self, number):
+        train = Train.query.filter_by(date=DATE, train_number=number).one()
+        return [(s.stop_sequence, s.stop_id) for s in
+                TrainStop.query.filter_by(train_id=train.id).order_by(TrainStop.stop_sequence)]
+
+    def test_insert_in_chunks_with_defaults(self):
+        written = self.load({'1': 'AB', '2': 'ABC', '3': 'C'})
+        self.assertEqual(sorted(written), ['1', '2', '3'])
+        train = db.session.get(Train, written['2'])
+        self.assertEqual((train.status, train.delay, train.destination), ('SCHEDULED', 0, 'Dest 2'))
+        self.assertEqual(self.stops_of('2'), [(1, 'A'), (2, 'B'), (3, 'C')])
+        self.assertEqual(TrainStop.query.count(), 6)
+
+    def test_replace_updates_trains_and_drops_stale_stops(self):
+        first = self.load({'1': 'ABC', '2': 'AB'})
+        db.session.get(Train, first['1']).status = 'CANCELLED'
+        db.session.commit()
+        db.session.expire_all()
+
+        second = self.load({'1': 'XY', '2': 'AB'})
+        self.assertEqual(second, first)  # same train ids
+        self.assertEqual(self.stops_of('1'), [(1, 'X'), (2, 'Y')])
+        self.assertEqual(db.session.get(Train, first['1']).status, 'CANCELLED')  # realtime state is kept
+
+    def test_skip_leaves_existing_trains_alone(self):
+        self.load({'1': 'ABC'})
+        written = self.load({'1': 'XY', '2': 'AB'}, replace=False)
+        self.assertEqual(list(written), ['2'])
+        self.assertEqual(self.stops_of('1'), [(1, 'A'), (2, 'B'), (3, 'C')])
+
+    def test_postgres_path_copies_into_staging(self):
+        trains, stops = day({'1': 'AB'})
+        copies = []
+        cursor = mock.Mock()
+        cursor.copy_expert.side_effect = lambda sql, buf: copies.append((sql, buf.read()))
+        conn = mock.MagicMock()
+        conn.connection.cursor.return_value = cursor
+        conn.execute.return_value.all.return_value = [('1', 42)]
+        engine = mock.MagicMock()
+        engine.dialect.name = 'postgresql'
+        engine.begin.return_value.__enter__.return_value = conn
+
+        written = schedule_loader.load_day(engine, Train.__table__, TrainStop.__table__, DATE, trains, stops)
+        self.assertEqual(written, {'1': 42})
+        self.assertEqual(copies[0][0], "COPY stage_trains (train_number, trip_id, route_name, destination, "
+                                       "departure_time, arrival_time) FROM STDIN")
+        self.assertEqual(copies[0][1], "1\tT1\tRoute\tDest 1\t10:00:00\t11:00:00\n")
+        self.assertEqual(copies[1][1].splitlines()[1], "1\tB\tStop B\tSTOP\t10:00:00\t10:01:00\t2\t\\N\tB")
+        upsert = str(conn.execute.call_args_list[2][0][0])
+        self.assertIn("ON CONFLICT (train_number, date) DO UPDATE", upsert)
+        self.assertIn("ON CONFLICT (train_id, stop_sequence) DO UPDATE", upsert)
+
+    def test_diff_against_stored_day(self):
+        self.load({'1': 'AB', '2': 'ABC', '3': 'C'})
+        stored_trains, stored_stops = schedule_loader.stored_day(db.engine, Train.__table__, TrainStop.__table__, DATE)
+        trains, stops = day({'1': 'AB', '2': 'ABX', '4': 'D'})
+        stops['infrabel_id'] = float('nan')  # missing values compare equal to stored NULLs
+        self.assertEqual(schedule_loader.diff_day(trains, stops, stored_trains, stored_stops),
+                         {'added': ['4'], 'removed': ['3'], 'modified': ['2'], 'unchanged': 1})
+
+    def test_copy_value_escaping(self):
+        self.assertEqual(schedule_loader._copy_value(None), r'\N')
+        self.assertEqual(schedule_loader._copy_value('a\tb\\c\nd'), 'a\\tb\\\\c\\nd')
+
+    def test_import_data_uses_bulk_loader(self):
+        with mock.patch.object(main.schedule_loader, 'load_day', return_value={'1': 1}) as load_day, \
+                mock.patch.object(main.schedule_planner, 'plan_day', return_value=day({'1': 'AB'})), \
+                mock.patch.object(main.schedule_planner, 'active_services', return_value={'WD'}), \
+                mock.patch.dict(main.static_data, {'trips': pd.DataFrame({'trip_id': ['T1']}),
+                                                   'stops': pd.DataFrame({'stop_id': ['A', 'B'], 'stop_name': ['a', 'b']})}):
+            main.import_data(DATE)
+        self.assertTrue(load_day.call_args.kwargs['replace'])
+        self.assertEqual(load_day.call_args.args[3], DATE)
+
+
+if __name__ == '__main__':
+    unittest.main()
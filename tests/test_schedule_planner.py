@@ -0,0 +1,282 @@
+import os
+os.environ.setdefault('FLASK_TESTING', '1')
+os.environ.setdefault('DATABASE_URL', 'sqlite:///:memory:')
+
+import tempfile
+import unittest
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from unittest import mock
+import pandas as pd
+import feed_cache
+from schedule_planner import classify_stops, plan_day, plan_days, prepare_feed, stops_by_trip, trip_rank
+
+DAY = '20261017'
+
+
+class Today(datetime):
+    """Fixed clock for the sync window; module level so worker processes can unpickle it."""
+    @classmethod
+    def now(cls, tz=None):
+        return cls(2026, 10, 17, 4, 0)
+
+
+def gtfs_frames():
+    """Train 100 has a dated, an undated and an other-day trip; train 200 a short and a long trip."""
+    trips = pd.DataFrame([
+        ('R1', 'WD', 'T100:OTHER:20261018', '100', 'Gent'),
+        ('R1', 'WD', 'T100:PLAIN', '100', 'Gent'),
+        ('R1', 'WD', 'T100:GOOD:20261017', '100', ''),
+        ('R1', 'WD', 'T200:SHORT', '200', None),
+        ('R1', 'WD', 'T200:LONG', '200', None),
+        ('R1', 'WE', 'T300', '300', 'Weekend'),
+        ('R1', 'WD', 'T400', '?', None),
+    ], columns=['route_id', 'service_id', 'trip_id', 'trip_short_name', 'trip_headsign'])
+    routes = pd.DataFrame([('R1', 'Oostende - Eupen')], columns=['route_id', 'route_long_name'])
+    stops = pd.DataFrame([('A', 'Alpha'), ('B', 'Beta'), ('C', 'Gamma')], columns=['stop_id', 'stop_name'])
+    rows = []
+    for trip_id, stop_ids, hour in [('T100:OTHER:20261018', 'AB', 6), ('T100:PLAIN', 'AB', 6),
+                                    ('T100:GOOD:20261017', 'ABC', 7), ('T200:SHORT', 'AB', 8),
+                                    ('T200:LONG', 'ACB', 23), ('T300', 'AB', 9), ('T400', 'AB', 9)]:
+        # Written out of order: the planner sorts by stop_sequence
+        for seq, stop_id in reversed(list(enumerate(stop_ids, start=1))):
+            passing = '1' if (seq == 2 and trip_id == 'T200:LONG') else '0'
+            rows.append((trip_id, str(seq), stop_id, f"{hour:02d}:{seq:02d}:00", f"{hour:02d}:{seq:02d}:00",
+                         passing, passing))
+    stop_times = pd.DataFrame(rows, columns=['trip_id', 'stop_sequence', 'stop_id', 'arrival_time',
+                                             'departure_time', 'pickup_type', 'drop_off_type'])
+    return trips, routes, stop_times, stops
+
+
+class SchedulePlannerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.feed = prepare_feed(*gtfs_frames())
+
+    def test_feed_summaries(self):
+        starts = dict(zip(self.feed['trip_starts']['trip_id'], self.feed['trip_starts']['departure_time']))
+        self.assertEqual(starts['T100:GOOD:20261017'], '07:01:00')
+        ends = self.feed['trip_ends'].set_index('trip_id')
+        self.assertEqual(ends.loc['T200:LONG', 'stop_name'], 'Beta')
+        self.assertEqual(ends.loc['T200:LONG', 'arrival_time'], '23:03:00')
+        counts = dict(zip(self.feed['trip_counts']['trip_id'], self.feed['trip_counts']['stop_count']))
+        self.assertEqual(counts['T200:LONG'], 3)
+
+    def test_trip_rank(self):
+        ids = pd.Series(['X:20261017', 'X:20261018', 'X:20261017:Y', 'X'])
+        self.assertEqual(trip_rank(ids, DAY).tolist(), [1, 2, 3, 4])
+
+    def test_classify_stops(self):
+        pickup, drop_off = [0, 1, 0, 1, 2], [0, 1, 1, 0, 1]
+        self.assertEqual(classify_stops(pickup, drop_off).tolist(), ['STOP', 'DOORRIT', 'STOP', 'STOP', 'STOP'])
+        self.assertEqual(classify_stops(pickup, drop_off, detailed=True).tolist(),
+                         ['STOP', 'DOORRIT', 'VERTREK', 'AANKOMST', 'STOP'])
+
+    def test_plan_day(self):
+        trains, stops = plan_day(self.feed, {'WD'}, DAY)
+        self.assertEqual(trains['train_number'].tolist(), ['100', '200'])
+        self.assertEqual(trains['trip_id'].tolist(), ['T100:GOOD:20261017', 'T200:LONG'])
+        # Empty / missing headsign falls back to the last stop
+        self.assertEqual(trains['destination'].tolist(), ['Gamma', 'Beta'])
+        self.assertEqual(trains['route_name'].tolist(), ['Oostende - Eupen'] * 2)
+        self.assertEqual(trains[['departure_time', 'arrival_time']].values.tolist(),
+                         [['07:01:00', '07:03:00'], ['23:01:00', '23:03:00']])
+
+        self.assertEqual(stops['trip_id'].tolist(), ['T100:GOOD:20261017'] * 3 + ['T200:LONG'] * 3)
+        self.assertEqual(stops['stop_sequence'].tolist(), [1, 2, 3, 1, 2, 3])
+        self.assertEqual(stops['stop_name'].tolist(), ['Alpha', 'Beta', 'Gamma', 'Alpha', 'Gamma', 'Beta'])
+        self.assertEqual(stops['stop_type'].tolist(), ['STOP'] * 4 + ['DOORRIT', 'STOP'])
+
+    def test_time_limit(self):
+        trains, stops = plan_day(self.feed, {'WD'}, DAY, time_limit='08:30:00')
+        self.assertEqual(trains['trip_id'].tolist(), ['T100:GOOD:20261017', 'T200:SHORT'])
+        self.assertEqual(len(stops), 5)
+        trains, stops = plan_day(self.feed, {'NONE'}, DAY)
+        self.assertTrue(trains.empty and stops.empty)
+
+    def test_stops_by_trip(self):
+        _, stops = plan_day(self.feed, {'WD'}, DAY)
+        stops['infrabel_id'] = [None, 'FB', float('nan'), None, None, None]
+        grouped = stops_by_trip(stops)
+        first = grouped['T100:GOOD:20261017']
+        self.assertEqual([s['stop_id'] for s in first], ['A', 'B', 'C'])
+        self.assertEqual(first[1], {'stop_id': 'B', 'stop_name': 'Beta', 'stop_type': 'STOP', 'arrival_time': '07:02:00',
+                                    'departure_time': '07:02:00', 'stop_sequence': 2, 'infrabel_id': 'FB'})
+        self.assertIsNone(first[2]['infrabel_id'])
+
+    def test_plan_days_in_worker_processes(self):
+        feed = dict(self.feed, calendar=pd.DataFrame(columns=['service_id']),
+                    calendar_dates=pd.DataFrame([('WD', DAY, '1'), ('WE', '20261018', '1')],
+                                                columns=['service_id', 'date', 'exception_type']))
+        dates = [datetime(2026, 10, 17), datetime(2026, 10, 18), datetime(2026, 10, 19)]
+        with tempfile.TemporaryDirectory() as cache_dir:
+            feed_cache.write_feed(cache_dir, 'v1', feed, categorical=('stop_times',))
+            feed = feed_cache.load_feed(cache_dir, 'v1')
+            serial = {p.date: p for p in plan_days(feed, dates, workers=1)}
+            with mock.patch('schedule_planner.ProcessPoolExecutor', wraps=ProcessPoolExecutor) as pool:
+                parallel = {p.date: p for p in plan_days(feed, dates, workers=3, feed_source=(cache_dir, 'v1'))}
+        self.assertEqual(pool.call_args.kwargs['mp_context'].get_start_method(), 'spawn')
+        self.assertEqual(set(parallel), set(dates))
+        for d in dates:
+            self.assertIsNone(parallel[d].error)
+            self.assertGreaterEqual(parallel[d].seconds, 0)
+            if serial[d].trains is None:
+                self.assertIsNone(parallel[d].trains)  # no service on the 19th
+                continue
+            pd.testing.assert_frame_equal(parallel[d].trains, serial[d].trains)
+            pd.testing.assert_frame_equal(parallel[d].stops, serial[d].stops)
+        self.assertEqual(parallel[dates[1]].trains['train_number'].tolist(), ['300'])
+
+
+class SyncDayTestCase(unittest.TestCase):
+    def setUp(self):
+        import main
+        self.main = main
+        self.ctx = main.app.app_context()
+        self.ctx.push()
+        main.db.create_all()
+        main.invalidate_station_resolver()
+        feed = prepare_feed(*gtfs_frames())
+        feed['calendar'] = pd.DataFrame(columns=['service_id'])
+        feed['calendar_dates'] = pd.DataFrame([('WD', DAY, '1')], columns=['service_id', 'date', 'exception_type'])
+        self.static = mock.patch.dict(main.static_data, feed, clear=True)
+        self.static.start()
+
+    def tearDown(self):
+        self.static.stop()
+        self.main.db.session.remove()
+        self.main.db.drop_all()
+        self.ctx.pop()
+
+    def test_sync_day_and_import_data_store_the_plan(self):
+        main = self.main
+        main.sync_day(datetime(2026, 10, 17))
+        train = main.Train.query.filter_by(date=DAY, train_number='200').one()
+        self.assertEqual(train.trip_id, 'T200:LONG')
+        stops = main.TrainStop.query.filter_by(train_id=train.id).order_by(main.TrainStop.stop_sequence).all()
+        self.assertEqual([(s.stop_id, s.stop_type, s.station_id) for s in stops],
+                         [('A', 'STOP', 'A'), ('C', 'DOORRIT', 'C'), ('B', 'STOP', 'B')])
+
+        main.import_data('2026-10-17')
+        main.import_data('2026-10-17')  # updates in place
+        trains = main.Train.query.filter_by(date='2026-10-17').all()
+        self.assertEqual(sorted(t.train_number for t in trains), ['100', '200'])
+        self.assertEqual(main.TrainStop.query.filter(main.TrainStop.train_id.in_([t.id for t in trains])).count(), 6)
+
+    def test_import_data_only_rewrites_changed_trains(self):
+        main = self.main
+        diff = main.import_data('2026-10-17', version='v1')
+        self.assertEqual((diff['added'], diff['modified'], diff['removed']), (['100', '200'], [], []))
+        self.assertEqual(main.get_status('schedule:2026-10-17'), 'v1')
+        ids = {t.train_number: t.id for t in main.Train.query.filter_by(date='2026-10-17')}
+
+        # Same version: the day is skipped without planning
+        with mock.patch.object(main.schedule_planner, 'plan_day') as plan_day:
+            self.assertIsNone(main.import_data('2026-10-17', version='v1'))
+        plan_day.assert_not_called()
+
+        # New feed: train 200 loses its long trip, train 100 leaves the feed
+        trips = main.static_data['trips']
+        main.static_data['trips'] = trips[~trips['trip_id'].isin(['T200:LONG']) & (trips['trip_short_name'] != '100')]
+        with mock.patch.object(main, 'datetime', Today), \
+                mock.patch.object(main.schedule_loader, 'load_day', wraps=main.schedule_loader.load_day) as load_day:
+            diff = main.import_data('2026-10-17', version='v2')
+        self.assertEqual(diff, {'added': [], 'removed': ['100'], 'modified': ['200'], 'unchanged': 0})
+        self.assertEqual(load_day.call_args.args[4]['train_number'].tolist(), ['200'])
+        train = main.Train.query.filter_by(date='2026-10-17', train_number='200').one()
+        self.assertEqual((train.id, train.trip_id), (ids['200'], 'T200:SHORT'))
+        self.assertEqual(main.TrainStop.query.filter_by(train_id=train.id).count(), 2)
+        # Today is history: the train that left the feed stays
+        self.assertEqual(main.db.session.get(main.Train, ids['100']).train_number, '100')
+
+        # Rerun with another version but the same plan: nothing is rewritten
+        diff = main.import_data('2026-10-17', version='v3')
+        self.assertEqual((diff['modified'], diff['unchanged']), ([], 1))
+
+    def test_removed_trains_are_only_deleted_on_future_days(self):
+        main = self.main
+        user = main.User(username='u', email='u@example.com', password_hash='x')
+        main.db.session.add(user)
+        for date in ('2026-10-17', '2026-10-20'):
+            for number in ('1', '2', '3'):
+                main.db.session.add(main.Train(train_number=number, date=date, trip_id=f"T{number}"))
+        main.db.session.flush()
+        trains = {(t.date, t.train_number): t.id for t in main.Train.query}
+        main.db.session.add(main.Journey(user_id=user.id, train_id=trains[('2026-10-20', '1')], train_number='1'))
+        main.db.session.add(main.TrainUnit(train_id=trains[('2026-10-20', '2')], position='1'))
+        main.db.session.add(main.TrainStop(train_id=trains[('2026-10-20', '3')], stop_id='A', stop_sequence=1))
+        main.db.session.commit()
+
+        with mock.patch.object(main, 'datetime', Today):
+            self.assertEqual(main.remove_trains('2026-10-17', ['1', '2', '3']), 0)  # today is history
+            self.assertEqual(main.remove_trains('2026-10-20', ['1', '2', '3']), 1)  # only the unreferenced one
+        self.assertEqual(sorted((t.date, t.train_number) for t in main.Train.query),
+                         [('2026-10-17', '1'), ('2026-10-17', '2'), ('2026-10-17', '3'),
+                          ('2026-10-20', '1'), ('2026-10-20', '2')])
+        self.assertEqual(main.TrainStop.query.count(), 0)
+        self.assertEqual(main.TrainUnit.query.count(), 1)
+        self.assertEqual(main.Journey.query.count(), 1)
+
+    def test_populate_window_plans_in_process_and_writes_once(self):
+        main = self.main
+        with mock.patch.object(main, 'datetime', Today), mock.patch.object(main, 'PREWARM_TRACES', False), \
+                mock.patch.object(main, 'schedule_version', return_value='v1'), \
+                mock.patch.object(main.feed_cache, 'feed_version', return_value='feed1'), \
+                mock.patch.object(main.schedule_planner, 'plan_days', wraps=main.schedule_planner.plan_days) as plan_days, \
+                mock.patch.object(main, 'write_day', wraps=main.write_day) as write_day:
+            main.populate_todays_schedule()
+            self.assertEqual(plan_days.call_args.kwargs['workers'], 1)  # never spawns from the web process
+            self.assertEqual([c.args[0] for c in write_day.call_args_list if c.args[1] is not None], ['2026-10-17'])
+            self.assertEqual(main.Train.query.filter_by(date='2026-10-17').count(), 2)
+            self.assertEqual(main.get_status('gtfs_feed_version'), 'feed1')
+
+            write_day.reset_mock()
+            main.populate_todays_schedule()  # same version: every day is skipped
+            write_day.assert_not_called()
+
+    def test_populate_window_plans_in_spawned_workers(self):
+        main = self.main
+        with tempfile.TemporaryDirectory() as cache_dir:
+            feed_cache.write_feed(cache_dir, 'v1', dict(main.static_data), categorical=('stop_times',))
+            with mock.patch.object(main, 'datetime', Today), mock.patch.object(main, 'PREWARM_TRACES', False), \
+                    mock.patch.object(main, 'FEED_CACHE_DIR', cache_dir), mock.patch.object(main, 'STATIC_FEED_STAMP', 'v1'), \
+                    mock.patch.object(main, 'schedule_version', return_value='v1'), \
+                    mock.patch.object(main.feed_cache, 'feed_version', return_value='feed1'), \
+                    mock.patch('schedule_planner.ProcessPoolExecutor', wraps=ProcessPoolExecutor) as pool:
+                main.populate_todays_schedule(workers=2)
+        self.assertEqual(pool.call_args.kwargs['max_workers'], 2)
+        self.assertEqual(sorted(t.train_number for t in main.Train.query.filter_by(date='2026-10-17')), ['100', '200'])
+        self.assertEqual(main.get_status('schedule:2026-10-18'), 'v1')  # days without service are stamped too
+
+    def test_startup_sync_uses_the_worker_pool(self):
+        main = self.main
+        with mock.patch.multiple(main, migrate_db=mock.DEFAULT, download_static_data=mock.DEFAULT,
+                                 load_static_data=mock.DEFAULT, ensure_infrabel_data=mock.DEFAULT,
+                                 build_railway_graph=mock.DEFAULT, populate_todays_schedule=mock.DEFAULT) as mocks, \
+                mock.patch.object(main, 'SYNC_WORKERS', 3), mock.patch.object(main.time, 'sleep', side_effect=StopIteration):
+            with self.assertRaises(StopIteration):
+                main.run_startup_tasks()
+        mocks['populate_todays_schedule'].assert_called_once_with(fast_boot=True, workers=3)
+
+    def test_populate_window_survives_a_failing_stop_node_table(self):
+        main = self.main
+        table = main.stop_node_table
+        calls = []
+
+        def flaky(stops):
+            calls.append(stops)
+            if len(calls) == 1:
+                raise KeyError('stops')
+            return table(stops)
+
+        with mock.patch.object(main, 'datetime', Today), mock.patch.object(main, 'stop_node_table', flaky), \
+                mock.patch.object(main, 'schedule_version', return_value='v1'), \
+                mock.patch.object(main.feed_cache, 'feed_version', return_value='feed1'), \
+                mock.patch.object(main, 'start_trace_prewarm') as prewarm:
+            main.populate_todays_schedule()
+        self.assertEqual(len(calls), 2)  # the window-wide table failed, the day resolved its own
+        self.assertEqual(main.Train.query.filter_by(date='2026-10-17').count(), 2)
+        prewarm.assert_called_once()
+
+
+if __name__ == '__main__':
+    unittest.main()
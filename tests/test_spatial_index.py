@@ -0,0 +1,57 @@
+import math
+import random
+import unittest
+from railway_graph import haversine_km as scalar_haversine_km
+from spatial_index import PointIndex, haversine_km
+
+
+def brute_nearest(points, lat, lon, radius_km):
+    best = None
+    for pid, plat, plon in points:
+        d = scalar_haversine_km(lat, lon, plat, plon)
+        if d < radius_km and (best is None or d < best[1]):
+            best = (pid, d)
+    return best
+
+
+class PointIndexTestCase(unittest.TestCase):
+    def setUp(self):
+        rng = random.Random(7)
+        # Operational points scattered over Belgium, plus one without coordinates
+        self.points = [(f"OP{i}", rng.uniform(49.5, 51.5), rng.uniform(2.5, 6.4)) for i in range(2000)]
+        self.index = PointIndex([p[0] for p in self.points] + ['NOWHERE'],
+                                [p[1] for p in self.points] + [None],
+                                [p[2] for p in self.points] + [None], cell_km=0.75)
+        self.queries = [(p[1] + rng.uniform(-0.01, 0.01), p[2] + rng.uniform(-0.01, 0.01))
+                        for p in rng.sample(self.points, 300)]
+
+    def test_haversine_matches_reference(self):
+        # Gent-Sint-Pieters -> Brussel-Zuid
+        self.assertAlmostEqual(float(haversine_km(51.036, 3.710, 50.836, 4.336)), 49.18, places=2)
+
+    def test_nearest_many_matches_brute_force(self):
+        self.assertEqual(len(self.index), 2000)
+        lats = [q[0] for q in self.queries] + [None]
+        lons = [q[1] for q in self.queries] + [4.0]
+        matches = self.index.nearest_many(lats, lons, 0.75)
+        self.assertIsNone(matches[-1])
+        for (lat, lon), match in zip(self.queries, matches):
+            expected = brute_nearest(self.points, lat, lon, 0.75)
+            if expected is None:
+                self.assertIsNone(match)
+            else:
+                self.assertEqual(match[0], expected[0])
+                self.assertTrue(math.isclose(match[1], expected[1], rel_tol=1e-6))
+            self.assertEqual(self.index.nearest(lat, lon, 0.75), match)
+
+    def test_k_nearest_within_larger_radius(self):
+        lat, lon = self.queries[0]
+        found = self.index.k_nearest(lat, lon, 5.0, k=4)
+        expected = sorted((scalar_haversine_km(lat, lon, p[1], p[2]), p[0]) for p in self.points)
+        expected = [(pid, d) for d, pid in expected if d < 5.0][:4]
+        self.assertEqual([f[0] for f in found], [e[0] for e in expected])
+        self.assertEqual(self.index.k_nearest(0.0, 0.0, 5.0), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,65 @@
+import time
+import unittest
+from station_search import StationSearchIndex, normalize
+
+TRANSLATIONS = [
+    ('8892007', 'Gent-Sint-Pieters', 'fr', 'Gand-Saint-Pierre'),
+    ('8892007', 'Gent-Sint-Pieters', 'nl', 'Gent-Sint-Pieters'),
+    ('8893120', 'Gent-Dampoort', 'fr', 'Gand-Dampoort'),
+    ('8841004', 'Liège-Guillemins', 'nl', 'Luik-Guillemins'),
+    ('8814001', 'Brussel-Zuid', 'fr', 'Bruxelles-Midi'),
+    ('8811916', 'Genval', 'nl', 'Genval'),
+    ('8861200', 'Gembloux', 'nl', 'Gembloers'),
+]
+IMPORTANCE = {'8892007': 900, '8893120': 300, '8811916': 40, '8861200': 120}
+
+
+class StationSearchTestCase(unittest.TestCase):
+    def setUp(self):
+        self.index = StationSearchIndex(TRANSLATIONS, IMPORTANCE)
+
+    def names(self, q, **kwargs):
+        return [s.name for s in self.index.search(q, **kwargs)]
+
+    def test_normalize(self):
+        self.assertEqual(normalize("Liège-Guillemins"), 'liege guillemins')
+        self.assertEqual(normalize(" Bruxelles-Midi / Brussel-Zuid "), 'bruxelles midi brussel zuid')
+
+    def test_ranking(self):
+        # prefix matches first, then by importance
+        self.assertEqual(self.names('ge')[:4], ['Gent-Sint-Pieters', 'Gent-Dampoort', 'Gembloux', 'Genval'])
+        self.assertEqual(self.names('gent'), ['Gent-Sint-Pieters', 'Gent-Dampoort'])
+        self.assertEqual(self.names('dampoort'), ['Gent-Dampoort'])   # word prefix
+        self.assertEqual(self.names('liege'), ['Liège-Guillemins'])   # accents ignored
+        self.assertEqual(self.names('Gand Saint'), ['Gent-Sint-Pieters'])
+        self.assertEqual(self.names('luik'), ['Liège-Guillemins'])    # translated name
+
+    def test_fuzzy_and_strict_matching(self):
+        self.assertEqual(self.names('guilemins'), ['Liège-Guillemins'])
+        self.assertEqual(self.index.matching('guilemins'), [])
+        self.assertEqual([s.name for s in self.index.matching('midi')], ['Brussel-Zuid'])
+        self.assertEqual(self.names('   '), [])
+
+    def test_short_queries_match_inside_words_when_filtering(self):
+        self.assertEqual(self.names('nt'), [])  # autocomplete: word prefixes only
+        self.assertEqual([s.name for s in self.index.matching('nt')], ['Gent-Sint-Pieters', 'Gent-Dampoort'])
+        self.assertEqual([s.name for s in self.index.matching('i')][:1], ['Gent-Sint-Pieters'])
+        self.assertEqual(sorted(s.name for s in self.index.matching('zu')), ['Brussel-Zuid'])
+
+    def test_station_payload(self):
+        station = self.index.search('gand-saint')[0]
+        self.assertEqual(station.as_dict('fr'), {"name": 'Gent-Sint-Pieters', "label": 'Gand-Saint-Pierre',
+                                                 "stop_ids": ['8892007']})
+        self.assertEqual(station.as_dict('en')['label'], 'Gent-Sint-Pieters')
+
+    def test_lookup_is_fast_on_a_full_size_index(self):
+        rows = [(f"88{i:05d}", f"Station {i:04d}-Noord", 'fr', f"Gare {i:04d} Nord") for i in range(3000)]
+        index = StationSearchIndex(rows)
+        t0 = time.perf_counter()
+        for q in ('station 12', 'gare 2999', 'nord', 'statoin 1234'):
+            index.search(q)
+        self.assertLess((time.perf_counter() - t0) / 4, 0.05)
+
+
+if __name__ == '__main__':
+    unittest.main()
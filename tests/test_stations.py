@@ -0,0 +1,74 @@
+import unittest
+from stations import StationResolver, clean_name, station_hierarchy, station_key
+
+MAPPINGS = [('8892007', 'FGSP'), ('S8821006', 'FN'), ('SNCB:8814001:0', 'FBMZ')]
+TRANSLATIONS = [('8892007', 'Gent-Sint-Pieters', 'Gand-Saint-Pierre'), ('S8821006', 'Antwerpen-Centraal', 'Anvers-Central')]
+POINTS = [('FGSP', '1', 51.036, 3.710, 'Gent-Sint-Pieters', 'Gand-Saint-Pierre'),
+          ('FN', '2', 51.217, 4.421, 'Antwerpen-Centraal', None),
+          ('FX', '3', None, None, 'Nergens', None)]
+OVERRIDES = [('leuven', 'heverlee', 'FLV')]
+
+
+class StationResolverTestCase(unittest.TestCase):
+    def setUp(self):
+        self.resolver = StationResolver(MAPPINGS, TRANSLATIONS, POINTS, overrides=OVERRIDES, version='v1')
+
+    def test_lookup_order(self):
+        r = self.resolver
+        self.assertEqual(r.resolve('8892007'), 'FGSP')
+        self.assertEqual(r.resolve('S8892007'), 'FGSP')         # S prefix added
+        self.assertEqual(r.resolve('8821006'), 'FN')            # S prefix removed
+        self.assertEqual(r.resolve('8814001'), 'FBMZ')          # numeric part of an old style id
+        self.assertEqual(r.resolve('9999999', 'GAND'), 'FGSP')  # via the translations, case-insensitive
+        self.assertEqual(r.resolve('9999999', 'Anvers'), 'FN')  # substring of a translated name
+        self.assertEqual(r.resolve('9999999', 'antwerpen'), 'FN')  # or of the official name
+        # Like the old ILIKE: '-' in the stop name becomes a space, stored names are compared as is
+        self.assertIsNone(r.resolve('9999999', 'Gand Saint-Pierre'))
+        self.assertEqual(r.resolve('8892007', 'Leuven'), 'FLV')
+        self.assertEqual(r.resolve('8892007', 'Heverlee (Leuven)'), 'FGSP')
+        self.assertIsNone(r.resolve('9999999', 'Nowhere'))
+        self.assertIsNone(r.resolve(None))
+
+    def test_fallback_order(self):
+        # Every step has its own answer, so each assertion pins which step runs first
+        r = StationResolver(
+            [('8000001', 'EXACT'), ('S8000002', 'PREFIX'), ('SNCB:8000003:0', 'DIGITS'), ('8000004', 'NAME'),
+             ('8000005', 'FIRST'), ('8000006', 'SECOND')],
+            [('8000004', 'Vier', 'Quatre'), ('8000005', 'Zeebrugge-Dorp', 'Zeebruges-Village'),
+             ('8000006', 'Zeebrugge', 'Zeebruges'), ('8000007', 'Zeven', 'Sept')],
+            [], overrides=[('lokeren', None, 'FLK')])
+        self.assertEqual(r.resolve('8000001', 'Lokeren'), 'FLK')    # 1. override beats the mapping
+        self.assertEqual(r.resolve('8000001', 'Vier'), 'EXACT')     # 2. exact id beats the name
+        self.assertEqual(r.resolve('8000002', 'Vier'), 'PREFIX')    # 3. S prefix beats digits and name
+        self.assertEqual(r.resolve('8000003', 'Vier'), 'DIGITS')    # 4. digits beat the name
+        self.assertEqual(r.resolve('42', 'Quatre'), 'NAME')         # 5. translation, then 2-4 for its stop
+        self.assertEqual(r.resolve('42', 'Zeebrugge'), 'FIRST')     # first matching row wins, not the exact one
+        self.assertIsNone(r.resolve('8000007', 'Zeven'))            # a name matching its own stop is no answer
+
+    def test_resolve_many(self):
+        self.assertEqual(self.resolver.resolve_many(['8892007', '123', '8821006_4'],
+                                                    ['Gent-Sint-Pieters', float('nan'), None]),
+                         ['FGSP', None, None])
+        # Platforms that are not mapped take the node of their station
+        self.assertEqual(self.resolver.resolve_many(['8821006_4', '123'], None, ['8821006', '123']), ['FN', None])
+
+    def test_operational_points(self):
+        r = self.resolver
+        self.assertEqual(r.op_coords('FGSP'), [3.710, 51.036])
+        self.assertIsNone(r.op_coords('FX'))
+        self.assertEqual(r.op_names('FN'), ('Antwerpen-Centraal', None))
+        self.assertEqual(r.op_names('1'), ('Gent-Sint-Pieters', 'Gand-Saint-Pierre'))  # by PTCAR id
+        self.assertIsNone(r.op_names('FZZ'))
+
+    def test_station_key(self):
+        self.assertEqual([station_key(i) for i in ('8892007', 'S8892007', '8892007_3', 'FOO')],
+                         ['8892007', '8892007', '8892007', 'FOO'])
+        self.assertEqual(station_hierarchy([('8892007_3', 'S8892007'), ('X1', float('nan'))]),
+                         {'8892007_3': '8892007', 'X1': 'X1'})
+
+    def test_clean_name(self):
+        self.assertEqual(clean_name('Brussel-Zuid/Bruxelles-Midi'), 'brussel zuid bruxelles midi')
+
+
+if __name__ == '__main__':
+    unittest.main()
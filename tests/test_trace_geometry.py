@@ -0,0 +1,126 @@
+import json
+import unittest
+from werkzeug.datastructures import MIMEAccept
+from trace_geometry import (decode_polyline, encode_delta, encode_geobuf, encode_polyline,
+                            encode_trace, merge_trace, negotiate_format)
+
+COLLECTION = {
+    "type": "FeatureCollection",
+    "features": [
+        {"type": "Feature",
+         "geometry": {"type": "LineString", "coordinates": [[3.71, 51.036], [3.74, 51.056], [3.993, 51.104]]},
+         "properties": {"from_id": "FGSP", "to_id": "FLK"}},
+        {"type": "Feature",
+         "geometry": {"type": "MultiLineString", "coordinates": [[[4.36, 50.86], [4.48, 50.9]], [[4.48, 50.9], [4.7, 50.88]]]},
+         "properties": {"from_id": "FN", "to_id": "FLV", "virtual": True}},
+    ],
+}
+
+
+def read_varint(buf, pos):
+    result = shift = 0
+    while True:
+        b = buf[pos]
+        pos += 1
+        result |= (b & 0x7f) << shift
+        shift += 7
+        if b < 0x80:
+            return result, pos
+
+
+def read_message(buf):
+    """Minimal protobuf reader: {field: [values]} with bytes for length-delimited fields."""
+    fields = {}
+    pos = 0
+    while pos < len(buf):
+        key, pos = read_varint(buf, pos)
+        field, wire = key >> 3, key & 7
+        if wire == 0:
+            value, pos = read_varint(buf, pos)
+        elif wire == 2:
+            n, pos = read_varint(buf, pos)
+            value, pos = buf[pos:pos + n], pos + n
+        else:
+            raise AssertionError(f"unexpected wire type {wire}")
+        fields.setdefault(field, []).append(value)
+    return fields
+
+
+def read_packed(buf, signed=False):
+    values, pos = [], 0
+    while pos < len(buf):
+        v, pos = read_varint(buf, pos)
+        values.append((v >> 1) ^ -(v & 1) if signed else v)
+    return values
+
+
+class TraceGeometryTestCase(unittest.TestCase):
+    def test_polyline_reference_vector(self):
+        line = [[-120.2, 38.5], [-120.95, 40.7], [-126.453, 43.252]]
+        encoded = encode_polyline(line)
+        self.assertEqual(encoded, '_p~iF~ps|U_ulLnnqC_mqNvxq`@')
+        for (x1, y1), (x2, y2) in zip(decode_polyline(encoded), line):
+            self.assertAlmostEqual(x1, x2)
+            self.assertAlmostEqual(y1, y2)
+
+    def test_delta_encoding(self):
+        self.assertEqual(encode_delta([[3.71, 51.036], [3.74, 51.056]]), [371000, 5103600, 3000, 2000])
+
+    def test_compact_json_formats(self):
+        body, mimetype = encode_trace(COLLECTION, 'polyline')
+        data = json.loads(body)
+        self.assertEqual(mimetype, 'application/vnd.treinfo.polyline+json')
+        self.assertEqual(len(data['features'][1]['lines']), 2)
+        self.assertEqual(data['features'][1]['properties'], {"from_id": "FN", "to_id": "FLV", "virtual": True})
+        data = json.loads(encode_trace(COLLECTION, 'delta')[0])
+        self.assertEqual(data['features'][0]['lines'][0][:2], [371000, 5103600])
+
+    def test_geobuf_structure(self):
+        data = read_message(encode_geobuf(COLLECTION))
+        self.assertEqual([k.decode() for k in data[1]], ['from_id', 'to_id', 'virtual'])
+        features = read_message(data[4][0])[1]
+        self.assertEqual(len(features), 2)
+
+        multi = read_message(features[1])
+        geometry = read_message(multi[1][0])
+        self.assertEqual(geometry[1], [3])
+        self.assertEqual(read_packed(geometry[2][0]), [2, 2])
+        coords = read_packed(geometry[3][0], signed=True)
+        self.assertEqual(coords[:4], [4360000, 50860000, 120000, 40000])
+        self.assertEqual(coords[4:6], [4480000, 50900000])  # deltas restart per line
+        self.assertEqual(read_packed(multi[14][0]), [0, 0, 1, 1, 2, 2])
+        self.assertEqual(read_message(multi[13][2]), {5: [1]})
+
+    def test_merge_orients_and_stitches_segments(self):
+        def feature(coords, a, b, **extra):
+            return {"type": "Feature", "geometry": {"type": "LineString", "coordinates": coords},
+                    "properties": dict(from_id=a, to_id=b, **extra)}
+
+        collection = {"type": "FeatureCollection", "features": [
+            feature([[4.01, 50.0], [4.0, 50.0]], 'B', 'A'),              # stored backwards
+            feature([[4.01, 50.0], [4.02, 50.0], [4.03, 50.0]], 'B', 'C'),
+            feature([[4.04, 50.0], [4.03, 50.0]], 'D', 'C'),             # stored backwards
+            feature([[4.04, 50.0], [4.2, 50.1]], 'D', 'X', fallback=True),
+            feature([[4.2, 50.1], [4.21, 50.1]], 'X', 'Y', virtual=True),
+        ]}
+        merged = merge_trace(collection)
+        line, fallback = merged['features']
+        self.assertEqual(line['geometry'], {"type": "MultiLineString", "coordinates": [
+            [[4.0, 50.0], [4.01, 50.0], [4.02, 50.0], [4.03, 50.0], [4.04, 50.0]],
+            [[4.2, 50.1], [4.21, 50.1]],
+        ]})
+        self.assertEqual(line['properties']['segments'], {
+            "from_id": ['B', 'B', 'D', 'X'], "to_id": ['A', 'C', 'C', 'Y'],
+            "part": [0, 0, 0, 1], "offset": [0, 1, 3, 0], "virtual": [0, 0, 0, 1]})
+        self.assertTrue(fallback['properties']['fallback'])
+        self.assertEqual(fallback['geometry']['coordinates'], [[4.04, 50.0], [4.2, 50.1]])
+
+    def test_negotiation(self):
+        self.assertEqual(negotiate_format({}, MIMEAccept([('*/*', 1)])), 'geojson')
+        self.assertEqual(negotiate_format({}, MIMEAccept([('application/x-protobuf', 1)])), 'geobuf')
+        self.assertEqual(negotiate_format({'format': 'Polyline'}, MIMEAccept([('application/x-protobuf', 1)])), 'polyline')
+        self.assertIsNone(negotiate_format({'format': 'kml'}, MIMEAccept([])))
+
+
+if __name__ == '__main__':
+    unittest.main()
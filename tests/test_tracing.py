@@ -0,0 +1,428 @@
+import os
+os.environ.setdefault('FLASK_TESTING', '1')
+os.environ.setdefault('DATABASE_URL', 'sqlite:///:memory:')
+
+import unittest
+import gzip
+import json
+import re
+import tempfile
+from unittest import mock
+from sqlalchemy import event
+import pandas as pd
+import main
+from main import app, db, Train, TrainStop, InfrabelOperationalPoint, InfrabelStationToStation, StationMapping, StopPairPath, StopTranslation, User, Journey
+
+POINTS = {
+    'FGSP': (51.036, 3.710), 'FGDM': (51.056, 3.740), 'FLK': (51.104, 3.993),
+    'FSN': (51.171, 4.143), 'FM': (51.017, 4.482), 'FN': (50.860, 4.361),
+    'FBNL': (50.898, 4.484), 'FLV': (50.881, 4.716), 'FX': (50.0, 5.0), 'FY': (50.1, 5.1),
+}
+SEGMENTS = [
+    ('FGSP', 'FGDM', 4.0), ('FGDM', 'FLK', 18.0), ('FGSP', 'FLK', 30.0), ('FLK', 'FSN', 12.0),
+    ('FSN', 'FM', 40.0), ('FM', 'FN', 20.0), ('FN', 'FLV', 25.0), ('FX', 'FY', None),
+]
+MAPPING = [
+    ('8892007', 'FGSP'), ('8893120', 'FGDM'), ('8894508', 'FSN'), ('8821006', 'FN'),
+    ('8822004', 'FM'), ('8819406', 'FBNL'), ('8833001', 'FLV'), ('8800001', 'FX'), ('8800002', 'FY'),
+]
+STOPS = [
+    ('8892007', 'Gent-Sint-Pieters'), ('8893120', 'Gent-Dampoort'), ('8894508', 'Sint-Niklaas'),
+    ('8821006', 'Antwerpen-Centraal'), ('8800001', 'X'), ('8800002', 'Y'),
+]
+
+
+class TracingTestCase(unittest.TestCase):
+    """Seeds a tiny Infrabel network and a train running over it."""
+
+    def setUp(self):
+        self.ctx = app.app_context()
+        self.ctx.push()
+        db.create_all()
+        for op_id, (lat, lon) in POINTS.items():
+            db.session.add(InfrabelOperationalPoint(id=op_id, ptcar_id=op_id, name_nl=f"{op_id} NL", latitude=lat, longitude=lon))
+        for i, (u, v, length) in enumerate(SEGMENTS, start=1):
+            (lat1, lon1), (lat2, lon2) = POINTS[u], POINTS[v]
+            geom = {"type": "LineString", "coordinates": [[lon1, lat1], [(lon1 + lon2) / 2, (lat1 + lat2) / 2], [lon2, lat2]]}
+            db.session.add(InfrabelStationToStation(id=i, stationfrom_id=u, stationto_id=v, length=length, geom_wkt=json.dumps(geom)))
+        for sncb_id, infrabel_id in MAPPING:
+            db.session.add(StationMapping(sncb_id=sncb_id, infrabel_id=infrabel_id, name=infrabel_id))
+        train = Train(train_number='2831', date='2026-10-17', trip_id='88____:007::8892007:8800002:6:1000:20261017')
+        db.session.add(train)
+        db.session.flush()
+        for seq, (stop_id, name) in enumerate(STOPS, start=1):
+            db.session.add(TrainStop(train_id=train.id, stop_id=stop_id, stop_name=name, stop_sequence=seq,
+                                     departure_time=f"10:{seq:02d}:00", arrival_time=f"10:{seq:02d}:00", stop_type='STOP'))
+        db.session.commit()
+        self.train_id = train.id
+        main.invalidate_station_resolver()
+        main.build_railway_graph()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.ctx.pop()
+
+    def test_find_path_is_persisted_per_graph_version(self):
+        path = main.find_path('FGSP', 'FN')
+        self.assertEqual(path, [1, 2, 4, 5, 'V_FBNL_FM', 'V_FBNL_FN'])
+        row = db.session.get(StopPairPath, ('FGSP', 'FN', main.GRAPH_MANAGER.graph.version))
+        self.assertEqual(json.loads(row.segment_ids), path)
+
+        # A fresh worker (empty LRU) reads the stored path instead of searching
+        main.PATH_CACHE.clear()
+        db.session.query(StopPairPath).update({"segment_ids": json.dumps([7])})
+        db.session.commit()
+        self.assertEqual(main.find_path('FGSP', 'FN'), [7])
+
+    def test_find_paths_searches_once_per_origin(self):
+        graph = main.GRAPH_MANAGER.graph
+        with mock.patch.object(graph, 'shortest_paths', wraps=graph.shortest_paths) as batch, \
+             mock.patch.object(graph, 'shortest_path', wraps=graph.shortest_path) as single:
+            paths = main.find_paths(['FGSP', 'FGSP', 'FGSP', 'FN', 'FX'], ['FSN', 'FN', 'FSN', 'FN', 'FGSP'],
+                                    mode='dijkstra')
+        batch.assert_called_once()
+        single.assert_not_called()
+        self.assertEqual(paths, {
+            ('FGSP', 'FSN'): [1, 2, 4],
+            ('FGSP', 'FN'): [1, 2, 4, 5, 'V_FBNL_FM', 'V_FBNL_FN'],
+            ('FN', 'FN'): [],
+            ('FX', 'FGSP'): None,
+        })
+        self.assertEqual(StopPairPath.query.count(), 2)
+        # Second call is served from the cache without searching
+        with mock.patch.object(graph, 'shortest_paths') as batch:
+            self.assertEqual(main.find_paths(['FGSP'], ['FSN']), {('FGSP', 'FSN'): [1, 2, 4]})
+        batch.assert_not_called()
+
+    def test_find_paths_uses_the_single_pair_mode_outside_dijkstra(self):
+        graph = main.GRAPH_MANAGER.graph
+        with mock.patch.object(graph, 'shortest_paths') as batch, \
+             mock.patch.object(graph, 'shortest_path', wraps=graph.shortest_path) as single:
+            batched = main.find_paths(['FGSP', 'FGSP'], ['FSN', 'FN'], mode='astar')
+        batch.assert_not_called()
+        self.assertEqual(sorted(c.args for c in single.call_args_list),
+                         [('FGSP', 'FN', 'astar'), ('FGSP', 'FSN', 'astar')])
+        # The same pairs computed one by one (cache dropped) give the same paths
+        main.PATH_CACHE.clear()
+        db.session.query(StopPairPath).delete()
+        db.session.commit()
+        self.assertEqual({pair: main.find_path(*pair, mode='astar') for pair in batched}, batched)
+
+    def test_graph_version_change_invalidates_stored_paths(self):
+        db.session.add(StopPairPath(from_id='FGSP', to_id='FN', graph_version='stale', segment_ids='[1]'))
+        db.session.commit()
+        main.build_railway_graph()
+        versions = {r.graph_version for r in StopPairPath.query.all()}
+        self.assertNotIn('stale', versions)
+
+    def test_unreachable_pair_falls_back_to_straight_line(self):
+        self.assertIsNone(main.find_path('FGSP', 'FX'))
+        trace = main.get_trace_geometry(self.train_id, '8821006', '8800001')
+        self.assertEqual(len(trace['features']), 1)
+        self.assertTrue(trace['features'][0]['properties']['fallback'])
+
+    def test_trace_geometry_comes_from_graph(self):
+        # Segment rows are only read at build time
+        InfrabelStationToStation.query.delete()
+        db.session.commit()
+        trace = main.get_trace_geometry(self.train_id, '8892007', '8894508')
+        self.assertEqual([f['properties']['from_id'] for f in trace['features']], ['FGSP', 'FGDM', 'FLK'])
+        (lat1, lon1), (lat2, lon2) = POINTS['FGSP'], POINTS['FGDM']
+        self.assertEqual(trace['features'][0]['geometry'], {
+            "type": "LineString",
+            "coordinates": [[lon1, lat1], [(lon1 + lon2) / 2, (lat1 + lat2) / 2], [lon2, lat2]]})
+        self.assertEqual(main.get_pt_coords('FLK'), [POINTS['FLK'][1], POINTS['FLK'][0]])
+
+    def test_stop_resolution_uses_no_queries(self):
+        main.station_resolver()
+        statements = []
+        listener = lambda conn, cursor, statement, *args: statements.append(statement)
+        event.listen(db.engine, 'before_cursor_execute', listener)
+        try:
+            ids = main.stop_infrabel_ids(TrainStop.query.filter_by(train_id=self.train_id).all())
+            self.assertEqual(main.get_pt_coords('FM'), [POINTS['FM'][1], POINTS['FM'][0]])
+            with app.test_request_context('/?lang=nl'):
+                self.assertEqual(main.get_op_name('FLK'), 'FLK NL')
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', listener)
+        self.assertEqual(ids, ['FGSP', 'FGDM', 'FSN', 'FN', 'FX', 'FY'])
+        self.assertEqual(len(statements), 1)  # only the TrainStop query
+
+        # New mapping rows are picked up once the resolver is invalidated
+        db.session.add(StationMapping(sncb_id='8800003', infrabel_id='FM', name='FM'))
+        db.session.commit()
+        main.invalidate_station_resolver()
+        self.assertEqual(main.get_infrabel_id('8800003'), 'FM')
+
+    def test_stop_nodes_are_stored_and_read_back(self):
+        # A stop without a name is matched (and counted) too
+        db.session.add(TrainStop(train_id=self.train_id, stop_id='8822004', stop_name=None, stop_sequence=7))
+        db.session.commit()
+        self.assertEqual(main.backfill_stop_nodes(), 7)
+        self.assertEqual(main.backfill_stop_nodes(), 0)
+        stops = TrainStop.query.filter_by(train_id=self.train_id).order_by(TrainStop.stop_sequence).all()
+        self.assertEqual([s.infrabel_id for s in stops], ['FGSP', 'FGDM', 'FSN', 'FN', 'FX', 'FY', 'FM'])
+        self.assertEqual([s.station_id for s in stops], [s[0] for s in STOPS] + ['8822004'])
+
+        # Stored nodes are only trusted once stamped with the current mapping version
+        stops[2].infrabel_id = 'FLK'
+        db.session.commit()
+        self.assertEqual(main.stop_infrabel_ids(stops)[2], 'FSN')
+        self.assertTrue(main.restamp_stop_nodes())
+        self.assertFalse(main.restamp_stop_nodes())
+        db.session.refresh(stops[2])
+        self.assertEqual(stops[2].infrabel_id, 'FSN')  # re-resolved by the restamp
+        stops[2].infrabel_id = 'FLK'
+        db.session.commit()
+        trace = main.get_trace_geometry(self.train_id, '8892007', '8894508')
+        self.assertEqual([f['properties']['to_id'] for f in trace['features']], ['FGDM', 'FLK'])
+
+        # A corrected mapping takes effect at once; the restamp then rewrites the stored ids
+        self.assertEqual(main.get_trace_geometry(self.train_id, '8800002', '8822004')['features'][0]['properties']['to_id'], 'FM')
+        db.session.get(StationMapping, '8822004').infrabel_id = 'FN'
+        db.session.commit()
+        main.invalidate_station_resolver()
+        self.assertEqual(main.stop_infrabel_ids(stops)[6], 'FN')
+        trace = main.get_trace_geometry(self.train_id, '8800002', '8822004')
+        self.assertEqual(trace['features'][0]['properties']['to_id'], 'FN')
+        self.assertTrue(main.restamp_stop_nodes())
+        db.session.refresh(stops[6])
+        self.assertEqual(stops[6].infrabel_id, 'FN')
+
+        table = main.stop_node_table(pd.DataFrame({'stop_id': ['8892007', '8822004', '123', '8822004_7'],
+                                                   'stop_name': ['Gent-Sint-Pieters', 'Mechelen', None, 'Mechelen'],
+                                                   'parent_station': [None, None, None, 'S8822004']}))
+        self.assertEqual(table['infrabel_id'].tolist(), ['FGSP', 'FN', None, 'FN'])  # corrected mapping above
+        self.assertEqual(table['station_id'].tolist(), ['8892007', '8822004', '123', '8822004'])
+
+    def test_station_suggestions_and_board_use_search_index(self):
+        db.session.add_all([
+            StopTranslation(stop_id='8892007', field_value='Gent-Sint-Pieters', lang='fr', translation='Gand-Saint-Pierre'),
+            StopTranslation(stop_id='8893120', field_value='Gent-Dampoort', lang='fr', translation='Gand-Dampoort'),
+        ])
+        db.session.commit()
+        main.invalidate_station_resolver()
+        client = app.test_client()
+        data = client.get('/api/station_suggestions?q=gand', headers={'Accept-Language': 'fr'}).get_json()
+        self.assertEqual([s['label'] for s in data], ['Gand-Dampoort', 'Gand-Saint-Pierre'])
+        self.assertEqual(data[1]['stop_ids'], ['8892007'])
+
+        with mock.patch.object(StopTranslation, 'query') as scan:
+            trains = client.get('/api/search_trains?q=saint-pierre').get_json()
+        scan.assert_not_called()
+        self.assertEqual([t['id'] for t in trains], [self.train_id])
+        # Short queries still match inside a name, like the old ILIKE '%q%'
+        self.assertEqual([t['id'] for t in client.get('/api/search_trains?q=mp').get_json()], [self.train_id])
+
+        # A platform-level stop with its own name is found through its station_id
+        other = Train(train_number='9001', date='2026-10-17', trip_id='platform')
+        db.session.add(other)
+        db.session.flush()
+        db.session.add_all([
+            TrainStop(train_id=other.id, stop_id='8892007_4', stop_name='Gent-St-Pieters perron 4', stop_sequence=1),
+            TrainStop(train_id=other.id, stop_id='8800002', stop_name='Y', stop_sequence=2),
+        ])
+        db.session.commit()
+        main.backfill_stop_nodes()
+        self.assertEqual(db.session.query(TrainStop.station_id).filter_by(stop_id='8892007_4').scalar(), '8892007')
+        trains = client.get('/api/search_trains?q=saint-pierre').get_json()
+        self.assertEqual(sorted(t['id'] for t in trains), sorted([self.train_id, other.id]))
+
+    def test_trace_zoom_selects_simplified_geometry(self):
+        client = app.test_client()
+        full = client.get(f'/api/trace/{self.train_id}?start=8892007&end=8894508').get_json()
+        self.assertEqual(len(full['features'][0]['geometry']['coordinates']), 3)
+        coarse = client.get(f'/api/trace/{self.train_id}?start=8892007&end=8894508&zoom=6').get_json()
+        self.assertEqual(len(coarse['features'][0]['geometry']['coordinates']), 2)
+        same = client.get(f'/api/trace/{self.train_id}?start=8892007&end=8894508&tolerance=0').get_json()
+        self.assertEqual(same, full)
+
+    def test_trace_encodings(self):
+        client = app.test_client()
+        url = f'/api/trace/{self.train_id}?start=8892007&end=8894508'
+        resp = client.get(url + '&format=polyline')
+        self.assertEqual(resp.mimetype, 'application/vnd.treinfo.polyline+json')
+        self.assertEqual(len(resp.get_json()['features']), 3)
+        resp = client.get(url, headers={'Accept': 'application/x-protobuf'})
+        self.assertEqual(resp.mimetype, 'application/x-protobuf')
+        self.assertIn('Accept', resp.headers['Vary'])
+        self.assertLess(len(resp.data), len(client.get(url).data))
+        self.assertEqual(client.get(url + '&format=kml').status_code, 400)
+
+    def test_trace_merged_layout(self):
+        client = app.test_client()
+        data = client.get(f'/api/trace/{self.train_id}?start=8892007&end=8894508&layout=merged').get_json()
+        self.assertEqual(len(data['features']), 1)
+        self.assertEqual(data['features'][0]['geometry']['type'], 'LineString')
+        self.assertEqual(len(data['features'][0]['geometry']['coordinates']), 7)
+        self.assertEqual(data['features'][0]['properties']['segments']['from_id'], ['FGSP', 'FGDM', 'FLK'])
+        self.assertEqual(client.get(f'/api/trace/{self.train_id}?layout=tiles').status_code, 400)
+
+    def test_trace_conditional_requests_and_compression(self):
+        client = app.test_client()
+        url = f'/api/trace/{self.train_id}'
+        resp = client.get(url)
+        etag = resp.headers['ETag']
+        self.assertIn('max-age', resp.headers['Cache-Control'])
+        self.assertEqual(client.get(url, headers={'If-None-Match': etag}).status_code, 304)
+        self.assertEqual(client.get(url + '?zoom=6', headers={'If-None-Match': etag}).status_code, 200)
+
+        gz = client.get(url, headers={'Accept-Encoding': 'gzip'})
+        self.assertEqual(gz.headers['Content-Encoding'], 'gzip')
+        self.assertEqual(json.loads(gzip.decompress(gz.data)), resp.get_json())
+        self.assertNotEqual(gz.headers['ETag'], etag)
+        self.assertEqual(client.get(url, headers={'If-None-Match': gz.headers['ETag']}).status_code, 304)
+        # The 304 keeps the validator and Vary of the gzip representation it revalidates
+        resp = client.get(url, headers={'If-None-Match': gz.headers['ETag'], 'Accept-Encoding': 'gzip'})
+        self.assertEqual(resp.status_code, 304)
+        self.assertEqual(resp.headers['ETag'], gz.headers['ETag'])
+        self.assertIn('Accept-Encoding', resp.headers['Vary'])
+        resp = client.get(url, headers={'If-None-Match': etag})
+        self.assertEqual((resp.status_code, resp.headers['ETag']), (304, etag))
+
+        # Only the geometry routes are compressed
+        with mock.patch.object(main.http_cache, 'COMPRESS_MIN_SIZE', 0):
+            resp = client.get('/api/station_suggestions?q=gent', headers={'Accept-Encoding': 'gzip'})
+            self.assertEqual(client.get(url, headers={'Accept-Encoding': 'gzip'}).headers['Content-Encoding'], 'gzip')
+        self.assertNotIn('Content-Encoding', resp.headers)
+        self.assertNotIn('Accept-Encoding', resp.headers.get('Vary', ''))
+        self.assertIsInstance(resp.get_json(), list)
+
+        # A changed stop list is a new representation
+        db.session.query(TrainStop).filter_by(stop_id='8800002').delete()
+        db.session.commit()
+        self.assertEqual(client.get(url, headers={'If-None-Match': etag}).status_code, 200)
+
+        # So is a stop that resolves to another node: stored at sync / backfill, or via a new mapping
+        main.backfill_stop_nodes(only_missing=False)
+        etag = client.get(url).headers['ETag']
+        db.session.query(TrainStop).filter_by(stop_id='8894508').update({"infrabel_id": 'FLK'})
+        db.session.commit()
+        resp = client.get(url, headers={'If-None-Match': etag})
+        self.assertEqual(resp.status_code, 200)
+        etag = resp.headers['ETag']
+        db.session.query(TrainStop).update({"infrabel_id": None})
+        db.session.get(StationMapping, '8894508').infrabel_id = 'FM'
+        db.session.commit()
+        main.invalidate_station_resolver()
+        resp = client.get(url, headers={'If-None-Match': etag})
+        self.assertEqual(resp.status_code, 200)
+        self.assertIn('FM', [f['properties']['to_id'] for f in resp.get_json()['features']])
+
+    def test_coverage_follows_the_station_mapping(self):
+        client = app.test_client()
+        user = User(username='tester', email='t@example.com', password_hash='x')
+        db.session.add(user)
+        db.session.flush()
+        db.session.add(Journey(user_id=user.id, train_id=self.train_id, train_number='2831',
+                               start_stop_id='8892007', end_stop_id='8894508'))
+        db.session.add(Journey(user_id=user.id, train_id=self.train_id, train_number='2831'))
+        db.session.commit()
+        with client.session_transaction() as sess:
+            sess['user_id'] = user.id
+        self.assertEqual(main.journey_node_pairs(main.user_journey_rows(user.id)), (('FGSP', 'FSN'), ('FGSP', 'FY')))
+
+        resp = client.get('/api/coverage')
+        etag = resp.headers['ETag']
+        self.assertEqual(client.get('/api/coverage', headers={'If-None-Match': etag}).status_code, 304)
+
+        # Same journeys, corrected mapping: new ETag and no stale cached segments
+        db.session.get(StationMapping, '8894508').infrabel_id = 'FM'
+        db.session.commit()
+        main.invalidate_station_resolver()
+        resp = client.get('/api/coverage', headers={'If-None-Match': etag})
+        self.assertEqual(resp.status_code, 200)
+        ends = {(f['properties']['from_id'], f['properties']['to_id']) for f in resp.get_json()['features']}
+        self.assertIn(('FSN', 'FM'), ends)
+
+    def test_index_exposes_the_geometry_levels(self):
+        html = app.test_client().get('/').get_data(as_text=True)
+        levels = json.loads(re.search(r'window\.GEOMETRY_LEVELS = (.*);', html).group(1))
+        self.assertEqual(levels['tolerances'], [0.0] + sorted(main.GEOMETRY_TOLERANCES))
+        self.assertAlmostEqual(levels['meters_per_pixel_z0'], main.METERS_PER_PIXEL_Z0)
+
+    def test_prewarm_dedupes_stopping_patterns(self):
+        twin = Train(train_number='2841', date='2026-10-17', trip_id='twin')
+        db.session.add(twin)
+        db.session.flush()
+        for seq, (stop_id, name) in enumerate(STOPS, start=1):
+            db.session.add(TrainStop(train_id=twin.id, stop_id=stop_id, stop_name=name, stop_sequence=seq))
+        db.session.commit()
+
+        with mock.patch.object(main, 'stop_infrabel_ids', wraps=main.stop_infrabel_ids) as resolve:
+            main.prewarm_traces(['2026-10-17', '2026-10-18'], pause=0)
+        self.assertEqual(resolve.call_count, 1)  # once per pattern, also when it misses the cache
+        status = app.test_client().get('/api/debug/prewarm').get_json()
+        self.assertEqual((status['state'], status['trains'], status['patterns'], status['computed']), ('done', 2, 1, 1))
+
+        graph = main.GRAPH_MANAGER.graph
+        with mock.patch.object(graph, 'shortest_paths') as search:
+            self.assertEqual(main.get_trace_geometry(twin.id), main.get_trace_geometry(self.train_id))
+            # A part of the train only assembles geometry from the warmed stop-pair paths
+            self.assertEqual(len(main.get_trace_geometry(twin.id, '8892007', '8894508')['features']), 3)
+        search.assert_not_called()
+        self.assertGreater(app.test_client().get('/api/debug/prewarm').get_json()['trace_cache']['hits'], 0)
+
+        main.prewarm_traces(['2026-10-17'], pause=0)
+        self.assertEqual(main.PREWARM_STATUS['already_cached'], 1)
+
+    def test_network_and_coverage_tiles(self):
+        client = app.test_client()
+        resp = client.get('/tiles/6/32/21.mvt')
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.mimetype, 'application/vnd.mapbox-vector-tile')
+        self.assertIn(b'network', resp.data)
+        self.assertEqual(client.get('/tiles/2/9/0.mvt').status_code, 404)
+        self.assertEqual(client.get('/tiles/coverage/6/32/21.mvt').status_code, 401)
+
+        user = User(username='tester', email='t@example.com', password_hash='x')
+        db.session.add(user)
+        db.session.commit()
+        with client.session_transaction() as sess:
+            sess['user_id'] = user.id
+        self.assertEqual(client.get('/tiles/coverage/6/32/21.mvt').data, b'')
+        db.session.add(Journey(user_id=user.id, train_id=self.train_id, train_number='2831',
+                               start_stop_id='8892007', end_stop_id='8894508'))
+        db.session.commit()
+        self.assertIn(b'coverage', client.get('/tiles/coverage/6/32/21.mvt').data)
+
+    def test_graph_components_endpoint(self):
+        data = app.test_client().get('/api/debug/graph_components?limit=3').get_json()
+        self.assertEqual(data['component_count'], 2)
+        self.assertEqual([c['size'] for c in data['components']], [8, 2])
+        self.assertEqual(len(data['components'][0]['nodes']), 3)
+
+    def test_journey_distance_uses_segment_lengths(self):
+        dist = main.get_journey_distance(self.train_id, '8892007', '8894508')
+        self.assertEqual(dist, 34.0)
+
+    def test_graph_is_loaded_from_snapshot(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'graph.snap')
+            with mock.patch.object(main, 'GRAPH_SNAPSHOT_PATH', path):
+                built = main.build_railway_graph()
+                with mock.patch.object(main, 'compile_railway_graph') as compile_graph:
+                    loaded = main.build_railway_graph()
+                compile_graph.assert_not_called()
+                self.assertIsInstance(loaded.targets, memoryview)
+                self.assertEqual(loaded.version, built.version)
+                self.assertEqual(main.find_path('FGSP', 'FSN'), [1, 2, 4])
+
+                db.session.add(InfrabelStationToStation(id=9, stationfrom_id='FY', stationto_id='FGSP', length=5.0))
+                db.session.commit()
+                rebuilt = main.build_railway_graph()
+                self.assertNotEqual(rebuilt.version, built.version)
+
+    def test_trace_returns_503_while_graph_is_warming(self):
+        with mock.patch.object(main.GRAPH_MANAGER, 'graph', None), \
+             mock.patch.object(main.GRAPH_MANAGER, 'refresh') as refresh:
+            resp = app.test_client().get(f'/api/trace/{self.train_id}')
+        self.assertEqual(resp.status_code, 503)
+        self.assertTrue(resp.get_json()['warming'])
+        self.assertEqual(resp.headers['Retry-After'], '5')
+        refresh.assert_called_once()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,92 @@
+import os
+import tempfile
+import unittest
+from railway_graph import CompiledGraph
+from test_trace_geometry import read_message, read_packed
+import vector_tiles
+
+# Gent-Sint-Pieters -> Gent-Dampoort -> Lokeren, plus a segment far away in Liège
+GEOMETRIES = {
+    1: {"type": "LineString", "coordinates": [[3.710, 51.036], [3.725, 51.046], [3.740, 51.056]]},
+    2: {"type": "LineString", "coordinates": [[3.740, 51.056], [3.993, 51.104]]},
+    3: {"type": "LineString", "coordinates": [[5.566, 50.624], [5.600, 50.630]]},
+}
+EDGES = [('FGSP', 'FGDM', 4.0, 1), ('FGDM', 'FLK', 18.0, 2), ('FLG', 'FANS', 3.0, 3), ('FBNL', 'FN', 0.1, 'V_FBNL_FN')]
+
+
+def tile_for(lon, lat, z):
+    project = vector_tiles._projector(z, 0, 0)
+    px, py = project(lon, lat)
+    return int(px // vector_tiles.EXTENT), int(py // vector_tiles.EXTENT)
+
+
+class VectorTilesTestCase(unittest.TestCase):
+    def setUp(self):
+        self.graph = CompiledGraph.from_edges(EDGES, geometries=GEOMETRIES)
+
+    def test_clip_line(self):
+        pieces = vector_tiles._clip_line([(-10, 5), (5, 5), (20, 5), (20, 20)], 0, 10)
+        self.assertEqual(pieces, [[(0.0, 5.0), (5.0, 5.0), (10.0, 5.0)]])
+        pieces = vector_tiles._clip_line([(2, 2), (20, 2), (20, 8), (2, 8)], 0, 10)
+        self.assertEqual(pieces, [[(2.0, 2.0), (10.0, 2.0)], [(10.0, 8.0), (2.0, 8.0)]])
+
+    def test_tile_bounds_round_trip(self):
+        x, y = tile_for(3.72, 51.05, 10)
+        min_lon, min_lat, max_lon, max_lat = vector_tiles.tile_bounds(10, x, y)
+        self.assertTrue(min_lon <= 3.72 <= max_lon and min_lat <= 51.05 <= max_lat)
+
+    def test_segment_features_are_filtered_to_the_tile(self):
+        x, y = tile_for(3.712, 51.037, 15)
+        features = vector_tiles.segment_features(self.graph, 15, x, y)
+        self.assertEqual([f[0] for f in features], [1])
+        for line in features[0][1]:
+            for px, py in line:
+                self.assertTrue(-vector_tiles.BUFFER <= px <= vector_tiles.EXTENT + vector_tiles.BUFFER)
+        self.assertEqual(vector_tiles.segment_features(self.graph, 15, x, y, segment_filter={2}), [])
+        self.assertEqual([f[0] for f in vector_tiles.segment_features(self.graph, 15, x, y,
+                                                                      segment_filter={1, 'unknown'})], [1])
+
+        x, y = tile_for(4.5, 50.8, 6)
+        ids = sorted(f[0] for f in vector_tiles.segment_features(self.graph, 6, x, y))
+        self.assertEqual(ids, [1, 2, 3])
+
+    def test_visible_segments_uses_the_level_bounding_boxes(self):
+        store = self.graph.geometry_level(0.0)
+        self.assertEqual(vector_tiles.visible_segments(store, (3.70, 51.03, 3.72, 51.04)).tolist(), [0])
+        self.assertEqual(vector_tiles.visible_segments(store, (3.0, 50.0, 6.0, 52.0)).tolist(), [0, 1, 2])
+        # The virtual edge has no geometry and never matches
+        self.assertEqual(vector_tiles.visible_segments(store, (-180, -90, 180, 90)).tolist(), [0, 1, 2])
+
+    def test_encoded_tile_structure(self):
+        x, y = tile_for(3.712, 51.037, 15)
+        tile = read_message(vector_tiles.encode_tile({"network": vector_tiles.segment_features(self.graph, 15, x, y),
+                                                      "empty": []}))
+        self.assertEqual(len(tile[3]), 1)
+        layer = read_message(tile[3][0])
+        self.assertEqual(layer[15], [2])
+        self.assertEqual(layer[1], [b'network'])
+        self.assertEqual(layer[5], [4096])
+        self.assertEqual(layer[3], [b'segment_id', b'from_id', b'to_id'])
+        feature = read_message(layer[2][0])
+        self.assertEqual(feature[1], [1])
+        self.assertEqual(feature[3], [2])
+        self.assertEqual(read_packed(feature[2][0]), [0, 0, 1, 1, 2, 2])
+        commands = read_packed(feature[4][0])
+        self.assertEqual(commands[0], (1 << 3) | 1)  # MoveTo, 1 point
+        self.assertEqual(commands[3] & 7, 2)          # then LineTo
+        self.assertEqual(len(commands), 3 + 1 + 2 * (commands[3] >> 3))
+
+    def test_tile_cache_prunes_other_versions(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            cache = vector_tiles.TileCache(tmp)
+            cache.put('v1', 'network', 1, 0, 0, b'old')
+            cache.put('v2', 'network', 1, 0, 0, b'new')
+            self.assertEqual(cache.get('v1', 'network', 1, 0, 0), b'old')
+            cache.prune('v2')
+            self.assertIsNone(cache.get('v1', 'network', 1, 0, 0))
+            self.assertEqual(cache.get('v2', 'network', 1, 0, 0), b'new')
+            self.assertEqual(os.listdir(tmp), ['v2'])
+
+
+if __name__ == '__main__':
+    unittest.main()
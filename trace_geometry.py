@@ -0,0 +1,327 @@
+"""Compact encodings for trace FeatureCollections.
+
+``/api/trace`` builds a GeoJSON FeatureCollection of LineString /
+MultiLineString features; the helpers here re-encode it for clients that ask
+for something smaller:
+
+* ``polyline`` - Google encoded polylines (lat, lon order, 5 decimals) per line
+* ``delta``    - integer coordinates (lon, lat, 5 decimals), the first point
+                 absolute and every next point as a delta to the previous one
+* ``geobuf``   - the Geobuf protobuf schema (https://github.com/mapbox/geobuf),
+                 a binary FeatureCollection readable with the ``geobuf`` JS lib
+
+GeoJSON stays the default. The format is picked with ``?format=`` or, when
+that is absent, the ``Accept`` header. ``merge_trace`` offers a second layout
+in which the segments are stitched into one continuous line.
+"""
+import json
+import math
+import struct
+
+FORMATS = ('geojson', 'polyline', 'delta', 'geobuf')
+
+MIMETYPES = {
+    'geojson': 'application/json',
+    'polyline': 'application/vnd.treinfo.polyline+json',
+    'delta': 'application/vnd.treinfo.delta+json',
+    'geobuf': 'application/x-protobuf',
+}
+_ACCEPT = {
+    'application/json': 'geojson',
+    'application/geo+json': 'geojson',
+    MIMETYPES['polyline']: 'polyline',
+    MIMETYPES['delta']: 'delta',
+    'application/x-protobuf': 'geobuf',
+    'application/vnd.geobuf': 'geobuf',
+}
+
+LAYOUTS = ('segments', 'merged')
+# Pieces whose nearest endpoints are further apart than this start a new part
+MERGE_GAP_M = 25.0
+
+POLYLINE_PRECISION = 5
+DELTA_PRECISION = 5
+GEOBUF_PRECISION = 6
+
+
+def negotiate_format(args, accept_mimetypes):
+    """Chosen format name, or None when ``?format=`` names an unknown format."""
+    fmt = args.get('format')
+    if fmt:
+        fmt = fmt.lower()
+        return fmt if fmt in FORMATS else None
+    best = accept_mimetypes.best_match(list(_ACCEPT), default='application/json')
+    return _ACCEPT.get(best, 'geojson')
+
+
+def encode_trace(collection, fmt):
+    """(body, mimetype) for a trace FeatureCollection in ``fmt``."""
+    if fmt == 'polyline':
+        body = _compact_json('polyline', POLYLINE_PRECISION, collection, encode_polyline)
+    elif fmt == 'delta':
+        body = _compact_json('delta', DELTA_PRECISION, collection, encode_delta)
+    elif fmt == 'geobuf':
+        body = encode_geobuf(collection)
+    else:
+        body = json.dumps(collection, separators=(',', ':'))
+    return body, MIMETYPES.get(fmt, MIMETYPES['geojson'])
+
+
+def _lines(geometry):
+    if geometry['type'] == 'LineString':
+        return [geometry['coordinates']]
+    return geometry['coordinates']
+
+
+def _compact_json(encoding, precision, collection, encode_line):
+    features = [{
+        "lines": [encode_line(line, precision) for line in _lines(f['geometry'])],
+        "properties": f.get('properties') or {},
+    } for f in collection['features']]
+    return json.dumps({
+        "type": "EncodedTrace",
+        "encoding": encoding,
+        "precision": precision,
+        "features": features,
+    }, separators=(',', ':'))
+
+
+# ==========================================
+# MERGED LAYOUT
+# ==========================================
+def _gap_m(a, b):
+    kx = 111320.0 * math.cos(math.radians(a[1]))
+    return math.hypot((a[0] - b[0]) * kx, (a[1] - b[1]) * 110540.0)
+
+
+def _geometry(lines):
+    if len(lines) == 1:
+        return {"type": "LineString", "coordinates": lines[0]}
+    return {"type": "MultiLineString", "coordinates": lines}
+
+
+def merge_trace(collection, gap_m=MERGE_GAP_M):
+    """Stitches a per-segment trace into one oriented (Multi)LineString feature.
+
+    Segments are appended in path order, each flipped so it continues from
+    the end of the current line; the shared vertex is written once. A new
+    part starts when a fallback connector breaks the path or when the next
+    piece does not touch the current line within ``gap_m`` metres. The
+    per-segment ids move to the columnar ``segments`` side array
+    (``part``/``offset`` locate the first vertex of the segment). Fallback
+    connectors are returned as a separate ``fallback`` feature, so a client
+    still draws them differently.
+    """
+    lines = []
+    run = None          # coordinate list of the line being extended
+    run_oriented = True  # False while the run is a single piece that may still be flipped
+    side = {"from_id": [], "to_id": [], "part": [], "offset": [], "virtual": []}
+    fallback_lines = []
+    fallback_side = {"from_id": [], "to_id": []}
+
+    for feature in collection['features']:
+        props = feature.get('properties') or {}
+        if props.get('fallback'):
+            fallback_lines.extend(_lines(feature['geometry']))
+            fallback_side["from_id"].append(props.get('from_id'))
+            fallback_side["to_id"].append(props.get('to_id'))
+            run = None
+            continue
+
+        first_piece = True
+        for piece in _lines(feature['geometry']):
+            if len(piece) < 2:
+                continue
+            piece = list(piece)
+            offset = None
+            if run is not None:
+                ends = [(_gap_m(run[-1], piece[0]), False, False), (_gap_m(run[-1], piece[-1]), False, True)]
+                if not run_oriented:
+                    ends += [(_gap_m(run[0], piece[0]), True, False), (_gap_m(run[0], piece[-1]), True, True)]
+                gap, flip_run, flip_piece = min(ends, key=lambda e: e[0])
+                if gap <= gap_m:
+                    if flip_run:
+                        run.reverse()
+                    if flip_piece:
+                        piece.reverse()
+                    offset = len(run) - 1
+                    run.extend(piece[1:] if piece[0] == run[-1] else piece)
+                    run_oriented = True
+            if offset is None:
+                run = piece
+                run_oriented = False
+                lines.append(run)
+                offset = 0
+            if first_piece:
+                side["from_id"].append(props.get('from_id'))
+                side["to_id"].append(props.get('to_id'))
+                side["part"].append(len(lines) - 1)
+                side["offset"].append(offset)
+                side["virtual"].append(1 if props.get('virtual') else 0)
+                first_piece = False
+
+    features = []
+    if lines:
+        features.append({"type": "Feature", "geometry": _geometry(lines),
+                         "properties": {"layout": "merged", "segments": side}})
+    if fallback_lines:
+        features.append({"type": "Feature", "geometry": _geometry(fallback_lines),
+                         "properties": {"layout": "merged", "fallback": True, "segments": fallback_side}})
+    return {"type": "FeatureCollection", "features": features}
+
+
+# ==========================================
+# POLYLINE / DELTA
+# ==========================================
+def encode_polyline(line, precision=POLYLINE_PRECISION):
+    """Google polyline encoding of ``[[lon, lat], ...]`` (emitted in lat, lon order)."""
+    factor = 10 ** precision
+    out = []
+    prev_lat = prev_lon = 0
+    for point in line:
+        lat = int(round(point[1] * factor))
+        lon = int(round(point[0] * factor))
+        for value in (lat - prev_lat, lon - prev_lon):
+            value = ~(value << 1) if value < 0 else value << 1
+            while value >= 0x20:
+                out.append(chr((0x20 | (value & 0x1f)) + 63))
+                value >>= 5
+            out.append(chr(value + 63))
+        prev_lat, prev_lon = lat, lon
+    return ''.join(out)
+
+
+def decode_polyline(text, precision=POLYLINE_PRECISION):
+    """Inverse of encode_polyline, returns ``[[lon, lat], ...]``."""
+    factor = 10 ** precision
+    coords = []
+    index = lat = lon = 0
+    while index < len(text):
+        deltas = []
+        for _ in range(2):
+            shift = result = 0
+            while True:
+                b = ord(text[index]) - 63
+                index += 1
+                result |= (b & 0x1f) << shift
+                shift += 5
+                if b < 0x20:
+                    break
+            deltas.append(~(result >> 1) if result & 1 else result >> 1)
+        lat += deltas[0]
+        lon += deltas[1]
+        coords.append([lon / factor, lat / factor])
+    return coords
+
+
+def encode_delta(line, precision=DELTA_PRECISION):
+    """Flat ``[x0, y0, dx1, dy1, ...]`` integer list for ``[[lon, lat], ...]``."""
+    factor = 10 ** precision
+    out = []
+    px = py = 0
+    for point in line:
+        x = int(round(point[0] * factor))
+        y = int(round(point[1] * factor))
+        out.append(x - px)
+        out.append(y - py)
+        px, py = x, y
+    return out
+
+
+# ==========================================
+# GEOBUF (protobuf)
+# ==========================================
+_GEOBUF_TYPES = {'Point': 0, 'MultiPoint': 1, 'LineString': 2, 'MultiLineString': 3,
+                 'Polygon': 4, 'MultiPolygon': 5}
+
+
+def _varint(value, out):
+    while value > 0x7f:
+        out.append((value & 0x7f) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def _zigzag(value):
+    return (value << 1) ^ (value >> 63)
+
+
+def _key(field, wire_type, out):
+    _varint((field << 3) | wire_type, out)
+
+
+def _bytes_field(field, payload, out):
+    _key(field, 2, out)
+    _varint(len(payload), out)
+    out += payload
+
+
+def _packed(field, values, out, signed=False):
+    payload = bytearray()
+    for v in values:
+        _varint(_zigzag(v) if signed else v, payload)
+    _bytes_field(field, payload, out)
+
+
+def _geobuf_value(value):
+    out = bytearray()
+    if isinstance(value, bool):
+        _key(5, 0, out)
+        _varint(int(value), out)
+    elif isinstance(value, int):
+        _key(3 if value >= 0 else 4, 0, out)
+        _varint(abs(value), out)
+    elif isinstance(value, float):
+        _key(2, 1, out)
+        out += struct.pack('<d', value)
+    elif isinstance(value, str):
+        _bytes_field(1, value.encode('utf-8'), out)
+    else:
+        _bytes_field(6, json.dumps(value).encode('utf-8'), out)
+    return out
+
+
+def _geobuf_geometry(geometry, factor):
+    out = bytearray()
+    _key(1, 0, out)
+    _varint(_GEOBUF_TYPES[geometry['type']], out)
+    lines = _lines(geometry)
+    if len(lines) != 1:
+        _packed(2, [len(line) for line in lines], out)
+    coords = []
+    for line in lines:
+        px = py = 0
+        for point in line:
+            x = int(round(point[0] * factor))
+            y = int(round(point[1] * factor))
+            coords.append(x - px)
+            coords.append(y - py)
+            px, py = x, y
+    _packed(3, coords, out, signed=True)
+    return out
+
+
+def encode_geobuf(collection, precision=GEOBUF_PRECISION):
+    """Geobuf ``Data`` message for a FeatureCollection of (Multi)LineStrings."""
+    factor = 10 ** precision
+    keys = {}
+    features = bytearray()
+    for f in collection['features']:
+        feature = bytearray()
+        _bytes_field(1, _geobuf_geometry(f['geometry'], factor), feature)
+        props = []
+        for i, (k, v) in enumerate((f.get('properties') or {}).items()):
+            _bytes_field(13, _geobuf_value(v), feature)
+            props += [keys.setdefault(k, len(keys)), i]
+        if props:
+            _packed(14, props, feature)
+        _bytes_field(1, feature, features)
+
+    out = bytearray()
+    for k in keys:
+        _bytes_field(1, k.encode('utf-8'), out)
+    if precision != 6:
+        _key(3, 0, out)
+        _varint(precision, out)
+    _bytes_field(4, features, out)
+    return bytes(out)
@@ -1,12 +1,17 @@
 import os
+import sys
 import math
-import heapq
 import json
-from flask import Flask, jsonify, request
+from flask import Flask, jsonify, request, make_response
 from flask_sqlalchemy import SQLAlchemy
 from sqlalchemy import or_
 from flask_cors import CORS
 
+# Shared graph code lives next to main.py in the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from railway_graph import CompiledGraph, GraphManager, GraphWarmingError, snapshot_or_build, tolerance_for_zoom
+from trace_geometry import FORMATS, encode_trace, negotiate_format
+
 # --- USER IMPORTS (Assumed to exist in the target environment) ---
 # from src.samenstelling import get_train_composition
 # from src.lijn import get_lijnsectie_from_to, get_ptcarid_from_name, get_neighbouring_stations, get_location_from_station_name
@@ -24,8 +29,10 @@ app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get(
 )
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 
+# Graph snapshot shared by the gunicorn workers: the first one builds it, the rest mmap it
+GRAPH_SNAPSHOT_PATH = os.environ.get('GRAPH_SNAPSHOT_PATH', 'railway_graph_trace.snap')
+
 db = SQLAlchemy(app)
-RAILWAY_GRAPH = {}
 
 # ==========================================
 # MODELS (New Tracing)
@@ -115,80 +122,75 @@ def get_infrabel_id(sncb_stop_id, stop_name=None):
             
     return None
 
+def compile_railway_graph():
+    with app.app_context():
+        print("🛠️  Building railway graph...")
+        coords = {op.id: (op.latitude, op.longitude)
+                  for op in InfrabelOperationalPoint.query.all() if op.latitude and op.longitude}
+        segments = InfrabelStationToStation.query.all()
+        edges = []
+        segment_lengths = {}
+        geometries = {}
+        for seg in segments:
+            u, v, w = seg.stationfrom_id, seg.stationto_id, seg.length
+            if w is None: w = 1.0 
+            edges.append((u, v, w, seg.id))
+            segment_lengths[seg.id] = seg.length
+            geometries[seg.id] = seg.geom_wkt
+        
+        # --- VIRTUAL EXTREME FIX FOR AIRPORT (FBNL) ---
+        # Ensure connectivity to avoiding reversals
+        # FBNL = Brussels Airport Zaventem
+        # FN   = Brussels North
+        # FM   = Mechelen 
+        # FL   = Leuven
+        virtual_edges = [
+            ('FBNL', 'FM', 0.1, 'V_FBNL_FM'),
+            ('FBNL', 'FN', 0.1, 'V_FBNL_FN'),
+            ('FBNL', 'FLV', 0.1, 'V_FBNL_FLV')
+        ]
+        # Dijkstra handles multiple edges fine, picks cheapest.
+        # We give these favorable weights (approx straight line).
+        edges.extend(virtual_edges)
+
+        graph = CompiledGraph.from_edges(edges, segment_lengths, coords, geometries=geometries)
+        print(f"✅ Graph built with {len(graph)} nodes (incl. Virtual Airport Links).")
+        return graph
+
+def graph_source_stamp():
+    with app.app_context():
+        seg_count, seg_max, seg_len = db.session.query(
+            db.func.count(InfrabelStationToStation.id),
+            db.func.max(InfrabelStationToStation.id),
+            db.func.sum(InfrabelStationToStation.length)).one()
+        op_count = db.session.query(db.func.count(InfrabelOperationalPoint.id)).scalar()
+    return f"trace:r3:{seg_count}:{seg_max}:{seg_len or 0:.6f}:{op_count}"
+
+def load_railway_graph():
+    if not GRAPH_SNAPSHOT_PATH:
+        return compile_railway_graph()
+    return snapshot_or_build(GRAPH_SNAPSHOT_PATH, graph_source_stamp(), compile_railway_graph)
+
+GRAPH_MANAGER = GraphManager(load_railway_graph)
+
 def build_railway_graph():
-    global RAILWAY_GRAPH
-    try:
-        with app.app_context():
-            print("🛠️  Building railway graph...")
-            segments = InfrabelStationToStation.query.all()
-            new_graph = {}
-            for seg in segments:
-                u, v, w = seg.stationfrom_id, seg.stationto_id, seg.length
-                if w is None: w = 1.0 
-                if u not in new_graph: new_graph[u] = []
-                if v not in new_graph: new_graph[v] = []
-                new_graph[u].append((v, w, seg.id))
-                new_graph[v].append((u, w, seg.id))
-            
-            # --- VIRTUAL EXTREME FIX FOR AIRPORT (FBNL) ---
-            # Ensure connectivity to avoiding reversals
-            # FBNL = Brussels Airport Zaventem
-            # FN   = Brussels North
-            # FM   = Mechelen 
-            # FL   = Leuven
-            virtual_edges = [
-                ('FBNL', 'FM', 0.1, 'V_FBNL_FM'),
-                ('FBNL', 'FN', 0.1, 'V_FBNL_FN'),
-                ('FBNL', 'FLV', 0.1, 'V_FBNL_FLV')
-            ]
-            for u, v, w, vid in virtual_edges:
-                if u not in new_graph: new_graph[u] = []
-                if v not in new_graph: new_graph[v] = []
-                # Check if edge already exists to avoid duplicates? 
-                # Dijkstra handles multiple edges fine, picks cheapest.
-                # We give these favorable weights (approx straight line).
-                new_graph[u].append((v, w, vid))
-                new_graph[v].append((u, w, vid))
-
-            RAILWAY_GRAPH = new_graph
-            print(f"✅ Graph built with {len(RAILWAY_GRAPH)} nodes (incl. Virtual Airport Links).")
-    except Exception as e:
-        print(f"⚠️ Error building graph: {e}")
+    return GRAPH_MANAGER.rebuild()
 
-def find_path(start_node, end_node):
-    if not RAILWAY_GRAPH: return None
-    if start_node == end_node: return []
-    if start_node not in RAILWAY_GRAPH or end_node not in RAILWAY_GRAPH: return None
-    
-    queue = [(0, start_node, [])]
-    visited = {}
-    
-    while queue:
-        (cost, node, path_segments) = heapq.heappop(queue)
-        
-        if node in visited and visited[node] <= cost:
-            continue
-        visited[node] = cost
-        
-        if node == end_node:
-            return path_segments
-            
-        for (neighbor, weight, seg_id) in RAILWAY_GRAPH.get(node, []):
-            if neighbor not in visited or visited[neighbor] > cost + weight:
-                heapq.heappush(queue, (cost + weight, neighbor, path_segments + [seg_id]))
-                
-    return None
+def find_path(start_node, end_node, graph=None):
+    if graph is None: graph = GRAPH_MANAGER.require()
+    return graph.shortest_path(start_node, end_node)
 
 def get_pt_coords(pt_id):
+    graph = GRAPH_MANAGER.graph
+    if graph is not None and pt_id in graph:
+        return graph.node_coords(pt_id)
     op = InfrabelOperationalPoint.query.filter_by(id=pt_id).first()
     if op and op.latitude and op.longitude:
         return [float(op.longitude), float(op.latitude)]
     return None
 
-def get_trace_geometry(train_id, start_stop_id=None, end_stop_id=None):
-    global RAILWAY_GRAPH
-    if not RAILWAY_GRAPH:
-        build_railway_graph()
+def get_trace_geometry(train_id, start_stop_id=None, end_stop_id=None, tolerance=0.0):
+    graph = GRAPH_MANAGER.require()
         
     stops = TrainStop.query.filter_by(train_id=train_id).order_by(TrainStop.stop_sequence).all()
     if not stops: return None
@@ -209,14 +211,14 @@ def get_trace_geometry(train_id, start_stop_id=None, end_stop_id=None):
     resolved_stops = []
     for s in stops:
         inf_id = get_infrabel_id(s.stop_id, s.stop_name)
-        if inf_id and inf_id in RAILWAY_GRAPH: 
+        if inf_id and inf_id in graph: 
             resolved_stops.append({"inf_id": inf_id, "stop": s})
 
     for i in range(len(resolved_stops) - 1):
         id1 = resolved_stops[i]["inf_id"]
         id2 = resolved_stops[i+1]["inf_id"]
         
-        path_seg_ids = find_path(id1, id2)
+        path_seg_ids = find_path(id1, id2, graph=graph)
         if path_seg_ids:
             for seg_id in path_seg_ids:
                 # Handle Virtual Edges
@@ -239,16 +241,14 @@ def get_trace_geometry(train_id, start_stop_id=None, end_stop_id=None):
                         continue
                     continue
 
-                seg = db.session.get(InfrabelStationToStation, seg_id)
-                if seg:
-                    try:
-                        geom = json.loads(seg.geom_wkt)
-                        features.append({
-                            "type": "Feature",
-                            "geometry": geom,
-                            "properties": { "from_id": seg.stationfrom_id, "to_id": seg.stationto_id }
-                        })
-                    except: continue
+                geom = graph.segment_geometry(seg_id, tolerance)
+                if geom:
+                    u, v = graph.segment_endpoints(seg_id)
+                    features.append({
+                        "type": "Feature",
+                        "geometry": geom,
+                        "properties": { "from_id": u, "to_id": v }
+                    })
         else:
             p1 = get_pt_coords(id1)
             p2 = get_pt_coords(id2)
@@ -369,13 +369,27 @@ def api_trace(train_id):
     """
     Returns the visual geometry (trace) for a train, using the PostGIS/internal graph logic.
     """
+    fmt = negotiate_format(request.args, request.accept_mimetypes)
+    if fmt is None:
+        return jsonify({"error": f"Unknown format, use one of: {', '.join(FORMATS)}"}), 400
     start_stop = request.args.get('start')
     end_stop = request.args.get('end')
+    # Simplification in metres, or derived from the map zoom level
+    tolerance = request.args.get('tolerance', type=float)
+    if tolerance is None:
+        zoom = request.args.get('zoom', type=float)
+        tolerance = tolerance_for_zoom(zoom) if zoom is not None else 0.0
     try:
-        geom = get_trace_geometry(train_id, start_stop, end_stop)
+        geom = get_trace_geometry(train_id, start_stop, end_stop, max(tolerance, 0.0))
         if geom:
-            return jsonify(geom)
+            body, mimetype = encode_trace(geom, fmt)
+            response = make_response(body)
+            response.mimetype = mimetype
+            response.vary.add('Accept')
+            return response
         return jsonify({"error": "No trace data"}), 404
+    except GraphWarmingError as e:
+        return jsonify({"error": str(e), "warming": True}), 503, {'Retry-After': '5'}
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
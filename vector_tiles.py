@@ -0,0 +1,281 @@
+"""Mapbox Vector Tiles (MVT) for the railway network, built from the compiled graph.
+
+Tiles use the usual web-mercator z/x/y scheme. Segment lines come from the
+graph's precomputed geometry levels (the level is picked from the zoom), are
+projected to tile coordinates, clipped to the tile plus a small buffer and
+written as protobuf by hand (spec 2.1), so no tile library is needed. The
+segments of a tile are picked with one vectorized comparison against the
+per-level bounding boxes the graph keeps next to the coordinates.
+"""
+import math
+import os
+import shutil
+import struct
+
+import numpy as np
+
+from railway_graph import tolerance_for_zoom
+
+EXTENT = 4096
+BUFFER = 64
+MAX_ZOOM = 20
+MIMETYPE = 'application/vnd.mapbox-vector-tile'
+
+
+def valid_tile(z, x, y):
+    return 0 <= z <= MAX_ZOOM and 0 <= x < 2 ** z and 0 <= y < 2 ** z
+
+
+def tile_bounds(z, x, y):
+    """(min_lon, min_lat, max_lon, max_lat) of a tile."""
+    n = 2 ** z
+
+    def lat(ty):
+        return math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * ty / n))))
+
+    return x / n * 360.0 - 180.0, lat(y + 1), (x + 1) / n * 360.0 - 180.0, lat(y)
+
+
+def _projector(z, x, y):
+    scale = (2 ** z) * EXTENT
+
+    def project(lon, lat):
+        lat = max(min(lat, 85.0511), -85.0511)
+        s = math.sin(math.radians(lat))
+        px = (lon + 180.0) / 360.0 * scale - x * EXTENT
+        py = (0.5 - math.log((1 + s) / (1 - s)) / (4 * math.pi)) * scale - y * EXTENT
+        return px, py
+
+    return project
+
+
+def _clip_line(points, lo, hi):
+    """Liang-Barsky clip of a polyline to the square [lo, hi]; returns the inside pieces."""
+    pieces = []
+    current = []
+    for (x0, y0), (x1, y1) in zip(points, points[1:]):
+        dx, dy = x1 - x0, y1 - y0
+        t0, t1 = 0.0, 1.0
+        inside = True
+        for p, q in ((-dx, x0 - lo), (dx, hi - x0), (-dy, y0 - lo), (dy, hi - y0)):
+            if p == 0:
+                if q < 0:
+                    inside = False
+                    break
+            else:
+                r = q / p
+                if p < 0:
+                    if r > t1:
+                        inside = False
+                        break
+                    t0 = max(t0, r)
+                else:
+                    if r < t0:
+                        inside = False
+                        break
+                    t1 = min(t1, r)
+        if not inside:
+            if len(current) > 1:
+                pieces.append(current)
+            current = []
+            continue
+        a = (x0 + t0 * dx, y0 + t0 * dy)
+        b = (x0 + t1 * dx, y0 + t1 * dy)
+        if not current:
+            current = [a]
+        current.append(b)
+        if t1 < 1.0:
+            pieces.append(current)
+            current = []
+    if len(current) > 1:
+        pieces.append(current)
+    return pieces
+
+
+def _tile_lines(parts, project):
+    lines = []
+    for part in parts:
+        projected = [project(lon, lat) for lon, lat in part]
+        for piece in _clip_line(projected, -BUFFER, EXTENT + BUFFER):
+            line = []
+            for px, py in piece:
+                pt = (int(round(px)), int(round(py)))
+                if not line or line[-1] != pt:
+                    line.append(pt)
+            if len(line) > 1:
+                lines.append(line)
+    return lines
+
+
+def visible_segments(store, bounds):
+    """Indices of the segments of a SegmentGeometries level whose bounding box meets ``bounds``."""
+    boxes = np.frombuffer(store.bboxes, dtype=np.float64).reshape(-1, 4)
+    min_lon, min_lat, max_lon, max_lat = bounds
+    # NaN boxes (no geometry) compare False and drop out
+    hit = (boxes[:, 0] <= max_lon) & (boxes[:, 2] >= min_lon) & (boxes[:, 1] <= max_lat) & (boxes[:, 3] >= min_lat)
+    return np.flatnonzero(hit)
+
+
+def segment_features(graph, z, x, y, segment_filter=None):
+    """(id, lines, properties) per segment of ``graph`` that is visible in the tile."""
+    store = graph.geometry_level(tolerance_for_zoom(z))
+    min_lon, min_lat, max_lon, max_lat = tile_bounds(z, x, y)
+    pad_lon = (max_lon - min_lon) * BUFFER / EXTENT
+    pad_lat = (max_lat - min_lat) * BUFFER / EXTENT
+    visible = visible_segments(store, (min_lon - pad_lon, min_lat - pad_lat, max_lon + pad_lon, max_lat + pad_lat))
+    if segment_filter is not None:
+        wanted = [graph.segment_index[s] for s in segment_filter if s in graph.segment_index]
+        visible = np.intersect1d(visible, np.asarray(wanted, dtype=np.intp))
+    project = _projector(z, x, y)
+
+    features = []
+    for si in visible.tolist():
+        lines = _tile_lines(store.parts(si), project)
+        if lines:
+            seg_id = graph.segment_ids[si]
+            u, v = graph.segment_ends[si]
+            features.append((seg_id, lines, {"segment_id": seg_id, "from_id": u, "to_id": v}))
+    return features
+
+
+# ==========================================
+# PROTOBUF
+# ==========================================
+def _varint(value, out):
+    while value > 0x7f:
+        out.append((value & 0x7f) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def _bytes_field(field, payload, out):
+    _varint((field << 3) | 2, out)
+    _varint(len(payload), out)
+    out += payload
+
+
+def _zigzag(n):
+    return (n << 1) ^ (n >> 31)
+
+
+def _value(value):
+    out = bytearray()
+    if isinstance(value, bool):
+        out += bytes([7 << 3])
+        _varint(int(value), out)
+    elif isinstance(value, int) and value >= 0:
+        out += bytes([5 << 3])
+        _varint(value, out)
+    elif isinstance(value, int):
+        out += bytes([6 << 3])
+        _varint((value << 1) ^ (value >> 63), out)
+    elif isinstance(value, float):
+        out += bytes([(3 << 3) | 1]) + struct.pack('<d', value)
+    else:
+        _bytes_field(1, str(value).encode('utf-8'), out)
+    return out
+
+
+def _geometry(lines):
+    cmds = []
+    cx = cy = 0
+    for line in lines:
+        x, y = line[0]
+        cmds += [(1 << 3) | 1, _zigzag(x - cx), _zigzag(y - cy)]
+        cx, cy = x, y
+        cmds.append(((len(line) - 1) << 3) | 2)
+        for x, y in line[1:]:
+            cmds += [_zigzag(x - cx), _zigzag(y - cy)]
+            cx, cy = x, y
+    return cmds
+
+
+def encode_layer(name, features):
+    """Layer message for ``(id, lines, properties)`` line features."""
+    keys, values = {}, {}
+    body = bytearray()
+    for fid, lines, props in features:
+        feature = bytearray()
+        if isinstance(fid, int) and fid >= 0:
+            feature += bytes([1 << 3])
+            _varint(fid, feature)
+        tags = []
+        for k, v in props.items():
+            if v is None:
+                continue
+            tags.append(keys.setdefault(k, len(keys)))
+            tags.append(values.setdefault((type(v).__name__, v), len(values)))
+        packed = bytearray()
+        for t in tags:
+            _varint(t, packed)
+        _bytes_field(2, packed, feature)
+        feature += bytes([3 << 3, 2])  # GeomType LINESTRING
+        packed = bytearray()
+        for c in _geometry(lines):
+            _varint(c, packed)
+        _bytes_field(4, packed, feature)
+        _bytes_field(2, feature, body)
+
+    layer = bytearray()
+    layer += bytes([15 << 3, 2])  # version 2
+    _bytes_field(1, name.encode('utf-8'), layer)
+    layer += body
+    for k in keys:
+        _bytes_field(3, k.encode('utf-8'), layer)
+    for _, v in values:
+        _bytes_field(4, _value(v), layer)
+    layer += bytes([5 << 3])
+    _varint(EXTENT, layer)
+    return bytes(layer)
+
+
+def encode_tile(layers):
+    """Tile message for ``{layer_name: features}``; layers without features are left out."""
+    out = bytearray()
+    for name, features in layers.items():
+        if features:
+            _bytes_field(3, encode_layer(name, features), out)
+    return bytes(out)
+
+
+# ==========================================
+# DISK CACHE
+# ==========================================
+class TileCache:
+    """Tiles on disk under ``<root>/<graph version>/<layer>/<z>/<x>/<y>.mvt``."""
+
+    def __init__(self, root):
+        self.root = root
+
+    def _path(self, version, layer, z, x, y):
+        return os.path.join(self.root, version, layer, str(z), str(x), f"{y}.mvt")
+
+    def get(self, version, layer, z, x, y):
+        if not self.root:
+            return None
+        try:
+            with open(self._path(version, layer, z, x, y), 'rb') as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def put(self, version, layer, z, x, y, data):
+        if not self.root:
+            return
+        path = self._path(version, layer, z, x, y)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp = f"{path}.{os.getpid()}.tmp"
+            with open(tmp, 'wb') as f:
+                f.write(data)
+            os.replace(tmp, path)
+        except OSError as e:
+            print(f"⚠️ Could not cache tile {path}: {e}")
+
+    def prune(self, keep_version):
+        """Removes the tiles of every graph version except ``keep_version``."""
+        if not self.root or not os.path.isdir(self.root):
+            return
+        for name in os.listdir(self.root):
+            if name != keep_version:
+                shutil.rmtree(os.path.join(self.root, name), ignore_errors=True)